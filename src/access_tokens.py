@@ -0,0 +1,133 @@
+import os
+import json
+import time
+import threading
+import collections
+import concurrent.futures
+
+import storage
+from utils import redis_client
+
+
+class AccessTokens:
+    """Slack access tokens for each team
+
+    Tokens are kept in the oauth bucket, redis holds them for `redis_ttl` and
+    each worker for `local_ttl` on top of that, so most lookups never leave
+    the process. When a team misses in both, only the first caller loads it
+    and everyone else asking for the same team waits on that one load.
+    """
+
+    prefix = 'slack-token:'
+
+    def __init__(self, client, local_ttl=300, redis_ttl=24 * 60 * 60, max_teams=1000, load_timeout=10):
+        self.client = client
+        self.local_ttl = local_ttl
+        self.redis_ttl = redis_ttl
+        self.max_teams = max_teams
+        self.load_timeout = load_timeout
+        self._lock = threading.Lock()
+        # team id -> (expires at, token), least recently used first
+        self._local = collections.OrderedDict()
+        # team id -> future of the load in progress
+        self._loading = {}
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.storage_loads = 0
+        self.coalesced = 0
+        self.invalidations = 0
+
+    def key(self, team_id):
+        return f"{self.prefix}{team_id}"
+
+    def _keep(self, team_id, token):
+        with self._lock:
+            self._local.pop(team_id, None)
+            self._local[team_id] = (time.monotonic() + self.local_ttl, token)
+            while len(self._local) > self.max_teams:
+                self._local.popitem(last=False)
+
+    def _load(self, team_id):
+        token = self.client.get(self.key(team_id))
+        if token is not None:
+            with self._lock:
+                self.redis_hits += 1
+            return token.decode('utf-8')
+
+        file_content = storage.get(os.environ['OAUTH_BUCKET'], f"slack/{team_id}.json")
+        token = json.loads(file_content.decode('utf-8'))['access_token']
+        self.client.set(self.key(team_id), token, ex=self.redis_ttl)
+        with self._lock:
+            self.storage_loads += 1
+        return token
+
+    def _get_local(self, team_id):
+        # Called holding the lock
+        expires, token = self._local.get(team_id, (0, None))
+        if expires > time.monotonic():
+            self._local.move_to_end(team_id)
+            self.local_hits += 1
+            return token
+        return None
+
+    def get_cached(self, team_id):
+        """The token if this worker has it, None rather than going to redis or storage"""
+        with self._lock:
+            return self._get_local(team_id)
+
+    def get(self, team_id):
+        with self._lock:
+            token = self._get_local(team_id)
+            if token is not None:
+                return token
+
+            future = self._loading.get(team_id)
+            loading = future is None
+            if loading:
+                future = self._loading[team_id] = concurrent.futures.Future()
+            else:
+                self.coalesced += 1
+
+        if not loading:
+            return future.result(timeout=self.load_timeout)
+
+        try:
+            token = self._load(team_id)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            self._keep(team_id, token)
+            future.set_result(token)
+            return token
+        finally:
+            with self._lock:
+                del self._loading[team_id]
+
+    def set(self, team_id, token):
+        """Save a team's new token to redis, replacing any this worker has kept"""
+        self.client.set(self.key(team_id), token, ex=self.redis_ttl)
+        self._keep(team_id, token)
+
+    def invalidate(self, team_id):
+        """Forget the team's token, i.e. slack says it is no longer valid"""
+        with self._lock:
+            self._local.pop(team_id, None)
+            self.invalidations += 1
+        self.client.delete(self.key(team_id))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'teams': len(self._local),
+                'local_hits': self.local_hits,
+                'redis_hits': self.redis_hits,
+                'storage_loads': self.storage_loads,
+                'coalesced': self.coalesced,
+                'invalidations': self.invalidations,
+            }
+
+
+access_tokens = AccessTokens(redis_client,
+                             local_ttl=float(os.getenv('ACCESS_TOKEN_LOCAL_TTL', 300)),
+                             redis_ttl=int(os.getenv('ACCESS_TOKEN_TTL', 24 * 60 * 60)))
@@ -0,0 +1,352 @@
+"""ASGI version of `server`, run from the `src` folder with `uvicorn asgi_server:app`
+
+Button clicks are played on the event loop. Redis is used through an asyncio
+client and slack through `slack_client.AsyncSlackClient`, so one process can have
+hundreds of clicks waiting on the network at once. Rendering, and storage
+(boto3 has no asyncio client), still block so they run in a thread pool.
+Slash commands and oauth are the WSGI resources run in that same pool.
+"""
+import io
+import os
+import json
+import time
+import types
+import asyncio
+import logging
+import functools
+import collections
+import urllib.parse
+import concurrent.futures
+
+import falcon
+import falcon.asgi
+import redis.asyncio
+
+import game_codec
+import server
+import connect4.endpoints as connect4_endpoints
+import connect4.utils as connect4_utils
+import mastermind.endpoints as mastermind_endpoints
+from access_tokens import access_tokens
+from delete_queue import delete_queue
+from game_store import AsyncGameStore, GameConflict, MOVE_NOT_APPLIED, game_store
+from local_files import LocalFiles, get_local_files
+from move_queue import MOVE_BUSY
+from slack_client import AsyncSlackClient, env_settings
+
+logging.getLogger('httpx').setLevel(logging.WARNING)
+logger = logging.getLogger(__name__)
+
+blocking = concurrent.futures.ThreadPoolExecutor(max_workers=int(os.getenv('ASGI_THREADS', 32)),
+                                                 thread_name_prefix='asgi-blocking')
+
+# Moves wait for a free connection rather than opening one each
+async_redis_client = redis.asyncio.Redis(connection_pool=redis.asyncio.BlockingConnectionPool(
+    host=os.getenv('REDIS_HOST', 'localhost'),
+    password=os.getenv('REDIS_PASSWORD', ''),
+    max_connections=int(os.getenv('ASGI_REDIS_CONNECTIONS', 64)),
+))
+async_game_store = AsyncGameStore(async_redis_client, hot_games=game_store.hot_games, ttl=game_store.ttl)
+
+async_slack_client = AsyncSlackClient(**env_settings())
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Run a blocking call (rendering, storage, sync redis) in the thread pool"""
+    return await asyncio.get_running_loop().run_in_executor(blocking, functools.partial(func, *args, **kwargs))
+
+
+class MoveTasks:
+    """Play moves as tasks on the event loop, one at a time for each game
+
+    Same as `move_queue.MoveQueue` for the WSGI app. Once `max_pending` moves
+    are waiting new ones are turned away, never played out of turn.
+    """
+
+    def __init__(self, max_pending=1000):
+        self.max_pending = max_pending
+        # game id -> [lock, moves waiting on it]
+        self._games = {}
+        self._tasks = set()
+        self.queued = 0
+        self.rejected = 0
+        self.processed = 0
+        self.failed = 0
+        # Recent (seconds waiting, seconds running)
+        self.timings = collections.deque(maxlen=200)
+
+    async def _play(self, game_id, move, args, submitted):
+        game = self._games.setdefault(game_id, [asyncio.Lock(), 0])
+        game[1] += 1
+        try:
+            async with game[0]:
+                started = time.time()
+                try:
+                    await move(*args)
+                except Exception:
+                    logger.exception("Failed playing move", extra={'move': move.__name__})
+                    self.failed += 1
+                self.processed += 1
+                self.timings.append((started - submitted, time.time() - started))
+        finally:
+            game[1] -= 1
+            if game[1] == 0:
+                del self._games[game_id]
+
+    async def submit(self, game_id, move, *args):
+        """Play `await move(*args)` after any moves already waiting on the game
+
+        Returns:
+            bool: If the move was queued, False if too many are waiting
+                and the player should be told to try again (see `MOVE_BUSY`)
+        """
+        submitted = time.time()
+        if len(self._tasks) >= self.max_pending:
+            logger.warning("Too many moves waiting, turning move away", extra={'game_id': game_id})
+            self.rejected += 1
+            return False
+
+        task = asyncio.create_task(self._play(game_id, move, args, submitted))
+        # The loop only keeps weak references to tasks
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        self.queued += 1
+        return True
+
+    async def join(self):
+        """Wait for every queued move to be played"""
+        while self._tasks:
+            await asyncio.gather(*self._tasks)
+
+    def stats(self):
+        wait_times = [t[0] for t in self.timings]
+        run_times = [t[1] for t in self.timings]
+        return {
+            'pending': len(self._tasks),
+            'max_pending': self.max_pending,
+            'queued': self.queued,
+            'rejected': self.rejected,
+            'processed': self.processed,
+            'failed': self.failed,
+            'avg_wait_ms': round(sum(wait_times) / len(wait_times) * 1000, 3) if wait_times else 0,
+            'avg_move_ms': round(sum(run_times) / len(run_times) * 1000, 3) if run_times else 0,
+        }
+
+
+move_tasks = MoveTasks(max_pending=int(os.getenv('ASGI_MAX_MOVES', 1000)))
+
+
+async def update_message(action_details, game_id, game_name):
+    """Post the updated game message to slack
+
+    Returns:
+        bool: If slack took the update
+    """
+    r = await async_slack_client.post(action_details['response_url'], team_id=action_details['team']['id'],
+                                      json=action_details['message'])
+    if r.json().get('ok') is True:
+        return True
+    logger.error(f"Updating {game_name} failed",
+                 extra={'game_id': game_id,
+                        'platform': 'slack',
+                        'blocks': action_details['message']['blocks'],
+                        'response': r.text})
+    return False
+
+
+async def move_not_applied(action_details):
+    """Tell just the player who clicked that another click changed the game first"""
+    await async_slack_client.post(action_details['response_url'], team_id=action_details['team']['id'],
+                                  json=MOVE_NOT_APPLIED)
+
+
+async def revert_move(game_id, previous_state, version, board_url):
+    """Only keep the move if the players can see it"""
+    try:
+        await async_game_store.save_state(game_id, previous_state, version)
+    except GameConflict:
+        pass
+    else:
+        await run_blocking(delete_queue.push, board_url)
+
+
+async def post_recap(game, action_details):
+    recap_url = await run_blocking(game.game_over)
+    team_id = action_details['team']['id']
+    for _ in range(2):
+        # Only go to the thread pool when the token has to come from redis or storage
+        token = access_tokens.get_cached(team_id) or await run_blocking(access_tokens.get, team_id)
+        r = await async_slack_client.api('chat.postMessage',
+                                         team_id=team_id,
+                                         token=token,
+                                         json=connect4_utils.recap_message(recap_url, action_details))
+        if r.json().get('error') not in connect4_utils.INVALID_TOKEN_ERRORS:
+            break
+        # Reinstalled since this worker got the token, load the new one
+        await run_blocking(access_tokens.invalidate, team_id)
+    if r.json().get('ok') is False:
+        logger.error("Failed sending the recap", extra={'game_id': game.game_id, 'response': r.text})
+
+
+async def connect4_move(action_details):
+    """Same as `connect4.endpoints.slack_connect4_move`"""
+    blocks = action_details['message']['blocks']
+
+    game_id = blocks[0]['block_id']
+    current_game, version = await async_game_store.load(game_id)
+    if current_game is None:
+        # Game is already over
+        return
+    # To put back if slack does not take the update
+    previous_state = game_codec.encode(current_game)
+    played = await run_blocking(connect4_endpoints.play_move, current_game, action_details)
+    if played is None:
+        return
+    board_url, game_state = played
+
+    try:
+        if game_state is not None:
+            await async_game_store.finish(game_id, version)
+        else:
+            version = await async_game_store.save(current_game, version)
+    except GameConflict:
+        # Another click got there first, this board will never be shown
+        await run_blocking(delete_queue.push, board_url)
+        await move_not_applied(action_details)
+        return
+
+    if game_state is not None:
+        # Recap is posted in the game's thread whenever it is ready
+        await move_tasks.submit(f"{game_id}-recap", post_recap, current_game, action_details)
+
+    connect4_endpoints.update_move_blocks(blocks, current_game, board_url, game_state)
+    if not await update_message(action_details, game_id, 'connect4') and game_state is None:
+        await revert_move(game_id, previous_state, version, board_url)
+
+
+async def mastermind_move(action_details):
+    """Same as `mastermind.endpoints.slack_mastermind_move`"""
+    blocks = action_details['message']['blocks']
+
+    game_id = blocks[0]['block_id']
+    current_game, version = await async_game_store.load(game_id)
+    if current_game is None:
+        return
+
+    if action_details['user']['id'] != current_game.player_id:
+        return
+
+    # To put back if slack does not take the update
+    previous_state = game_codec.encode(current_game)
+    previous_board_url = blocks[1]['image_url']
+    board_url, game_state = await run_blocking(mastermind_endpoints.play_move, current_game, blocks, action_details)
+    if board_url is not None:
+        try:
+            if game_state is not None:
+                # Nothing more can be done with a finished game
+                await async_game_store.finish(game_id, version)
+            else:
+                version = await async_game_store.save(current_game, version)
+        except GameConflict:
+            # Another click got there first, this board will never be shown
+            await run_blocking(delete_queue.push, board_url)
+            await move_not_applied(action_details)
+            return
+        if game_state is not None:
+            # Only now that this move is the one that ended the game
+            await run_blocking(current_game.save_history)
+
+    mastermind_endpoints.update_move_blocks(blocks, current_game, board_url, game_state)
+
+    if await update_message(action_details, game_id, 'mastermind'):
+        if board_url is not None:
+            # Delete previous game board once slack has had time to fetch the new one
+            await run_blocking(delete_queue.push, previous_board_url)
+    elif board_url is not None and game_state is None:
+        await revert_move(game_id, previous_state, version, board_url)
+
+
+class SlackInteractive:
+    async def on_post(self, req, resp):
+        data = urllib.parse.unquote((await req.stream.read()).decode('utf-8'))
+        action_details = json.loads(data.replace('payload=', ''))
+        if action_details['actions'][0]['action_id'].startswith('connect4-move'):
+            move = connect4_move
+        elif action_details['actions'][0]['action_id'].startswith('mastermind-move'):
+            move = mastermind_move
+        else:
+            return
+        if not await move_tasks.submit(action_details['message']['blocks'][0]['block_id'], move, action_details):
+            await async_slack_client.post(action_details['response_url'], team_id=action_details['team']['id'],
+                                          json=MOVE_BUSY)
+
+
+class Threaded:
+    """Run a resource of the WSGI app in the thread pool"""
+
+    def __init__(self, resource):
+        self.resource = resource
+
+    async def _respond(self, method, req, resp):
+        responder = getattr(self.resource, method, None)
+        if responder is None:
+            raise falcon.HTTPMethodNotAllowed([m[3:].upper() for m in ('on_get', 'on_post')
+                                               if hasattr(self.resource, m)])
+        # Only what the WSGI resources use
+        sync_req = types.SimpleNamespace(stream=io.BytesIO(await req.stream.read()), params=req.params)
+        sync_resp = types.SimpleNamespace(media=None, body=None, status=falcon.HTTP_200)
+        await run_blocking(responder, sync_req, sync_resp)
+
+        resp.status = sync_resp.status
+        if sync_resp.media is not None:
+            resp.media = sync_resp.media
+        elif sync_resp.body is not None:
+            resp.text = sync_resp.body
+
+    async def on_get(self, req, resp):
+        await self._respond('on_get', req, resp)
+
+    async def on_post(self, req, resp):
+        await self._respond('on_post', req, resp)
+
+
+class Healthcheck:
+    async def on_get(self, req, resp):
+        resp.media = {'success': True}
+
+
+class Stats:
+    async def on_get(self, req, resp):
+        stats = await run_blocking(server.get_stats)
+        stats['move_tasks'] = move_tasks.stats()
+        stats['async_game_store'] = async_game_store.stats()
+        stats['async_slack_client'] = async_slack_client.stats()
+        resp.media = stats
+
+
+class Shutdown:
+    async def process_shutdown(self, scope, event):
+        await move_tasks.join()
+        await async_slack_client.aclose()
+        await async_redis_client.aclose()
+        blocking.shutdown(wait=False)
+
+
+def add_local_files(app):
+    files = get_local_files()
+    if files is not None:
+        async def sink(req, resp, bucket, key):
+            await run_blocking(files, req, resp, bucket, key)
+        app.add_sink(sink, prefix=LocalFiles.prefix)
+
+
+app = falcon.asgi.App(middleware=[Shutdown()])
+app.add_route('/healthcheck', Healthcheck())
+app.add_route('/stats', Stats())
+add_local_files(app)
+
+app.add_route('/slack/breakroom', Threaded(server.BreakRoom()))
+app.add_route('/slack/oauth', Threaded(connect4_endpoints.SlackOAuth()))
+app.add_route('/slack/interactive', SlackInteractive())
+app.add_route('/slack/connect4', Threaded(connect4_endpoints.SlackConnect4()))
+app.add_route('/slack/mastermind', Threaded(mastermind_endpoints.SlackMastermind()))
@@ -0,0 +1,147 @@
+import os
+import threading
+import collections
+from PIL import Image
+from PIL import ImageFont
+
+from theme_bundle import load_bundle
+
+
+class ThemeAssets:
+    """Decoded images, resized variants, fonts and templates for a single (game, theme)
+
+    Images handed out are shared between renders, so callers must `.copy()`
+    anything they are going to draw onto.
+    """
+
+    def __init__(self, cache, game, theme=None):
+        self._cache = cache
+        self.game = game
+        self.theme = theme
+        self._images = {}
+        self._resized = {}
+        self._fonts = {}
+        self._rendered = {}
+
+    def path(self, name):
+        return os.path.join(self.game, 'assets', self.theme or '', name)
+
+    def image(self, name):
+        with self._cache.lock:
+            if name in self._images:
+                self._cache.hits += 1
+                img = self._images[name]
+            else:
+                self._cache.misses += 1
+                img = self._cache.bundle and self._cache.bundle.image(self.game, self.theme, name)
+                if img is None:
+                    try:
+                        img = Image.open(self.path(name)).convert('RGBA')
+                    except FileNotFoundError:
+                        # Remember optional assets that the theme does not have
+                        img = None
+                self._images[name] = img
+
+        if img is None:
+            raise FileNotFoundError(self.path(name))
+        return img
+
+    def resized(self, name, size):
+        key = (name, size)
+        with self._cache.lock:
+            if key in self._resized:
+                self._cache.hits += 1
+                return self._resized[key]
+
+        img = self._cache.bundle and self._cache.bundle.resized(self.game, self.theme, name, size)
+        if img is None:
+            img = self.image(name).resize(size, Image.LANCZOS)
+        with self._cache.lock:
+            self._cache.misses += 1
+            self._resized[key] = img
+        return img
+
+    def memoize(self, key, render):
+        """Keep anything built only from this themes assets, i.e. empty board templates"""
+        with self._cache.lock:
+            if key in self._rendered:
+                self._cache.hits += 1
+                return self._rendered[key]
+
+        img = render()
+        with self._cache.lock:
+            self._cache.misses += 1
+            self._rendered[key] = img
+        return img
+
+    def font(self, font_file, size):
+        key = (font_file, size)
+        with self._cache.lock:
+            if key not in self._fonts:
+                self._cache.misses += 1
+                self._fonts[key] = ImageFont.truetype(font_file, size)
+            else:
+                self._cache.hits += 1
+            return self._fonts[key]
+
+
+class AssetCache:
+    """Per process LRU of theme assets keyed by (game, theme)"""
+
+    def __init__(self, max_themes=16, bundle_path=None):
+        self.max_themes = max_themes
+        self.bundle_path = bundle_path
+        # Pre-decoded assets shared between workers, see compile_themes.py
+        self.bundle = load_bundle(bundle_path)
+        self.lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._themes = collections.OrderedDict()
+
+    def get(self, game, theme=None):
+        key = (game, theme)
+        with self.lock:
+            try:
+                self._themes.move_to_end(key)
+                return self._themes[key]
+            except KeyError:
+                pass
+
+            theme_assets = ThemeAssets(self, game, theme)
+            self._themes[key] = theme_assets
+            while len(self._themes) > self.max_themes:
+                self._themes.popitem(last=False)
+                self.evictions += 1
+            return theme_assets
+
+    def clear(self):
+        with self.lock:
+            self._themes.clear()
+
+    def reload(self):
+        """Map the bundle again and drop every cached asset, after the theme files change"""
+        bundle = load_bundle(self.bundle_path)
+        with self.lock:
+            self.bundle = bundle
+            self._themes.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'themes': len(self._themes),
+                'max_themes': self.max_themes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'bundle': self.bundle is not None,
+                'bundle_stale': sorted(self.bundle.stale) if self.bundle else [],
+            }
+
+
+asset_cache = AssetCache(max_themes=int(os.getenv('ASSET_CACHE_THEMES', 16)),
+                         bundle_path=os.getenv('THEME_BUNDLE', 'themes.bundle'))
+
+
+def get_theme_assets(game, theme=None):
+    return asset_cache.get(game, theme)
@@ -0,0 +1,88 @@
+import os
+import time
+import logging
+import threading
+import botocore.exceptions
+
+import storage
+
+logger = logging.getLogger(__name__)
+
+# Most keys s3 will take in a single delete_objects call
+MAX_KEYS_PER_REQUEST = 1000
+
+
+class BatchDeleter:
+    """Delete stored objects with as few requests as possible
+
+    Keys are sent through `delete_objects` in chunks, and keys that fail are
+    retried with a backoff before giving up on them.
+    """
+
+    def __init__(self, max_retries=3, retry_delay=0.2):
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.deleted = 0
+        self.retries = 0
+        self.failed = 0
+
+    def _delete_chunk(self, bucket, keys):
+        """Returns the keys that could not be deleted"""
+        try:
+            errors = storage.delete_many(bucket, keys)
+        except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError, OSError):
+            logger.warning("Failed deleting objects", exc_info=True, extra={'bucket': bucket, 'keys': len(keys)})
+            errors = keys
+
+        with self._lock:
+            self.requests += 1
+            self.deleted += len(keys) - len(errors)
+        return errors
+
+    def delete(self, keys, bucket=None):
+        """Delete the keys from the bucket
+
+        Args:
+            keys (iterable): Object keys to delete
+            bucket (str): Defaults to the rendered images bucket
+
+        Returns:
+            list: Keys that still failed after all retries
+        """
+        bucket = bucket or os.environ['RENDERED_IMAGES_BUCKET']
+        # Deleting the same key twice in a request is an error on some s3 implementations
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            return []
+
+        failed = []
+        for i in range(0, len(keys), MAX_KEYS_PER_REQUEST):
+            chunk = keys[i:i + MAX_KEYS_PER_REQUEST]
+            for attempt in range(self.max_retries + 1):
+                chunk = self._delete_chunk(bucket, chunk)
+                if not chunk or attempt == self.max_retries:
+                    break
+                with self._lock:
+                    self.retries += 1
+                time.sleep(self.retry_delay * (2 ** attempt))
+            failed.extend(chunk)
+
+        if failed:
+            with self._lock:
+                self.failed += len(failed)
+            logger.error("Gave up deleting objects", extra={'bucket': bucket, 'keys': failed})
+        return failed
+
+    def stats(self):
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'deleted': self.deleted,
+                'retries': self.retries,
+                'failed': self.failed,
+            }
+
+
+batch_deleter = BatchDeleter(max_retries=int(os.getenv('DELETE_MAX_RETRIES', 3)))
@@ -0,0 +1,52 @@
+"""Compare saving games to redis with pickle and with `game_codec`
+
+Run from the `src` folder: `python -m benchmarks.codec`
+"""
+import pickle
+import timeit
+
+import game_codec
+import utils as core_utils
+import connect4.utils as connect4_utils
+import mastermind.utils as mastermind_utils
+from connect4.game import Connect4
+from mastermind.game import Mastermind
+from benchmarks.recap import play_game
+
+ITERATIONS = 2000
+
+
+def connect4_game():
+    """A finished game with a move log like one played through slack"""
+    moves, winning_moves = play_game()
+    game = Connect4('U0A1B2C3D', 'U4E5F6G7H', 'T0123ABCD', 'C0123ABCD')
+    game.moves = [move._replace(timestamp=core_utils.get_ts(),
+                                rendered_board_url=f"https://s3.amazonaws.com/imgs/connect4/renders/{'0' * 40}.png")
+                  for move in moves]
+    game.board = game.get_history()['moves'][-1]['board']
+    game.latest_move = connect4_utils.get_pieces_played(moves)[-1]
+    game.winning_moves = winning_moves
+    return game
+
+
+def mastermind_game():
+    game = Mastermind('U0A1B2C3D', 'player', 'T0123ABCD', 'C0123ABCD')
+    for move in [3, 2, 1, 0, -2, 0, 1, 2, 4, -2, 5, 5, 1, 0]:
+        game.board, _ = mastermind_utils.make_move(game.board, move)
+    return game
+
+
+def report(name, encode, decode):
+    data = encode()
+    # Best of a few runs, these are short enough for other things on the machine to skew a single run
+    encode_time = min(timeit.repeat(encode, number=ITERATIONS, repeat=5)) / ITERATIONS
+    decode_time = min(timeit.repeat(lambda: decode(data), number=ITERATIONS, repeat=5)) / ITERATIONS
+    print(f"{name:<30} {len(data):6d} bytes {encode_time * 1e6:8.1f} us encode {decode_time * 1e6:8.1f} us decode")
+
+
+if __name__ == '__main__':
+    for name, game in (('connect4', connect4_game()), ('mastermind', mastermind_game())):
+        print(name)
+        report('  pickle', lambda: pickle.dumps(game), pickle.loads)
+        report('  game_codec', lambda: game_codec.encode(game), game_codec.decode)
+        report('  game_codec, uncompressed', lambda: game_codec.encode(game, compress=False), game_codec.decode)
@@ -0,0 +1,39 @@
+"""Time playing a Connect4 game on the list board and on the bitboard
+
+Run from the `src` folder: `python -m benchmarks.engine`
+"""
+import timeit
+
+import connect4.utils as connect4_utils
+from connect4.bitboard import Bitboard
+from benchmarks.recap import play_game
+
+ITERATIONS = 2000
+
+
+def list_engine(columns):
+    board = connect4_utils.gen_new_board()
+    for player, column in columns:
+        board, _ = connect4_utils.place_piece(board, column, player)
+        connect4_utils.check_win(board, column)
+        connect4_utils.check_tie(board)
+
+
+def bitboard_engine(columns):
+    """What `Connect4.place_piece` does each move"""
+    board = connect4_utils.gen_new_board()
+    bitboard = Bitboard()
+    for player, column in columns:
+        row_idx = bitboard.drop(column - 1, player)
+        board[row_idx][column - 1] = player
+        bitboard.winning_lines(row_idx, column - 1)
+        bitboard.is_full()
+
+
+if __name__ == '__main__':
+    moves, _ = play_game()
+    columns = [(move.player, move.column) for move in moves[1:]]
+    print(f"{len(columns)} moves")
+    for name, func in (('list board', list_engine), ('bitboard', bitboard_engine)):
+        seconds = timeit.timeit(lambda: func(columns), number=ITERATIONS) / ITERATIONS
+        print(f"{name:<12} {seconds * 1e6:8.1f} us per game {seconds / len(columns) * 1e6:6.2f} us per move")
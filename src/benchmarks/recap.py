@@ -0,0 +1,65 @@
+"""Time encoding a Connect4 recap and report its size
+
+Run from the `src` folder: `python -m benchmarks.recap`
+"""
+import io
+import random
+import timeit
+from PIL import Image
+
+import connect4.utils as connect4_utils
+import connect4.exceptions
+
+ITERATIONS = 10
+
+
+def play_game(seed=20):
+    """Random game played to the end, returns the move log and the winning lines"""
+    random.seed(seed)
+    board = connect4_utils.gen_new_board()
+    moves = [connect4_utils.Move(0, None, None, None)]
+    player = 1
+    while True:
+        column = random.randint(1, 7)
+        try:
+            board, latest_move = connect4_utils.place_piece(board, column, player)
+        except connect4.exceptions.ColumnFull:
+            continue
+        moves.append(connect4_utils.Move(player, column, None, None))
+        wins = connect4_utils.check_win(board, column)
+        if wins or connect4_utils.check_tie(board):
+            return moves, wins
+        player = 2 if player == 1 else 1
+
+
+def adaptive_palette_recap(moves, winning_moves):
+    """How recaps were encoded before, a palette per frame and every frame stored in full"""
+    def gen_frame(im):
+        alpha = im.getchannel('A')
+        im = im.convert('RGB').convert('P', palette=Image.Palette.ADAPTIVE, colors=255)
+        mask = Image.eval(alpha, lambda a: 255 if a <= 128 else 0)
+        im.paste(255, mask)
+        im.info['transparency'] = 255
+        return im
+
+    frames = [gen_frame(f) for f, _ in connect4_utils.render_recap_frames(moves, winning_moves)][1:]
+    with io.BytesIO() as buf:
+        frames[0].save(buf, format='gif', save_all=True, append_images=frames[1:],
+                       loop=0, disposal=2, duration=500)
+        return buf.getvalue()
+
+
+def report(name, func):
+    size = len(func())
+    seconds = timeit.timeit(func, number=ITERATIONS)
+    print(f"{name:<40} {seconds / ITERATIONS * 1000:8.1f} ms {size / 1024:8.1f} KiB")
+
+
+if __name__ == '__main__':
+    moves, winning_moves = play_game()
+    print(f"{len(moves) - 1} moves")
+    report('adaptive palette, full frames', lambda: adaptive_palette_recap(moves, winning_moves))
+    report('theme palette, changed area only',
+           lambda: connect4_utils.build_recap_gif(moves, winning_moves, max_frames=0))
+    report('theme palette, max 20 frames',
+           lambda: connect4_utils.build_recap_gif(moves, winning_moves, max_frames=20))
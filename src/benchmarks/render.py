@@ -0,0 +1,55 @@
+"""Time a single move's board render for each game
+
+Run from the `src` folder: `python -m benchmarks.render`
+"""
+import timeit
+
+import mastermind.utils as mastermind_utils
+from assets import asset_cache
+
+ITERATIONS = 200
+
+# A game half way through, on the guess after submitting
+mastermind_board = {
+    'private': [1, 5, 2, 0],
+    'public': ([[[3, 1, 4, 5], [['w', 'w', None, None], 1]],
+                [[1, 4, 0, 2], [['b', 'w', 'w', None], 1]],
+                [[1, 5, 3, 0], [['b', 'b', 'w', None], 1]],
+                [[1, 5, 2, 0], [['b', 'b', 'b', 'b'], 1]],
+                [[1, 3, None, None], [[None, None, None, None], 0]]]
+               + [[[None] * 4, [[None] * 4, 0]] for _ in range(5)]),
+}
+
+mastermind_frame = mastermind_utils.render_board(mastermind_board)
+
+
+def mastermind_no_cache():
+    asset_cache.clear()
+    mastermind_utils.render_board(mastermind_board)
+
+
+def mastermind_no_template():
+    board_img = mastermind_utils.render_empty_board(holes=4, guesses=10)
+    for row_idx, row in enumerate(mastermind_board['public'][::-1]):
+        mastermind_utils.add_row_pegs(board_img, row, row_idx)
+
+
+def mastermind_template():
+    mastermind_utils.render_board(mastermind_board)
+
+
+def mastermind_row():
+    mastermind_utils.render_rows(mastermind_frame, mastermind_board, [4])
+
+
+def report(name, func):
+    func()  # warm up
+    seconds = timeit.timeit(func, number=ITERATIONS)
+    print(f"{name:<40} {seconds / ITERATIONS * 1000:8.3f} ms/render")
+
+
+if __name__ == '__main__':
+    report('mastermind: decode assets every render', mastermind_no_cache)
+    report('mastermind: build empty board', mastermind_no_template)
+    report('mastermind: copy cached empty board', mastermind_template)
+    report('mastermind: repaint changed row', mastermind_row)
@@ -0,0 +1,133 @@
+"""Compare how fast one process plays a burst of clicks with the WSGI and the ASGI app
+
+Each click is a Connect4 move in its own game, posted to a fake slack that
+takes `--latency` ms to answer like the real response_url can. Both apps get
+the same number of threads: the WSGI app plays each move on one of its move
+threads, the ASGI app plays them on the event loop and only renders and
+uploads in its threads. Both use the redis the server is configured for, so
+needs redis running same as the server. Boards are kept on local disk.
+
+Run from the `src` folder: `python -m benchmarks.serving`
+"""
+import os
+import io
+import copy
+import json
+import time
+import types
+import asyncio
+import argparse
+import concurrent.futures
+import tempfile
+import threading
+import http.server
+import urllib.parse
+
+os.environ.setdefault('STORAGE_BACKEND', 'local')
+os.environ.setdefault('LOCAL_STORAGE_DIR', tempfile.mkdtemp())
+os.environ.setdefault('BASE_URL', 'http://localhost:8000')
+os.environ.setdefault('RENDERED_IMAGES_BUCKET', 'benchmark-images')
+os.environ.setdefault('GAME_HISTORY_BUCKET', 'benchmark-history')
+
+import asgi_server  # noqa: E402
+import connect4.endpoints as connect4_endpoints  # noqa: E402
+from move_queue import MoveQueue  # noqa: E402
+
+
+class SlowSlack(http.server.BaseHTTPRequestHandler):
+    latency = 0.2
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        time.sleep(self.latency)
+        body = json.dumps({'ok': True}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SlackServer(http.server.ThreadingHTTPServer):
+    # Every click connects at once
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+def start_slack(latency):
+    SlowSlack.latency = latency
+    server = SlackServer(('127.0.0.1', 0), SlowSlack)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}/response"
+
+
+def new_clicks(count, response_url):
+    """Start `count` games and the first player's click in each of them"""
+    clicks = []
+    for idx in range(count):
+        # Each in its own workspace so slack_client's per team rate limit does not come into it
+        team_id = f"T{idx}"
+        body = urllib.parse.urlencode({'user_id': 'U1', 'user_name': 'one', 'text': '<@U2|two>',
+                                       'team_id': team_id, 'channel_id': 'C1'})
+        resp = types.SimpleNamespace(media=None)
+        connect4_endpoints.SlackConnect4().on_post(types.SimpleNamespace(stream=io.BytesIO(body.encode())), resp)
+        blocks = copy.deepcopy(resp.media['blocks'])
+        # Added by slack to the message it sends back
+        blocks[1].update({'image_width': 430, 'image_height': 50, 'image_bytes': 1, 'fallback': ''})
+        clicks.append({
+            'message': {'blocks': blocks, 'ts': '1'},
+            'response_url': response_url,
+            'user': {'id': 'U1'},
+            'actions': [{'action_id': 'connect4-move-4', 'value': '4'}],
+            'team': {'id': team_id},
+            'channel': {'id': 'C1'},
+        })
+    return clicks
+
+
+def play_wsgi(clicks, threads):
+    # Room for every click, so none are turned away
+    moves = MoveQueue(workers=threads, max_queue=len(clicks) * threads)
+    started = time.perf_counter()
+    taken = sum(moves.submit(action_details['message']['blocks'][0]['block_id'],
+                             connect4_endpoints.slack_connect4_move, action_details)
+                for action_details in clicks)
+    while moves.stats()['processed'] < taken:
+        time.sleep(0.005)
+    stats = moves.stats()
+    return time.perf_counter() - started, stats['failed'] + stats['rejected']
+
+
+async def play_asgi(clicks, threads):
+    asgi_server.blocking = concurrent.futures.ThreadPoolExecutor(max_workers=threads,
+                                                                 thread_name_prefix='asgi-blocking')
+    started = time.perf_counter()
+    for action_details in clicks:
+        await asgi_server.move_tasks.submit(action_details['message']['blocks'][0]['block_id'],
+                                            asgi_server.connect4_move, action_details)
+    await asgi_server.move_tasks.join()
+    stats = asgi_server.move_tasks.stats()
+    return time.perf_counter() - started, stats['failed'] + stats['rejected']
+
+
+def report(name, clicks, seconds, failed):
+    print(f"{name:<30} {seconds:8.2f} s {clicks / seconds:8.1f} moves/s {failed:6} failed")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clicks', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=200, help="ms the fake slack takes to answer")
+    parser.add_argument('--threads', type=int, default=4,
+                        help="WSGI move threads, and ASGI threads for rendering and storage")
+    args = parser.parse_args()
+
+    response_url = start_slack(args.latency / 1000)
+    wsgi_clicks = new_clicks(args.clicks, response_url)
+    asgi_clicks = new_clicks(args.clicks, response_url)
+    print(f"{args.clicks} clicks, slack answering in {args.latency:.0f} ms")
+    report(f"wsgi, {args.threads} move threads", args.clicks, *play_wsgi(wsgi_clicks, args.threads))
+    report(f"asgi, {args.threads} threads", args.clicks, *asyncio.run(play_asgi(asgi_clicks, args.threads)))
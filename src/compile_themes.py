@@ -0,0 +1,29 @@
+import sys
+import argparse
+
+import theme_bundle
+import connect4.utils as connect4_utils
+import mastermind.utils as mastermind_utils
+
+parser = argparse.ArgumentParser(description="Validate all themes and pack them into a theme bundle")
+parser.add_argument('-o', '--output', default='themes.bundle', help="Where to write the bundle")
+parser.add_argument('--check', action='store_true', help="Only validate the themes")
+args = parser.parse_args()
+
+themes = {
+    'connect4': connect4_utils.get_theme_list(),
+    'mastermind': mastermind_utils.get_theme_list(),
+}
+
+errors = []
+for game, game_themes in themes.items():
+    for theme in game_themes:
+        errors.extend(theme_bundle.validate_theme(game, theme))
+
+if errors:
+    print('\n'.join(errors))
+    sys.exit(1)
+
+if not args.check:
+    theme_bundle.write_bundle(args.output, themes)
+    print(f"Compiled {sum(len(t) for t in themes.values())} themes into {args.output}")
@@ -0,0 +1,157 @@
+"""Connect4 engine on bitboards
+
+Each player's pieces are a bit mask, one column after another from the bottom
+up with a spare bit on top of each column so lines can not wrap into the next
+column. With the default 6x7 board both masks fit in 64 bits.
+
+`place_piece`, `check_win` and `check_tie` take and return the same things as
+the ones in `connect4.utils`, games keep a `Bitboard` next to their list board
+so they do not have to convert it every move.
+"""
+import functools
+
+import connect4.exceptions
+
+# Steps from a piece in (row, col) of the list board, row 0 is the top.
+# Grouped and ordered the same as `connect4.utils.check_win` so wins come back the same
+DIRECTIONS = [
+    ([(0, -1), (0, 1)], None),  # Horizontal, left then right
+    ([(1, 0)], None),  # Vertical, only down since nothing can be on top of the latest piece
+    ([(1, -1), (-1, 1)], 3),  # Forward slash, down-left then up-right
+    ([(-1, -1), (1, 1)], 3),  # Back slash, up-left then down-right
+]
+
+
+class Geometry:
+    """Bit positions and line masks for a board size, built once per size"""
+
+    def __init__(self, rows, cols):
+        self.rows = rows
+        self.cols = cols
+        self.height = rows + 1
+        self.top_mask = sum(1 << self.bit(0, col) for col in range(cols))
+        # (row, col) -> [(every 4 in a row through it, rays of (bit, cell) going out from it)]
+        self.lines = {(row, col): [self._lines(row, col, steps, max_steps) for steps, max_steps in DIRECTIONS]
+                      for row in range(rows) for col in range(cols)}
+
+    def bit(self, row_idx, col_idx):
+        return col_idx * self.height + (self.rows - 1 - row_idx)
+
+    def _lines(self, row_idx, col_idx, steps, max_steps):
+        rays = []
+        for row_step, col_step in steps:
+            ray = []
+            row, col = row_idx + row_step, col_idx + col_step
+            while 0 <= row < self.rows and 0 <= col < self.cols and (max_steps is None or len(ray) < max_steps):
+                ray.append((1 << self.bit(row, col), (row, col)))
+                row, col = row + row_step, col + col_step
+            rays.append(ray)
+
+        # All the cells on the line in order, and every 4 of them that includes the piece
+        line = [bit for bit, _ in rays[0][::-1]] + [1 << self.bit(row_idx, col_idx)]
+        if len(rays) > 1:
+            line += [bit for bit, _ in rays[1]]
+        center = len(rays[0])
+        windows = [sum(line[start:start + 4])
+                   for start in range(max(0, center - 3), min(center, len(line) - 4) + 1)]
+        return windows, rays
+
+
+@functools.lru_cache(maxsize=8)
+def get_geometry(rows, cols):
+    return Geometry(rows, cols)
+
+
+class Bitboard:
+
+    def __init__(self, rows=6, cols=7):
+        self.geometry = get_geometry(rows, cols)
+        # Index by the player's piece, 1 or 2
+        self.masks = [0, 0, 0]
+        self.heights = [0] * cols
+
+    @classmethod
+    def from_board(cls, board):
+        bitboard = cls(rows=len(board), cols=len(board[0]))
+        for row_idx, row in enumerate(board):
+            for col_idx, piece in enumerate(row):
+                if piece:
+                    bitboard.masks[piece] |= 1 << bitboard.geometry.bit(row_idx, col_idx)
+                    bitboard.heights[col_idx] += 1
+        return bitboard
+
+    def copy(self):
+        bitboard = Bitboard.__new__(Bitboard)
+        bitboard.geometry = self.geometry
+        bitboard.masks = self.masks.copy()
+        bitboard.heights = self.heights.copy()
+        return bitboard
+
+    def drop(self, col_idx, player):
+        """Drop a piece in the column
+
+        Returns:
+            int: Row index of the list board the piece landed in
+
+        Raises:
+            connect4.exceptions.ColumnFull
+        """
+        height = self.heights[col_idx]
+        if height == self.geometry.rows:
+            raise connect4.exceptions.ColumnFull
+        self.masks[player] |= 1 << (col_idx * self.geometry.height + height)
+        self.heights[col_idx] = height + 1
+        return self.geometry.rows - 1 - height
+
+    def has_four(self, player):
+        """If the player has 4 in a row anywhere on the board"""
+        mask = self.masks[player]
+        height = self.geometry.height
+        for shift in (1, height, height + 1, height - 1):
+            pairs = mask & (mask >> shift)
+            if pairs & (pairs >> (2 * shift)):
+                return True
+        return False
+
+    def winning_lines(self, row_idx, col_idx):
+        """Every line of 4 or more through the piece, same as `connect4.utils.check_win`"""
+        player = 1 if self.masks[1] >> self.geometry.bit(row_idx, col_idx) & 1 else 2
+        if not self.has_four(player):
+            return []
+
+        mask = self.masks[player]
+        wins = []
+        for windows, rays in self.geometry.lines[(row_idx, col_idx)]:
+            if not any(mask & window == window for window in windows):
+                continue
+            win = [(row_idx, col_idx)]
+            for ray in rays:
+                for bit, cell in ray:
+                    if not mask & bit:
+                        break
+                    win.append(cell)
+            wins.append(win)
+        return wins
+
+    def is_full(self):
+        top_mask = self.geometry.top_mask
+        return (self.masks[1] | self.masks[2]) & top_mask == top_mask
+
+
+def place_piece(board, column, player):
+    col_idx = column - 1
+    row_idx = Bitboard.from_board(board).drop(col_idx, player)
+    board[row_idx][col_idx] = player
+    return board, (row_idx, col_idx)
+
+
+def check_win(board, col_played):
+    col_idx = col_played - 1
+    bitboard = Bitboard.from_board(board)
+    row_idx = bitboard.geometry.rows - bitboard.heights[col_idx]
+    return bitboard.winning_lines(row_idx, col_idx)
+
+
+def check_tie(board):
+    """Must only check after check_win"""
+    return Bitboard.from_board(board).is_full()
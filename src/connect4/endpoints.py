@@ -1,15 +1,19 @@
 import os
+import copy
 import json
-import boto3
 import falcon
-import pickle
 import logging
-import requests
 import threading
 import urllib.parse
 
+import storage
 import connect4.exceptions
-from utils import redis_client
+import game_codec
+from delete_queue import delete_queue
+from game_store import game_store, GameConflict, MOVE_NOT_APPLIED
+from slack_client import slack_client
+from access_tokens import access_tokens
+from themes import theme_registry
 from connect4.game import Connect4
 import connect4.utils as connect4_utils
 
@@ -63,21 +67,20 @@ default_message_blocks = [
 class SlackOAuth:
     def on_get(self, req, resp):
         code = req.params['code']
-        r = requests.post('https://slack.com/api/oauth.access',
-                          data={'code': code,
-                                'client_id': os.environ['SLACKBOT_CLIENT_ID'],
-                                'client_secret': os.environ['SLACKBOT_CLIENT_SECRET'],
-                                })
+        r = slack_client.api('oauth.access',
+                             data={'code': code,
+                                   'client_id': os.environ['SLACKBOT_CLIENT_ID'],
+                                   'client_secret': os.environ['SLACKBOT_CLIENT_SECRET'],
+                                   })
         oauth_resp = r.json()
         try:
             # Save to s3
-            s3 = boto3.client('s3', endpoint_url=os.getenv('S3_ENDPOINT', None))
-            s3.put_object(Body=json.dumps(oauth_resp).encode('utf-8'),
-                          Bucket=os.environ['OAUTH_BUCKET'],
-                          Key=f"slack/{oauth_resp['team_id']}.json",
-                          ContentType='application/json')
-            # Save to redis cache
-            redis_client.set(oauth_resp['team_id'], oauth_resp['access_token'])
+            storage.put(os.environ['OAUTH_BUCKET'],
+                        f"slack/{oauth_resp['team_id']}.json",
+                        json.dumps(oauth_resp).encode('utf-8'),
+                        'application/json')
+            # Replace the token anywhere it is cached
+            access_tokens.set(oauth_resp['team_id'], oauth_resp['access_token'])
 
             # TODO: Create better landing page
             resp.body = json.dumps({'message': 'Break Room successfully installed'})
@@ -102,7 +105,7 @@ class SlackConnect4:
             if data['text'][0].strip().lower() == 'themes':
                 resp.media = {
                     'replace_original': True,
-                    'blocks': connect4_utils.get_sample_theme_blocks(),
+                    'blocks': theme_registry.sample_blocks('connect4'),
                 }
                 return
             # TODO: make a call to slack to get the display names, not the actual user names
@@ -121,7 +124,7 @@ class SlackConnect4:
                 theme = data['text'][0].split(' ')[-1]
 
             # Theme passed in does not exist
-            if theme not in connect4_utils.get_theme_list():
+            if theme_registry.get('connect4', theme) is None:
                 resp.media = {'text': f'The theme *{theme}* is not found'}
                 return
 
@@ -133,16 +136,18 @@ class SlackConnect4:
                                     theme=theme)
 
             player_banner_url, board_url = current_game.start(player1_name, player2_name)
-            redis_client.set(current_game.game_id, pickle.dumps(current_game))
+            game_store.create(current_game)
 
+            # Requests are handled on many threads at once, so each one fills in its own copy of the blocks
+            blocks = copy.deepcopy(default_message_blocks)
             header_message = f"<@{player1_id}> & <@{player2_id}>"
-            default_message_blocks[0]['text']['text'] = header_message
+            blocks[0]['text']['text'] = header_message
 
-            default_message_blocks[1]['image_url'] = player_banner_url
-            default_message_blocks[2]['image_url'] = board_url
+            blocks[1]['image_url'] = player_banner_url
+            blocks[2]['image_url'] = board_url
 
-            default_message_blocks[0]['block_id'] = current_game.game_id
-            default_message_blocks[-2]['text']['text'] = f"<@{current_game.current_player}>'s Turn"
+            blocks[0]['block_id'] = current_game.game_id
+            blocks[-2]['text']['text'] = f"<@{current_game.current_player}>'s Turn"
 
         except Exception:
             logger.exception("Failed to start connect4 game")
@@ -156,64 +161,103 @@ class SlackConnect4:
             resp.media = {
                 # 'replace_original': True,  # Does this even  work when using in_channel?
                 'response_type': 'in_channel',
-                'blocks': default_message_blocks,
+                'blocks': blocks,
             }
 
 
+def play_move(current_game, action_details):
+    """Place the clicked piece, rendering and uploading the new board
+
+    Returns:
+        tuple: New board url and game state, None if it was not a valid move
+    """
+    try:
+        column, player = current_game.parse_column_and_player(action_details)
+        return current_game.place_piece(column, player)
+    except (connect4.exceptions.NotYourTurn, connect4.exceptions.ColumnFull):
+        return None
+
+
+def update_move_blocks(blocks, current_game, board_url, game_state):
+    """Update the game message to show the move that was played"""
+    if game_state is not None:
+        blocks.pop(-3)  # Remove buttons
+
+    msg_state = {'win': f"<@{current_game.current_player}> WON!!!",
+                 'tie': f"It's a Tie!",
+                 None: f"<@{current_game.current_player}>'s Turn",
+                 }
+    blocks[-2]['text']['text'] = msg_state.get(game_state, 'The game got into an invalid state.')
+    # Better to create a new block because the one returned has data that breaks the api if returned
+    new_image = copy.deepcopy(default_message_blocks[2])
+    new_image["image_url"] = board_url
+    blocks[2] = new_image
+
+    # Fix formating of some messages
+    blocks[0]['text']['text'] = blocks[0]['text']['text'].replace('+', ' ')
+    blocks[1]['title']['text'] = blocks[1]['title']['text'].replace('+', ' ')
+    blocks[2]['title']['text'] = blocks[2]['title']['text'].replace('+', ' ')
+    blocks[-1]['elements'][0]['text'] = blocks[-1]['elements'][0]['text'].replace('+', ' ')
+    # Clean up image fields auto added by slack that cannot be posted when updating the message
+    del blocks[1]['image_width']
+    del blocks[1]['image_height']
+    del blocks[1]['image_bytes']
+    del blocks[1]['fallback']
+
+
 def slack_connect4_move(action_details):
     blocks = action_details['message']['blocks']
 
     game_id = blocks[0]['block_id']
-    current_game = pickle.loads(redis_client.get(game_id))
+    current_game, version = game_store.load(game_id)
+    if current_game is None:
+        # Game is already over
+        return
+    # To put back if slack does not take the update
+    previous_state = game_codec.encode(current_game)
+    played = play_move(current_game, action_details)
+    if played is None:
+        return
+    board_url, game_state = played
+
     try:
-        column, player = current_game.parse_column_and_player(action_details)
-        board_url, game_state = current_game.place_piece(column, player)
-    except (connect4.exceptions.NotYourTurn, connect4.exceptions.ColumnFull):
-        pass
-    else:
         if game_state is not None:
-            # Game is over
-            # Generate recap in thread to post when ready
-            t = threading.Thread(target=connect4_utils.post_recap,
-                                 args=(current_game,
-                                       action_details))
-            t.daemon = True
-            t.start()
-
-            blocks.pop(-3)  # Remove buttons
-            redis_client.delete(game_id)  # Clear from cache
-
-        msg_state = {'win': f"<@{current_game.current_player}> WON!!!",
-                     'tie': f"It's a Tie!",
-                     None: f"<@{current_game.current_player}>'s Turn",
-                     }
-        blocks[-2]['text']['text'] = msg_state.get(game_state, 'The game got into an invalid state.')
-        # Better to create a new block because the one returned has data that breaks the api if returned
-        new_image = default_message_blocks[2].copy()
-        new_image["image_url"] = board_url
-        blocks[2] = new_image
-
-        # Fix formating of some messages
-        blocks[0]['text']['text'] = blocks[0]['text']['text'].replace('+', ' ')
-        blocks[1]['title']['text'] = blocks[1]['title']['text'].replace('+', ' ')
-        blocks[2]['title']['text'] = blocks[2]['title']['text'].replace('+', ' ')
-        blocks[-1]['elements'][0]['text'] = blocks[-1]['elements'][0]['text'].replace('+', ' ')
-        # Clean up image fields auto added by slack that cannot be posted when updating the message
-        del blocks[1]['image_width']
-        del blocks[1]['image_height']
-        del blocks[1]['image_bytes']
-        del blocks[1]['fallback']
-
-        r = requests.post(action_details['response_url'], json=action_details['message'])
-        if r.json().get('ok') is True:
-            if redis_client.exists(game_id):
-                # only save game status if updating slack was successful and game is still playable
-                redis_client.set(game_id, pickle.dumps(current_game))
+            game_store.finish(game_id, version)
         else:
-            logger.error("Updating connect4 failed",
-                         extra={
-                             'game_id': game_id,
-                             'platform': 'slack',
-                             'blocks': blocks,
-                             'response': r.text,
-                         })
+            version = game_store.save(current_game, version)
+    except GameConflict:
+        # Another click got there first, this board will never be shown
+        delete_queue.push(board_url)
+        slack_client.post(action_details['response_url'], team_id=action_details['team']['id'],
+                          json=MOVE_NOT_APPLIED)
+        return
+
+    if game_state is not None:
+        # Game is over
+        # Generate recap in thread to post when ready
+        t = threading.Thread(target=connect4_utils.post_recap,
+                             args=(current_game,
+                                   action_details))
+        t.daemon = True
+        t.start()
+
+    update_move_blocks(blocks, current_game, board_url, game_state)
+
+    r = slack_client.post(action_details['response_url'], team_id=action_details['team']['id'],
+                          json=action_details['message'])
+    if r.json().get('ok') is not True:
+        logger.error("Updating connect4 failed",
+                     extra={
+                         'game_id': game_id,
+                         'platform': 'slack',
+                         'blocks': blocks,
+                         'response': r.text,
+                     })
+        if game_state is None:
+            # Only keep the move if the players can see it
+            try:
+                game_store.save_state(game_id, previous_state, version)
+            except GameConflict:
+                pass
+            else:
+                delete_queue.push(board_url)
@@ -1,13 +1,17 @@
 import os
 import copy
-import time
 import json
 import uuid
-import boto3
 
+import storage
 import utils as core_utils
+from batch_delete import batch_deleter
+from render_cache import render_cache, render_key, render_name
+from render_service import render_service
+from themes import theme_registry
 import connect4.exceptions
 import connect4.utils as connect4_utils
+from connect4.bitboard import Bitboard
 
 
 class Connect4:
@@ -37,17 +41,10 @@ class Connect4:
             'recap_url': None,
             # None-game not done; 0-tie; 1-player 1 won; 2-player2 won
             'game_state': None,
-            'moves': [
-                # Example of whats in a move
-                # {
-                #     'player': 1,
-                #     'latest_move': (6, 2),
-                #     'board': [[0, 0, 0],[0, 0, 0],[0, 0, 0]] ...,
-                #     'rendered_board_url': 'https://...',
-                #     'timestamp': '...',
-                # }
-            ],
+            # The moves are added from the move log when the history is saved, see `get_history`
         }
+        # Every move played as `connect4_utils.Move`, boards are worked out from it when needed
+        self.moves = []
 
         self.s3_root_folder = f"connect4/slack/{self.team_id}"
 
@@ -56,18 +53,26 @@ class Connect4:
         self.board = connect4_utils.gen_new_board()
         self.winning_moves = None
 
+        # Last rendered board without any overlays, the board and theme version it was rendered from
+        # Not saved when pickled, the first render after loading will do a full render
+        self._frame = None
+        self._frame_board = None
+        self._frame_version = None
+        # Same pieces as the board, for placing pieces and checking wins. Rebuilt from the board after loading
+        self._bitboard = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_frame'] = None
+        state['_frame_board'] = None
+        state['_frame_version'] = None
+        state['_bitboard'] = None
+        return state
+
     def start(self, player1_name, player2_name):
         banner_url = self.render_player_banner(player1_name, player2_name)
         board_url = self.render_board()
-        self.game_history['moves'].append(
-            {
-                'player': 0,
-                'piece_played': (None, None),
-                'board': copy.deepcopy(self.board),
-                'rendered_board_url': board_url,
-                'timestamp': core_utils.get_ts(),
-            }
-        )
+        self.moves.append(connect4_utils.Move(0, None, core_utils.get_ts(), board_url))
         return banner_url, board_url
 
     def render_board_str(self):
@@ -79,15 +84,67 @@ class Connect4:
             rendered_board += '\n'
         return rendered_board
 
-    def render_board(self):
-        board_name = f"{self.s3_root_folder}/{self.game_id}_{time.time()}"
-        board_img = connect4_utils.render_board(self.board, theme=self.theme)
-        # Only render the last more OR the winning pieces
-        if not self.winning_moves:
-            board_img = connect4_utils.add_lastest_move_overlay(board_img, self.latest_move, theme=self.theme)
+    def _update_frame(self, version):
+        if self._frame is not None and self._frame_version == version:
+            # Pieces are only ever added, so anything new can be pasted on the previous frame
+            new_pieces = [(row_idx, col_idx)
+                          for row_idx, row in enumerate(self.board)
+                          for col_idx, piece in enumerate(row)
+                          if piece != self._frame_board[row_idx][col_idx]]
+            if all(self._frame_board[row_idx][col_idx] == 0 for row_idx, col_idx in new_pieces):
+                for row_idx, col_idx in new_pieces:
+                    piece = self.board[row_idx][col_idx]
+                    self._frame = connect4_utils.add_piece(self._frame, row_idx, col_idx, piece, theme=self.theme)
+                    self._frame_board[row_idx][col_idx] = piece
+                return
+
+        self._frame = connect4_utils.render_board(self.board, theme=self.theme)
+        self._frame_board = copy.deepcopy(self.board)
+        self._frame_version = version
+
+    def render_board(self, final=False):
+        # The theme version changes when its images do, so boards drawn with the old ones are not reused
+        version = theme_registry.version('connect4', self.theme)
+        if final:
+            # The finished message shows the last board for good, so the game keeps its own copy
+            # instead of sharing one that is deleted once the other games showing it move on
+            digest = None
+            board_name = f"{self.s3_root_folder}/{self.game_id}_final"
+        else:
+            digest = render_key('connect4',
+                                self.theme,
+                                version,
+                                self.board,
+                                connect4_utils.get_overlay(self.latest_move, self.winning_moves))
+            board_url = render_cache.get_url(digest)
+            if board_url is not None:
+                # Already rendered by this or another game
+                return board_url
+            board_name = render_name('connect4/renders', digest)
+
+        if render_service.enabled:
+            # Render processes do not have the previous frame, so they render the full board
+            board_png = render_service.render(connect4_utils.render_board_png,
+                                              self.board,
+                                              self.latest_move,
+                                              self.winning_moves,
+                                              theme=self.theme)
+            board_url = core_utils.upload_render(board_png, board_name)
         else:
-            board_img = connect4_utils.add_won_overlay(board_img, self.winning_moves, theme=self.theme)
-        return core_utils.save_render(board_img, board_name)
+            self._update_frame(version)
+            board_img = connect4_utils.add_overlay(self._frame.copy(),
+                                                   self.latest_move,
+                                                   self.winning_moves,
+                                                   theme=self.theme)
+            board_url = core_utils.save_render(board_img, board_name)
+
+        if digest is not None:
+            cached_url = render_cache.add(digest, board_url)
+            if cached_url != board_url:
+                # Another game rendered the same board at the same time, show theirs and drop this copy
+                batch_deleter.delete([core_utils.get_file_key(board_url)])
+                board_url = cached_url
+        return board_url
 
     def render_player_banner(self, player1_name, player2_name):
         name_prefix = f"{self.s3_root_folder}/{self.game_id}"
@@ -109,30 +166,31 @@ class Connect4:
 
         return column, player
 
+    def get_bitboard(self):
+        if self._bitboard is None:
+            self._bitboard = Bitboard.from_board(self.board)
+        return self._bitboard
+
     def place_piece(self, column, player):
-        self.board, self.latest_move = connect4_utils.place_piece(self.board, column, self.pieces[player])
+        bitboard = self.get_bitboard()
+        col_idx = column - 1
+        row_idx = bitboard.drop(col_idx, self.pieces[player])
+        self.board[row_idx][col_idx] = self.pieces[player]
+        self.latest_move = (row_idx, col_idx)
 
         game_end = None
-        self.winning_moves = connect4_utils.check_win(self.board, column)
+        self.winning_moves = bitboard.winning_lines(row_idx, col_idx)
         if self.winning_moves:
             game_end = 'win'
             self.game_history['game_state'] = self.pieces[self.current_player]
 
-        elif connect4_utils.check_tie(self.board):
+        elif bitboard.is_full():
             game_end = 'tie'
             self.game_history['game_state'] = 0
 
-        board_url = self.render_board()
+        board_url = self.render_board(final=game_end is not None)
         # Save the players move before game_over gets called and the player is toggled
-        self.game_history['moves'].append(
-            {
-                'player': self.pieces[self.current_player],
-                'piece_played': self.latest_move,
-                'board': copy.deepcopy(self.board),
-                'rendered_board_url': board_url,
-                'timestamp': core_utils.get_ts(),
-            }
-        )
+        self.moves.append(connect4_utils.Move(self.pieces[self.current_player], column, core_utils.get_ts(), board_url))
 
         if game_end is None:
             # Only toggle the player if game has not ended
@@ -141,32 +199,36 @@ class Connect4:
         return board_url, game_end
 
     def _generate_recap(self, moves):
-        s3 = boto3.client('s3', endpoint_url=os.getenv('S3_ENDPOINT', None))
-        frame_urls = []
-        for idx, move in enumerate(moves, start=1):
-            frame_urls.append(move['rendered_board_url'])
+        frame_urls = [move.rendered_board_url for move in moves]
 
-        recap_name = f"{self.s3_root_folder}/{self.game_id}_recap.gif"
-        recap_url = connect4_utils.generate_recap(frame_urls, recap_name)
+        recap_name = f"{self.s3_root_folder}/{self.game_id}_recap"
+        recap_url = connect4_utils.generate_recap(moves, self.winning_moves, recap_name, theme=self.theme)
 
-        # Remove un-needed boards from s3
-        # Do not delete the very last image
-        for frame_url in frame_urls[:-1]:
-            s3.delete_object(Bucket=os.environ['RENDERED_IMAGES_BUCKET'],
-                             Key=f"{self.s3_root_folder}/{frame_url.split('/')[-1]}")
+        # Remove un-needed boards from s3, unless other games are still showing them
+        # The very last image is still shown in slack, it belongs to this game and is never deleted
+        batch_deleter.delete(core_utils.get_file_key(frame_url)
+                             for frame_url in frame_urls[:-1]
+                             if render_cache.release(frame_url))
 
         return recap_url
 
     def game_over(self):
         self.game_history['end_time'] = core_utils.get_ts()
 
-        recap_url = self._generate_recap(self.game_history['moves'])
+        recap_url = self._generate_recap(self.moves)
 
         self.game_history['recap_url'] = recap_url
-        s3 = boto3.client('s3', endpoint_url=os.getenv('S3_ENDPOINT', None))
-        s3.put_object(Body=json.dumps(self.game_history).encode('utf-8'),
-                      Bucket=os.environ['GAME_HISTORY_BUCKET'],
-                      Key=f"{self.s3_root_folder}/{self.game_id}_history.json",
-                      ContentType='application/json')
+        storage.put(os.environ['GAME_HISTORY_BUCKET'],
+                    f"{self.s3_root_folder}/{self.game_id}_history.json",
+                    json.dumps(self.get_history()).encode('utf-8'),
+                    'application/json')
 
         return recap_url
+
+    def get_history(self):
+        """Game history as it is archived, with every moves board"""
+        history = self.game_history.copy()
+        history['moves'] = list(connect4_utils.iter_history_moves(self.moves,
+                                                                  rows=len(self.board),
+                                                                  cols=len(self.board[0])))
+        return history
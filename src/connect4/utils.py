@@ -1,130 +1,231 @@
 import os
 import io
-import json
-import boto3
+import copy
 import os.path
 import tempfile
-import requests
+import collections
 from PIL import Image
-from PIL import ImageFont
 from PIL import ImageDraw
-from pygifsicle import optimize
+from PIL import ImageChops
+try:
+    from pygifsicle import optimize
+except ImportError:
+    optimize = None
 
+import utils as core_utils
 import connect4.exceptions
-from utils import redis_client
+from render_service import render_service
+from slack_client import slack_client
+from access_tokens import access_tokens
+from assets import get_theme_assets
 
 PIECE_D = 50
 PIECE_SPACE = 10
 
+RECAP_FRAME_DURATION = int(os.getenv('RECAP_FRAME_DURATION', 500))
+RECAP_FINAL_FRAME_DURATION = int(os.getenv('RECAP_FINAL_FRAME_DURATION', RECAP_FRAME_DURATION))
+RECAP_MAX_FRAMES = int(os.getenv('RECAP_MAX_FRAMES', 0))
+# The recap is already only storing what changes each frame, gifsicle squeezes out a little more
+RECAP_GIFSICLE = os.getenv('RECAP_GIFSICLE', '').lower() in ('1', 'true')
+
+# Slack errors for a token that was replaced or revoked
+INVALID_TOKEN_ERRORS = ('invalid_auth', 'token_revoked', 'token_expired', 'account_inactive')
+
+# An entry in a games move log, column is None for the empty board every game starts with
+Move = collections.namedtuple('Move', ['player', 'column', 'timestamp', 'rendered_board_url'])
+
 
 def get_theme_list():
     return list(os.walk('connect4/assets'))[0][1]
 
 
+def recap_message(recap_url, action_details):
+    """chat.postMessage body posting the recap in the game's thread"""
+    return {
+        'text': 'Game Recap',
+        'blocks': [{"type": "image",
+                    "image_url": recap_url,
+                    "alt_text": "Game Recap"}],
+        'channel': action_details['channel']['id'],
+        'thread_ts': action_details['message']['ts'],
+    }
+
+
 def post_recap(game, action_details):
     recap_url = game.game_over()
-    team_access_token = get_access_token(action_details['team']['id'])
-    r = requests.post(
-        'https://slack.com/api/chat.postMessage',
-        headers={
-            'Content-Type': 'application/json',
-            'Authorization': f"Bearer {team_access_token}",
-        },
-        json={
-            'text': 'Game Recap',
-            'blocks': [{"type": "image",
-                        "image_url": recap_url,
-                        "alt_text": "Game Recap"}],
-            'channel': action_details['channel']['id'],
-            'thread_ts': action_details['message']['ts'],
-        })
+    team_id = action_details['team']['id']
+    for _ in range(2):
+        r = slack_client.api('chat.postMessage',
+                             team_id=team_id,
+                             token=access_tokens.get(team_id),
+                             json=recap_message(recap_url, action_details))
+        if r.json().get('error') not in INVALID_TOKEN_ERRORS:
+            break
+        # Reinstalled since this worker got the token, load the new one
+        access_tokens.invalidate(team_id)
     if r.json().get('ok') is False:
         print("Failed sending the recap", r.text)
 
 
-def get_access_token(team_id):
-    try:
-        access_token = redis_client.get(team_id).decode('utf-8')
-    except AttributeError:
-        # Load in from s3 and save into redis cache
-        s3 = boto3.client('s3', endpoint_url=os.getenv('S3_ENDPOINT', None))
-        file_content = s3.get_object(Bucket=os.environ['OAUTH_BUCKET'],
-                                     Key=f"slack/{team_id}.json")['Body'].read().decode('utf-8')
-        access_token = json.loads(file_content)['access_token']
-        redis_client.set(team_id, access_token)
-
-    return access_token
-
-
-def generate_recap(frame_urls, recap_name):
-    def gen_frame(url):
-        # Source: https://stackoverflow.com/a/51219787
-        im = Image.open(io.BytesIO(requests.get(url).content))
-        alpha = im.getchannel('A')
-        # Convert the image into P mode but only use 255 colors in the palette out of 256
-        im = im.convert('RGB').convert('P', palette=Image.ADAPTIVE, colors=255)
-        # Set all pixel values below 128 to 255 , and the rest to 0
-        mask = Image.eval(alpha, lambda a: 255 if a <= 128 else 0)
-        # Paste the color of index 255 and use alpha as a mask
-        im.paste(255, mask)
-        # The transparency index is 255
-        im.info['transparency'] = 255
+def render_recap_frames(moves, winning_moves, theme='classic'):
+    """Re-render the board after each move from the games move log
+
+    Each frame only pastes the piece played onto the previous one
+
+    Args:
+        moves (list): Move log, the first being the empty board
+        winning_moves (list): Winning lines, drawn on the last frame
+
+    Yields:
+        tuple: Rendered board for each move, and the alpha channel of that board without the overlays
+    """
+    board_img = get_theme_assets('connect4', theme).image('board.png').copy()
+    for idx, (move, piece_played) in enumerate(zip(moves, get_pieces_played(moves))):
+        if piece_played != (None, None):
+            row_idx, col_idx = piece_played
+            board_img = add_piece(board_img, row_idx, col_idx, move.player, theme=theme)
+        # Only the final board of a won game shows the winning pieces
+        frame_winning_moves = winning_moves if idx == len(moves) - 1 else None
+        frame = add_overlay(board_img.copy(), piece_played, frame_winning_moves, theme=theme)
+        yield frame, board_img.getchannel('A')
+
+
+def get_recap_palette(theme='classic'):
+    """One palette for every frame of a themes recaps
+
+    Built from every asset the theme draws, including the overlays blended on
+    top of both pieces. Index 255 is left free for transparency.
+    """
+    def build_palette():
+        board = [[(row_idx + col_idx) % 2 + 1 for col_idx in range(7)] for row_idx in range(6)]
+        board_img = render_board(board, theme=theme)
+        board_img = add_lastest_move_overlay(board_img, (0, 0), theme=theme)
+        board_img = add_lastest_move_overlay(board_img, (0, 1), theme=theme)
+        board_img = add_won_overlay(board_img, [[(1, 0), (1, 1)]], theme=theme)
+        return board_img.convert('RGB').quantize(colors=255, method=Image.Quantize.MEDIANCUT)
+
+    return get_theme_assets('connect4', theme).memoize('recap_palette', build_palette)
+
+
+def select_recap_frames(num_frames, max_frames):
+    """Evenly drop frames from long games, always keeping the first and last"""
+    if not max_frames or num_frames <= max_frames:
+        return list(range(num_frames))
+    # Nothing less than the first and last frame makes a recap
+    max_frames = max(max_frames, 2)
+    if num_frames <= max_frames:
+        return list(range(num_frames))
+    step = (num_frames - 1) / (max_frames - 1)
+    return sorted({round(i * step) for i in range(max_frames)})
+
+
+def build_recap_gif(moves,
+                    winning_moves,
+                    theme='classic',
+                    duration=RECAP_FRAME_DURATION,
+                    final_duration=RECAP_FINAL_FRAME_DURATION,
+                    max_frames=RECAP_MAX_FRAMES):
+    """Combine the board of each move into an animated gif
+
+    Every frame uses the themes fixed palette and is drawn on top of the one
+    before it, so the gif encoder only stores the area around the piece played.
+
+    Args:
+        moves (list): Moves from the game history, the first being the empty board
+        winning_moves (list): Winning lines, drawn on the last frame
+        duration (int): ms to show each move
+        final_duration (int): ms to show the final board before looping
+        max_frames (int): Drop moves to keep long games at this many frames, 0 to keep all
+
+    Returns:
+        bytes: The gif
+    """
+    palette = get_recap_palette(theme=theme)
+
+    def gen_frame(im, opaque):
+        im = im.convert('RGB').quantize(palette=palette, dither=Image.Dither.NONE)
+        # Paste the color of index 255 where the board is see through
+        im.paste(255, ImageChops.invert(opaque))
         return im
 
     # Something is weird with the empty board png
     # So start 1 move in so all frames are transparent
-    recap_gif = gen_frame(frame_urls[1])
-    other_frames = []
-    for frame_url in frame_urls[2:]:
-        other_frames.append(gen_frame(frame_url))
-
-    s3 = boto3.client('s3', endpoint_url=os.getenv('S3_ENDPOINT', None))
-    with tempfile.TemporaryDirectory() as tmp_dir_name:
-        filename = os.path.join(tmp_dir_name, 'recap.gif')
-        recap_gif.save(filename,
+    board_frames = list(render_recap_frames(moves, winning_moves, theme=theme))[1:]
+    frames = []
+    opaque = None
+    for idx in select_recap_frames(len(board_frames), max_frames):
+        frame, alpha = board_frames[idx]
+        # Transparency comes from the board without overlays, and once a pixel is drawn it stays drawn.
+        # Each frame is drawn over the last one, so a pixel can never go back to being transparent
+        frame_opaque = Image.eval(alpha, lambda a: 255 if a > 128 else 0)
+        opaque = frame_opaque if opaque is None else ImageChops.lighter(opaque, frame_opaque)
+        frames.append(gen_frame(frame, opaque))
+    durations = [duration] * (len(frames) - 1) + [final_duration]
+
+    with io.BytesIO() as buf:
+        frames[0].save(buf,
                        format='gif',
                        save_all=True,
-                       append_images=other_frames,
+                       append_images=frames[1:],
                        loop=0,
-                       disposal=2,
-                       duration=500)
-        optimize(filename)
-        s3.upload_file(filename,
-                       os.environ['RENDERED_IMAGES_BUCKET'],
-                       recap_name,
-                       ExtraArgs={'ContentType': 'image/gif'})
+                       # Leave the last frame in place, the next one is only the changed area
+                       disposal=1,
+                       transparency=255,
+                       optimize=False,
+                       duration=durations)
+        recap_data = buf.getvalue()
 
-    return f"{os.getenv('S3_ENDPOINT', 'https://s3.amazonaws.com')}/{os.environ['RENDERED_IMAGES_BUCKET']}/{recap_name}"
+    if not RECAP_GIFSICLE or optimize is None:
+        return recap_data
 
+    # gifsicle only works on files
+    with tempfile.TemporaryDirectory() as tmp_dir_name:
+        filename = os.path.join(tmp_dir_name, 'recap.gif')
+        with open(filename, 'wb') as f:
+            f.write(recap_data)
+        optimize(filename)
+        with open(filename, 'rb') as f:
+            return f.read()
 
-def get_sample_theme_blocks():
-    samples = []
-    for theme in get_theme_list():
-        try:
-            with open(os.path.join('connect4', 'assets', theme, 'about.txt'), 'r') as f:
-                theme_about_text = f.read().strip()
-        except FileNotFoundError:
-            theme_about_text = ''
-
-        samples.append({
-            "type": "section",
-            "text": {
-                "type": "mrkdwn",
-                "text": f"Theme: *{theme}*\n{theme_about_text[:200]}"
-            },
-            "accessory": {
-                "type": "image",
-                "image_url": f"{os.getenv('S3_ENDPOINT', 'https://s3.amazonaws.com')}/{os.environ['RENDERED_IMAGES_BUCKET']}/connect4/themes/sample-{theme}.png",  # noqa:E501
-                "alt_text": theme
-            }
-        })
-    return samples
+
+def generate_recap(moves, winning_moves, recap_name, theme='classic'):
+    recap_gif = render_service.render(build_recap_gif, moves, winning_moves, theme=theme)
+    return core_utils.upload_render(recap_gif, recap_name, ext='gif')
 
 
 def gen_new_board(rows=6, cols=7):
     return [[0] * cols for i in range(rows)]
 
 
+def get_pieces_played(moves, rows=6, cols=7):
+    """Where each move's piece landed on the board as (row, col), (None, None) for the empty board"""
+    heights = [0] * cols
+    pieces_played = []
+    for move in moves:
+        if move.column is None:
+            pieces_played.append((None, None))
+            continue
+        col_idx = move.column - 1
+        heights[col_idx] += 1
+        pieces_played.append((rows - heights[col_idx], col_idx))
+    return pieces_played
+
+
+def iter_history_moves(moves, rows=6, cols=7):
+    """Replay a move log into the moves of the archived game history, with the board after each move"""
+    board = gen_new_board(rows, cols)
+    for move, piece_played in zip(moves, get_pieces_played(moves, rows, cols)):
+        if piece_played != (None, None):
+            board[piece_played[0]][piece_played[1]] = move.player
+        yield {
+            'player': move.player,
+            'piece_played': piece_played,
+            'board': copy.deepcopy(board),
+            'rendered_board_url': move.rendered_board_url,
+            'timestamp': move.timestamp,
+        }
+
+
 def place_piece(board, column, player):
     column_idx = column - 1
     for i in range(1, len(board) + 1):
@@ -236,27 +337,19 @@ def check_win(board, col_played):
 
 
 def render_player_banner(player1_name, player2_name, board_name, theme='classic'):
-    template = Image.open("connect4/assets/player_banner.png")
-    player1_piece = Image.open(f"connect4/assets/{theme}/player1.png")
-    player2_piece = Image.open(f"connect4/assets/{theme}/player2.png")
+    theme_assets = get_theme_assets('connect4', theme)
+    template = get_theme_assets('connect4').image('player_banner.png').copy()
+    player1_piece = theme_assets.image('player1.png')
+    player2_piece = theme_assets.image('player2.png')
 
     template.paste(player1_piece, (2, 2), player1_piece)
     template.paste(player2_piece, (219, 2), player2_piece)
     draw = ImageDraw.Draw(template)
-    font = ImageFont.truetype("Lato-Bold.ttf", 16)
+    font = theme_assets.font("Lato-Bold.ttf", 16)
     draw.text((58, 20), player1_name[:20], (66, 135, 245), font=font)
     draw.text((278, 20), player2_name[:20], (66, 135, 245), font=font)
 
-    s3 = boto3.client('s3', endpoint_url=os.getenv('S3_ENDPOINT', None))
-    file_key = board_name + '_player_banner.png'
-    with tempfile.NamedTemporaryFile() as tmp:
-        template.save(tmp.name, format='png')
-        s3.upload_file(tmp.name,
-                       os.environ['RENDERED_IMAGES_BUCKET'],
-                       file_key,
-                       ExtraArgs={'ContentType': 'image/png'})
-
-    return f"{os.getenv('S3_ENDPOINT', 'https://s3.amazonaws.com')}/{os.environ['RENDERED_IMAGES_BUCKET']}/{file_key}"
+    return core_utils.save_render(template, board_name + '_player_banner')
 
 
 def get_piece_x(row_idx, col_idx):
@@ -279,7 +372,7 @@ def get_overlay_y(row_idx, col_idx, piece_height, board_height):
 def add_lastest_move_overlay(board_img, latest_move=(None, None), theme='classic'):
     if latest_move != (None, None):
         try:
-            lastest_move_img = Image.open(f"connect4/assets/{theme}/latest_move.png")
+            lastest_move_img = get_theme_assets('connect4', theme).image('latest_move.png')
         except FileNotFoundError:
             return board_img
 
@@ -298,7 +391,7 @@ def add_won_overlay(board_img, winning_moves, theme='classic'):
     # If the game is won, then mark each spot
     if winning_moves:
         try:
-            won_img = Image.open(f"connect4/assets/{theme}/won.png")
+            won_img = get_theme_assets('connect4', theme).image('won.png')
         except FileNotFoundError:
             return board_img
 
@@ -317,19 +410,44 @@ def add_won_overlay(board_img, winning_moves, theme='classic'):
     return board_img
 
 
-def render_board(board, theme='classic'):
-    board_img = Image.open(f"connect4/assets/{theme}/board.png")
+def add_piece(board_img, row_idx, col_idx, piece, theme='classic'):
+    theme_assets = get_theme_assets('connect4', theme)
+    player_piece = theme_assets.image('player1.png' if piece == 1 else 'player2.png')
+
     _, board_height = board_img.size
-    player1_piece = Image.open(f"connect4/assets/{theme}/player1.png")
-    player2_piece = Image.open(f"connect4/assets/{theme}/player2.png")
+    piece_x = get_piece_x(row_idx, col_idx)
+    piece_y = get_piece_y(row_idx, col_idx, board_height)
+    board_img.paste(player_piece, (piece_x, piece_y), player_piece)
+
+    return board_img
+
+
+def render_board(board, theme='classic'):
+    board_img = get_theme_assets('connect4', theme).image('board.png').copy()
 
     for row_idx, row in enumerate(board):
         for col_idx, piece in enumerate(row):
             if piece != 0:
-                piece_x = get_piece_x(row_idx, col_idx)
-                piece_y = get_piece_y(row_idx, col_idx, board_height)
-                # Add players piece
-                player_piece = player1_piece if piece == 1 else player2_piece
-                board_img.paste(player_piece, (piece_x, piece_y), player_piece)
+                board_img = add_piece(board_img, row_idx, col_idx, piece, theme=theme)
 
     return board_img
+
+
+def get_overlay(latest_move, winning_moves):
+    """What `add_overlay` will draw, used to tell identical renders apart"""
+    if not winning_moves:
+        return ['latest_move', latest_move]
+    return ['won', sorted({cell for win in winning_moves for cell in win})]
+
+
+def add_overlay(board_img, latest_move, winning_moves, theme='classic'):
+    # Only render the last move OR the winning pieces
+    if not winning_moves:
+        return add_lastest_move_overlay(board_img, latest_move, theme=theme)
+    return add_won_overlay(board_img, winning_moves, theme=theme)
+
+
+def render_board_png(board, latest_move, winning_moves, theme='classic'):
+    board_img = render_board(board, theme=theme)
+    board_img = add_overlay(board_img, latest_move, winning_moves, theme=theme)
+    return core_utils.encode_image(board_img)
@@ -0,0 +1,129 @@
+import os
+import time
+import uuid
+import logging
+import threading
+
+import utils as core_utils
+from utils import redis_client
+from render_cache import render_cache
+from batch_delete import batch_deleter
+
+logger = logging.getLogger(__name__)
+
+
+class DeleteQueue:
+    """Delete superseded board images in the background
+
+    Urls go into a redis sorted set scored by when they can be deleted, which
+    gives slack's image proxy time to fetch the old image. Any worker can drain
+    the queue. Claimed entries are pushed into the future rather than removed,
+    so if a worker dies mid delete another one picks them up again later.
+    """
+
+    key = 'render-delete-queue'
+
+    # Entries whose image was already released, only the delete is left to retry
+    released = 'released:'
+
+    # Claim up to ARGV[2] due entries by moving them ARGV[3] seconds into the future
+    _claim_script = """
+    local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+    for _, member in ipairs(due) do
+        redis.call('ZADD', KEYS[1], ARGV[1] + ARGV[3], member)
+    end
+    return due
+    """
+
+    def __init__(self, client, grace_period=60, batch_size=500, interval=10, claim_timeout=300):
+        self.client = client
+        self.grace_period = grace_period
+        self.batch_size = batch_size
+        self.interval = interval
+        self.claim_timeout = claim_timeout
+        self._claim = client.register_script(self._claim_script)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.drained = 0
+
+    def push(self, url):
+        # The same image can be released by more then one game, keep each release as its own entry
+        member = f"{uuid.uuid4().hex} {url}"
+        self.client.zadd(self.key, {member: time.time() + self.grace_period})
+        with self._lock:
+            self.queued += 1
+
+    def drain(self):
+        """Delete everything past its grace period
+
+        Returns:
+            int: Number of queue entries handled
+        """
+        now = time.time()
+        members = self._claim(keys=[self.key], args=[now, self.batch_size, self.claim_timeout])
+        if not members:
+            return 0
+
+        done = []
+        to_delete = {}
+        released = {}
+        for member in members:
+            member = member.decode('utf-8')
+            entry, url = member.split(' ', 1)
+            if entry.startswith(self.released):
+                to_delete[member] = url
+            # Only now drop the games reference, another game may have started showing it during the grace period
+            elif render_cache.release(url):
+                # Never release it again if the delete has to be retried
+                released[member] = f"{self.released}{entry} {url}"
+                to_delete[released[member]] = url
+            else:
+                done.append(member)
+        if released:
+            pipe = self.client.pipeline()
+            pipe.zrem(self.key, *released)
+            pipe.zadd(self.key, {member: now + self.claim_timeout for member in released.values()})
+            pipe.execute()
+
+        # Safe even if a game has rendered the same board since, every upload has its own name
+        failed = set(batch_deleter.delete([core_utils.get_file_key(url) for url in to_delete.values()]))
+        # Leave failed ones claimed, they will be tried again once the claim times out
+        done.extend(member for member, url in to_delete.items() if core_utils.get_file_key(url) not in failed)
+        if done:
+            self.client.zrem(self.key, *done)
+
+        with self._lock:
+            self.drained += len(done)
+        return len(members)
+
+    def _run(self):
+        while True:
+            try:
+                # Keep going while there is a backlog
+                while self.drain() >= self.batch_size:
+                    pass
+            except Exception:
+                logger.exception("Failed draining the delete queue")
+            time.sleep(self.interval)
+
+    def start(self):
+        """Start draining in a background thread of this process"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='delete-queue', daemon=True)
+                self._thread.start()
+
+    def stats(self):
+        pending = self.client.zcard(self.key)
+        with self._lock:
+            return {
+                'queued': self.queued,
+                'drained': self.drained,
+                'pending': pending,
+            }
+
+
+delete_queue = DeleteQueue(redis_client,
+                           grace_period=float(os.getenv('DELETE_GRACE_PERIOD', 60)),
+                           interval=float(os.getenv('DELETE_QUEUE_INTERVAL', 10)))
@@ -0,0 +1,352 @@
+"""Binary format for games kept in redis between moves
+
+Layout is a fixed header followed by the games fields:
+
+    magic (3s) | version (B) | game type (B) | flags (B) | payload
+
+Each game's payload starts with its fixed size fields, then all of its text
+(ids, theme, timestamps, urls) as one block of new line separated utf-8, then
+boards packed a few bits per cell and the move log a field at a time. Anything
+that can be worked out from other fields (player pieces, folders) is not
+stored. Unlike pickle nothing in here can run code when loading.
+"""
+import uuid
+import zlib
+import struct
+
+from connect4.game import Connect4
+from connect4.utils import Move
+from mastermind.game import Mastermind
+
+MAGIC = b'BRB'
+VERSION = 1
+HEADER = struct.Struct('<3sBBB')
+
+CONNECT4 = 1
+MASTERMIND = 2
+
+FLAG_ZLIB = 1
+# Small games do not shrink enough to be worth the time
+COMPRESS_MIN_SIZE = 256
+
+# Stands in for None in byte fields
+NONE_BYTE = 0xFF
+
+# game id, game state, current player's piece, latest move row & col, board rows & cols
+CONNECT4_FIELDS = struct.Struct('<16sBBBBBB')
+# game id, game state, holes, colors, guesses, colors in the history
+MASTERMIND_FIELDS = struct.Struct('<16sBBBBB')
+
+
+class CodecError(ValueError):
+    pass
+
+
+def _byte(value):
+    return NONE_BYTE if value is None else value
+
+
+def _from_byte(value):
+    return None if value == NONE_BYTE else value
+
+
+def _text(value):
+    # None is saved as an empty string, none of the optional fields are ever empty
+    return '' if value is None else value
+
+
+def _from_text(value):
+    return None if value == '' else value
+
+
+class _Writer:
+
+    def __init__(self):
+        self.buf = bytearray()
+
+    def pack(self, fmt, *values):
+        self.buf += struct.pack(fmt, *values)
+
+    def str_list(self, values):
+        """Strings without new lines, decoded all at once when loading"""
+        data = '\n'.join(values).encode('utf-8')
+        self.pack('<I', len(data))
+        self.buf += data
+
+    def pegs(self, values):
+        self.buf += bytes(_byte(value) for value in values)
+
+    def cells(self, values, bits):
+        """Pack small ints"""
+        packed = 0
+        for i, value in enumerate(values):
+            packed |= value << (i * bits)
+        self.buf += packed.to_bytes((len(values) * bits + 7) // 8, 'little')
+
+
+class _Reader:
+
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    def unpack(self, fmt):
+        if isinstance(fmt, str):
+            fmt = struct.Struct(fmt)
+        values = fmt.unpack_from(self.data, self.offset)
+        self.offset += fmt.size
+        return values
+
+    def take(self, size):
+        if self.offset + size > len(self.data):
+            raise CodecError("Game data is cut short")
+        value = bytes(self.data[self.offset:self.offset + size])
+        self.offset += size
+        return value
+
+    def str_list(self, count):
+        length, = self.unpack('<I')
+        values = self.take(length).decode('utf-8').split('\n') if length else []
+        if len(values) != count:
+            raise CodecError(f"Expected {count} strings, got {len(values)}")
+        return values
+
+    def pegs(self, count):
+        return [_from_byte(value) for value in self.take(count)]
+
+    def cells(self, count, bits):
+        mask = (1 << bits) - 1
+        packed = int.from_bytes(self.take((count * bits + 7) // 8), 'little')
+        return [(packed >> (i * bits)) & mask for i in range(count)]
+
+
+def _format_uuid(data):
+    # Same as str(uuid.UUID(bytes=data)) without the overhead
+    h = data.hex()
+    return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+
+
+def _write_connect4(w, game):
+    history = game.game_history
+    rows, cols = len(game.board), len(game.board[0])
+    w.buf += CONNECT4_FIELDS.pack(uuid.UUID(game.game_id).bytes,
+                                  _byte(history['game_state']),
+                                  game.pieces[game.current_player],
+                                  _byte(game.latest_move[0]),
+                                  _byte(game.latest_move[1]),
+                                  rows,
+                                  cols)
+    w.str_list([game.player1_id, game.player2_id, game.team_id, game.channel_id, game.theme,
+                history['platform'], history['start_time'], _text(history['end_time']),
+                _text(history['recap_url'])])
+    w.cells([piece for row in game.board for piece in row], 2)
+
+    if game.winning_moves is None:
+        w.pack('<B', NONE_BYTE)
+    else:
+        w.pack('<B', len(game.winning_moves))
+        for win in game.winning_moves:
+            w.pack('<B', len(win))
+            w.buf += bytes(row_idx * cols + col_idx for row_idx, col_idx in win)
+
+    moves = game.moves
+    w.pack('<H', len(moves))
+    w.buf += bytes(move.player for move in moves)
+    w.buf += bytes(_byte(move.column) for move in moves)
+    w.str_list([move.timestamp for move in moves] + [move.rendered_board_url for move in moves])
+
+
+def _read_connect4(r):
+    game_id, game_state, current_piece, latest_row, latest_col, rows, cols = r.unpack(CONNECT4_FIELDS)
+    (player1_id, player2_id, team_id, channel_id, theme,
+     platform, start_time, end_time, recap_url) = r.str_list(9)
+
+    game = Connect4.__new__(Connect4)
+    game.game_id = _format_uuid(game_id)
+    game.player1_id = player1_id
+    game.player2_id = player2_id
+    game.team_id = team_id
+    game.channel_id = channel_id
+    game.theme = theme
+    game.pieces = {
+        game.player1_id: 1,
+        game.player2_id: 2,
+    }
+    game.current_player = game.player1_id if current_piece == 1 else game.player2_id
+    game.latest_move = (_from_byte(latest_row), _from_byte(latest_col))
+
+    cells = r.cells(rows * cols, 2)
+    game.board = [cells[i:i + cols] for i in range(0, rows * cols, cols)]
+
+    num_wins, = r.unpack('<B')
+    if num_wins == NONE_BYTE:
+        game.winning_moves = None
+    else:
+        game.winning_moves = []
+        for _ in range(num_wins):
+            length, = r.unpack('<B')
+            game.winning_moves.append([divmod(cell, cols) for cell in r.take(length)])
+
+    num_moves, = r.unpack('<H')
+    players = r.take(num_moves)
+    played = r.take(num_moves)
+    text = r.str_list(num_moves * 2)
+    columns = [None if column == NONE_BYTE else column for column in played]
+    game.moves = list(map(Move._make, zip(players, columns, text[:num_moves], text[num_moves:])))
+
+    game.game_history = {
+        'platform': platform,
+        'game_id': game.game_id,
+        'start_time': start_time,
+        'end_time': _from_text(end_time),
+        'theme': game.theme,
+        'player1_id': game.player1_id,
+        'player2_id': game.player2_id,
+        'team_id': game.team_id,
+        'channel_id': game.channel_id,
+        'recap_url': _from_text(recap_url),
+        'game_state': _from_byte(game_state),
+    }
+    game.s3_root_folder = f"connect4/slack/{game.team_id}"
+    game._frame = None
+    game._frame_board = None
+    game._frame_version = None
+    game._bitboard = None
+    return game
+
+
+def _write_mastermind(w, game):
+    history = game.game_history
+    w.buf += MASTERMIND_FIELDS.pack(uuid.UUID(game.game_id).bytes,
+                                    _byte(history['game_state']),
+                                    game.num_holes,
+                                    game.num_colors,
+                                    game.num_guesses,
+                                    history['num_colors'])
+    w.str_list([game.player_id, game.player_name, game.team_id, game.channel_id, game.theme,
+                history['platform'], history['start_time'], _text(history['end_time'])])
+
+    public = game.board['public']
+    w.pegs(game.board['private'])
+    w.pack('<B', len(public))
+    w.pegs([peg for guess, _ in public for peg in guess])
+    w.buf += bytes(submitted for _, (_, submitted) in public)
+    # Feedback is always the black pegs, then white, then empty
+    w.buf += bytes(feedback.count('b') << 4 | feedback.count('w') for _, (feedback, _) in public)
+
+
+def _read_mastermind(r):
+    game_id, game_state, holes, colors, guesses, history_num_colors = r.unpack(MASTERMIND_FIELDS)
+    player_id, player_name, team_id, channel_id, theme, platform, start_time, end_time = r.str_list(8)
+
+    game = Mastermind.__new__(Mastermind)
+    game.game_id = _format_uuid(game_id)
+    game.player_id = player_id
+    game.player_name = player_name
+    game.team_id = team_id
+    game.channel_id = channel_id
+    game.theme = theme
+    game.num_holes = holes
+    game.num_colors = colors
+    game.num_guesses = guesses
+
+    private = r.pegs(holes)
+    num_rows, = r.unpack('<B')
+    row_guesses = r.pegs(num_rows * holes)
+    submitted = r.take(num_rows)
+    feedback = r.take(num_rows)
+    public = []
+    for row_idx in range(num_rows):
+        black, white = feedback[row_idx] >> 4, feedback[row_idx] & 0xF
+        public.append([row_guesses[row_idx * holes:(row_idx + 1) * holes],
+                       [['b'] * black + ['w'] * white + [None] * (holes - black - white), submitted[row_idx]]])
+    game.board = {
+        'private': private,
+        'public': public,
+    }
+
+    game_state = _from_byte(game_state)
+    game.game_history = {
+        'platform': platform,
+        'game_id': game.game_id,
+        'start_time': start_time,
+        'end_time': _from_text(end_time),
+        'theme': game.theme,
+        'player_id': game.player_id,
+        'team_id': game.team_id,
+        'channel_id': game.channel_id,
+        'game_state': game_state,
+        'num_colors': history_num_colors,
+        # The board only gets added to the history once the game is over
+        'board': game.board if game_state is not None else {},
+    }
+    game.s3_root_folder = f"mastermind/slack/{game.team_id}"
+    game._frame = None
+    game._frame_version = None
+    game._dirty_rows = set()
+    return game
+
+
+GAME_TYPES = {
+    Connect4: (CONNECT4, _write_connect4),
+    Mastermind: (MASTERMIND, _write_mastermind),
+}
+
+READERS = {
+    CONNECT4: _read_connect4,
+    MASTERMIND: _read_mastermind,
+}
+
+
+def encode(game, compress=True):
+    """Serialize a game to be saved in redis
+
+    Args:
+        game (Connect4|Mastermind): Game to save
+        compress (bool): zlib the payload when it is big enough to be worth it
+
+    Returns:
+        bytes
+    """
+    game_type, writer = GAME_TYPES[type(game)]
+    w = _Writer()
+    writer(w, game)
+    payload = bytes(w.buf)
+
+    flags = 0
+    if compress and len(payload) >= COMPRESS_MIN_SIZE:
+        compressed = zlib.compress(payload, 1)
+        if len(compressed) < len(payload):
+            payload = compressed
+            flags |= FLAG_ZLIB
+
+    return HEADER.pack(MAGIC, VERSION, game_type, flags) + payload
+
+
+def decode(data):
+    """Load a game saved with `encode`
+
+    Rendered frames are not saved, the first render after loading does a full render.
+
+    Raises:
+        CodecError: Data is not a game or is from an unknown version
+    """
+    if data is None or len(data) < HEADER.size:
+        raise CodecError("No game data")
+    magic, version, game_type, flags = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise CodecError("Not a saved game")
+    if version != VERSION:
+        raise CodecError(f"Unknown game format version {version}")
+    if game_type not in READERS:
+        raise CodecError(f"Unknown game type {game_type}")
+
+    try:
+        payload = memoryview(data)[HEADER.size:]
+        if flags & FLAG_ZLIB:
+            payload = zlib.decompress(payload)
+        return READERS[game_type](_Reader(payload))
+    except CodecError:
+        raise
+    except (struct.error, zlib.error, ValueError) as e:
+        raise CodecError(f"Corrupt game data: {e}") from e
@@ -0,0 +1,258 @@
+import os
+import logging
+import threading
+import collections
+
+import game_codec
+from utils import redis_client
+
+logger = logging.getLogger(__name__)
+
+
+class GameConflict(Exception):
+    """The game was saved or finished by someone else since it was loaded"""
+    pass
+
+
+# response_url body telling just the player who clicked that their move lost to a GameConflict
+MOVE_NOT_APPLIED = {
+    'response_type': 'ephemeral',
+    'replace_original': False,
+    'text': "Your move was not applied, the game changed while it was being played. Please try again.",
+}
+
+
+class GameStore:
+    """Games kept in redis between moves
+
+    Each game is a hash of its encoded state and a version. Saves only go
+    through if the version is still the one that was loaded, so when two clicks
+    (or two workers) load the same game only the first one to save wins.
+    Checking the game still exists and writing it is a single round trip.
+
+    Games expire once nobody has touched them for `ttl` seconds, every load
+    and save pushes that back.
+
+    Games saved by this worker are also kept in memory, along with their
+    rendered frames. Loading one of those only fetches its version, the full
+    state is only fetched when someone else has saved the game since.
+    """
+
+    prefix = 'game:'
+
+    # Returns the new version, 0 if the version changed or -1 if the game is gone
+    _save_script = """
+    local version = redis.call('HGET', KEYS[1], 'version')
+    if not version then
+        return -1
+    end
+    if version ~= ARGV[1] then
+        return 0
+    end
+    redis.call('HSET', KEYS[1], 'state', ARGV[2], 'version', version + 1)
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+    return version + 1
+    """
+
+    # Returns 1 if deleted, 0 if the version changed or -1 if the game is gone
+    _delete_script = """
+    local version = redis.call('HGET', KEYS[1], 'version')
+    if not version then
+        return -1
+    end
+    if version ~= ARGV[1] then
+        return 0
+    end
+    redis.call('DEL', KEYS[1])
+    return 1
+    """
+
+    def __init__(self, client, hot_games=64, ttl=7 * 24 * 60 * 60):
+        self.client = client
+        self.hot_games = hot_games
+        self.ttl = ttl
+        # game id -> (version, game), most recently saved last
+        self._hot = collections.OrderedDict()
+        self._save = client.register_script(self._save_script)
+        self._delete = client.register_script(self._delete_script)
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.saves = 0
+        self.conflicts = 0
+        self.missing = 0
+        self.hot_hits = 0
+        self.hot_stale = 0
+
+    def key(self, game_id):
+        return f"{self.prefix}{game_id}"
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _keep_hot(self, game, version):
+        if self.hot_games <= 0:
+            return
+        with self._lock:
+            self._hot[game.game_id] = (version, game)
+            self._hot.move_to_end(game.game_id)
+            while len(self._hot) > self.hot_games:
+                self._hot.popitem(last=False)
+
+    def create(self, game):
+        """Save a new game
+
+        Returns:
+            int: Version to pass to `save` next
+        """
+        pipe = self.client.pipeline(transaction=False)
+        pipe.hset(self.key(game.game_id), mapping={'state': game_codec.encode(game), 'version': 1})
+        pipe.expire(self.key(game.game_id), self.ttl)
+        pipe.execute()
+        self._keep_hot(game, 1)
+        return 1
+
+    def load(self, game_id):
+        """
+        Returns:
+            tuple: The game and its version, (None, None) if the game is not in redis
+        """
+        # Taken out while in use, it only goes back in once saved
+        with self._lock:
+            hot_version, hot_game = self._hot.pop(game_id, (None, None))
+        if hot_game is not None:
+            pipe = self.client.pipeline(transaction=False)
+            pipe.hget(self.key(game_id), 'version')
+            pipe.expire(self.key(game_id), self.ttl)
+            version, _ = pipe.execute()
+            if version is None:
+                self._count('missing')
+                return None, None
+            if int(version) == hot_version:
+                self._count('hot_hits')
+                self._count('loads')
+                return hot_game, hot_version
+            self._count('hot_stale')
+
+        pipe = self.client.pipeline(transaction=False)
+        pipe.hmget(self.key(game_id), 'state', 'version')
+        pipe.expire(self.key(game_id), self.ttl)
+        (state, version), _ = pipe.execute()
+        if state is None:
+            self._count('missing')
+            return None, None
+        self._count('loads')
+        return game_codec.decode(state), int(version)
+
+    def save(self, game, version):
+        version = self.save_state(game.game_id, game_codec.encode(game), version)
+        self._keep_hot(game, version)
+        return version
+
+    def save_state(self, game_id, state, version):
+        """Save an encoded game if nobody else has since `version`
+
+        Returns:
+            int: The new version
+
+        Raises:
+            GameConflict: The game changed or is gone
+        """
+        new_version = self._save(keys=[self.key(game_id)], args=[version, state, self.ttl])
+        if new_version <= 0:
+            self._conflict(game_id, version, new_version)
+        self._count('saves')
+        return new_version
+
+    def finish(self, game_id, version):
+        """Remove a game that is over, if nobody else has changed it since `version`
+
+        Raises:
+            GameConflict: The game changed or is gone
+        """
+        result = self._delete(keys=[self.key(game_id)], args=[version])
+        if result <= 0:
+            self._conflict(game_id, version, result)
+
+    def _conflict(self, game_id, version, result):
+        self._count('conflicts')
+        reason = 'gone' if result < 0 else 'changed'
+        logger.info("Game was changed by someone else", extra={'game_id': game_id, 'version': version,
+                                                               'reason': reason})
+        raise GameConflict(f"Game {game_id} {reason} since version {version}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'loads': self.loads,
+                'saves': self.saves,
+                'conflicts': self.conflicts,
+                'missing': self.missing,
+                'hot_games': len(self._hot),
+                'hot_hits': self.hot_hits,
+                'hot_stale': self.hot_stale,
+            }
+
+
+class AsyncGameStore(GameStore):
+    """`GameStore` on an asyncio redis client, for the ASGI app
+
+    Same keys, scripts and versions, so games can be played through either app.
+    """
+
+    async def create(self, game):
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.hset(self.key(game.game_id), mapping={'state': game_codec.encode(game), 'version': 1})
+            pipe.expire(self.key(game.game_id), self.ttl)
+            await pipe.execute()
+        self._keep_hot(game, 1)
+        return 1
+
+    async def load(self, game_id):
+        with self._lock:
+            hot_version, hot_game = self._hot.pop(game_id, (None, None))
+        if hot_game is not None:
+            async with self.client.pipeline(transaction=False) as pipe:
+                pipe.hget(self.key(game_id), 'version')
+                pipe.expire(self.key(game_id), self.ttl)
+                version, _ = await pipe.execute()
+            if version is None:
+                self._count('missing')
+                return None, None
+            if int(version) == hot_version:
+                self._count('hot_hits')
+                self._count('loads')
+                return hot_game, hot_version
+            self._count('hot_stale')
+
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.hmget(self.key(game_id), 'state', 'version')
+            pipe.expire(self.key(game_id), self.ttl)
+            (state, version), _ = await pipe.execute()
+        if state is None:
+            self._count('missing')
+            return None, None
+        self._count('loads')
+        return game_codec.decode(state), int(version)
+
+    async def save(self, game, version):
+        version = await self.save_state(game.game_id, game_codec.encode(game), version)
+        self._keep_hot(game, version)
+        return version
+
+    async def save_state(self, game_id, state, version):
+        new_version = await self._save(keys=[self.key(game_id)], args=[version, state, self.ttl])
+        if new_version <= 0:
+            self._conflict(game_id, version, new_version)
+        self._count('saves')
+        return new_version
+
+    async def finish(self, game_id, version):
+        result = await self._delete(keys=[self.key(game_id)], args=[version])
+        if result <= 0:
+            self._conflict(game_id, version, result)
+
+
+game_store = GameStore(redis_client,
+                       hot_games=int(os.getenv('HOT_GAMES', 64)),
+                       ttl=int(os.getenv('GAME_TTL', 7 * 24 * 60 * 60)))
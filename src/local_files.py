@@ -0,0 +1,63 @@
+import os
+import hashlib
+import mimetypes
+
+import falcon
+
+import storage
+
+# Board renders are content addressed and recaps are written once, so browsers and
+# slack's image proxy never need to ask again. Sample theme images change between deploys.
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+MUTABLE_CACHE = 'public, max-age=300'
+
+
+class LocalFiles:
+    """Serve the public bucket when files are kept on local disk
+
+    Added as a sink since keys contain slashes, i.e. `/files/<bucket>/connect4/renders/<digest>.<upload>.png`
+    """
+
+    prefix = r'/files/(?P<bucket>[^/]+)/(?P<key>.+)'
+
+    def __init__(self, backend, public_buckets):
+        self.backend = backend
+        self.public_buckets = set(public_buckets)
+
+    def __call__(self, req, resp, bucket, key):
+        if req.method not in ('GET', 'HEAD'):
+            raise falcon.HTTPMethodNotAllowed(['GET', 'HEAD'])
+        # Game history and oauth tokens live next to the images, never hand those out
+        if bucket not in self.public_buckets:
+            raise falcon.HTTPNotFound()
+
+        try:
+            data = self.backend.get(bucket, key)
+        except (ValueError, FileNotFoundError, IsADirectoryError, NotADirectoryError):
+            raise falcon.HTTPNotFound()
+
+        etag = hashlib.sha1(data).hexdigest()
+        resp.etag = etag
+        resp.cache_control = [MUTABLE_CACHE if '/themes/' in f"/{key}" else IMMUTABLE_CACHE]
+        if any(tag in (etag, '*') for tag in req.if_none_match or []):
+            resp.status = falcon.HTTP_304
+            return
+
+        resp.content_type = mimetypes.guess_type(key)[0] or 'application/octet-stream'
+        resp.content_length = len(data)
+        if req.method == 'GET':
+            resp.data = data
+
+
+def get_local_files():
+    """Sink serving the rendered images, None unless using the local storage backend"""
+    if isinstance(storage.backend, storage.LocalStorage):
+        return LocalFiles(storage.backend, [os.environ['RENDERED_IMAGES_BUCKET']])
+    return None
+
+
+def add_local_files(api):
+    """Serve the rendered images from the api when using the local storage backend"""
+    files = get_local_files()
+    if files is not None:
+        api.add_sink(files, prefix=LocalFiles.prefix)
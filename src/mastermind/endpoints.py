@@ -1,15 +1,15 @@
-import os
+import copy
 import json
-import boto3
-import pickle
 import logging
-import requests
 import urllib.parse
 
 import mastermind.exceptions
-from utils import redis_client
+import game_codec
+from delete_queue import delete_queue
+from game_store import game_store, GameConflict, MOVE_NOT_APPLIED
+from slack_client import slack_client
+from themes import theme_registry
 from mastermind.game import Mastermind
-import mastermind.utils as mastermind_utils
 
 logger = logging.getLogger()
 
@@ -63,7 +63,7 @@ class SlackMastermind:
             if 'text' in data and data['text'][0].strip().lower() == 'themes':
                 resp.media = {
                     'replace_original': True,
-                    'blocks': mastermind_utils.get_sample_theme_blocks(),
+                    'blocks': theme_registry.sample_blocks('mastermind'),
                 }
                 return
 
@@ -74,7 +74,7 @@ class SlackMastermind:
                 theme = data['text'][0].split(' ')[-1]
 
             # Theme passed in does not exist
-            if theme not in mastermind_utils.get_theme_list():
+            if theme_registry.get('mastermind', theme) is None:
                 resp.media = {'text': f'The theme *{theme}* is not found'}
                 return
 
@@ -87,13 +87,15 @@ class SlackMastermind:
                 theme=theme)
 
             board_url = current_game.start()
-            redis_client.set(current_game.game_id, pickle.dumps(current_game))
+            game_store.create(current_game)
 
+            # Requests are handled on many threads at once, so each one fills in its own copy of the blocks
+            blocks = copy.deepcopy(default_message_blocks)
             header_message = f"<@{player_id}>'s game"
-            default_message_blocks[0]['text']['text'] = header_message
-            default_message_blocks[1]['image_url'] = board_url
+            blocks[0]['text']['text'] = header_message
+            blocks[1]['image_url'] = board_url
 
-            default_message_blocks[0]['block_id'] = current_game.game_id
+            blocks[0]['block_id'] = current_game.game_id
 
             # Add undo button
             buttons = [
@@ -104,16 +106,14 @@ class SlackMastermind:
                  }
             ]
             # Add color buttons
-            with open(f'mastermind/assets/{theme}/colors.csv', 'r') as f:
-                for color in f.readlines():
-                    i, name = color.split(',')
-                    buttons.append(
-                        {"type": "button",
-                         "action_id": f"mastermind-move-{i}",
-                         "text": {"type": "plain_text", "text": f"{name}"},
-                         "value": f"{i}",
-                         }
-                    )
+            for i, name in theme_registry.get('mastermind', theme).colors:
+                buttons.append(
+                    {"type": "button",
+                     "action_id": f"mastermind-move-{i}",
+                     "text": {"type": "plain_text", "text": f"{name}"},
+                     "value": f"{i}",
+                     }
+                )
             # Add submit button
             buttons.append(
                 {"type": "button",
@@ -122,7 +122,7 @@ class SlackMastermind:
                  "value": "-2",
                  }
             )
-            default_message_blocks[2]['elements'] = buttons
+            blocks[2]['elements'] = buttons
 
         except Exception:
             logger.exception("Failed to start Mastermind game")
@@ -132,32 +132,29 @@ class SlackMastermind:
                          'if this keeps happening please create an issue in github'),
             }
         else:
-            logger.warning(json.dumps(default_message_blocks))
+            logger.warning(json.dumps(blocks))
             # Post the new game
             resp.media = {
                 # 'replace_original': True,  # Does this even  work when using in_channel?
                 'response_type': 'in_channel',
-                'blocks': default_message_blocks,
+                'blocks': blocks,
             }
 
 
-def slack_mastermind_move(action_details):
-    blocks = action_details['message']['blocks']
-
-    game_id = blocks[0]['block_id']
-    current_game = pickle.loads(redis_client.get(game_id))
+def play_move(current_game, blocks, action_details):
+    """Play the clicked color or action, rendering and uploading the new board
 
-    if action_details['user']['id'] != current_game.player_id:
-        return None
+    Moves that are not allowed right now show why in the message instead.
 
+    Returns:
+        tuple: New board url (None if nothing changed) and game state
+    """
     color = current_game.parse_move(action_details)
 
     # Set message back to default
     blocks[-2]['text']['text'] = default_message_blocks[-2]['text']['text']
-
-    game_state = None
     try:
-        board_url, game_state = current_game.make_move(color)
+        return current_game.make_move(color)
     except (mastermind.exceptions.MustSubmitGuess,
             mastermind.exceptions.NothingToUndo,
             mastermind.exceptions.MustCompleteCode) as e:
@@ -167,16 +164,14 @@ def slack_mastermind_move(action_details):
         del blocks[1]['image_height']
         del blocks[1]['image_bytes']
         del blocks[1]['fallback']
-    else:
-        # Delete previous game board
-        prev_board_url = blocks[1]['image_url']
-        s3 = boto3.client('s3', endpoint_url=os.getenv('S3_ENDPOINT', None))
-        s3.delete_object(
-            Bucket=os.environ['RENDERED_IMAGES_BUCKET'],
-            Key=f"{current_game.s3_root_folder}/{prev_board_url.split('/')[-1]}"
-        )
+        return None, None
+
+
+def update_move_blocks(blocks, current_game, board_url, game_state):
+    """Update the game message to show the move that was played"""
+    if board_url is not None:
         # Better to create a new block because the one returned has data that breaks the api if returned
-        new_image = default_message_blocks[1].copy()
+        new_image = copy.deepcopy(default_message_blocks[1])
         new_image['image_url'] = board_url
         blocks[1] = new_image
 
@@ -198,14 +193,58 @@ def slack_mastermind_move(action_details):
     blocks[-2]['text']['text'] = blocks[-2]['text']['text'].replace('+', ' ')
     blocks[-1]['elements'][0]['text'] = blocks[-1]['elements'][0]['text'].replace('+', ' ')
 
-    r = requests.post(action_details['response_url'], json=action_details['message'])
+
+def slack_mastermind_move(action_details):
+    blocks = action_details['message']['blocks']
+
+    game_id = blocks[0]['block_id']
+    current_game, version = game_store.load(game_id)
+    if current_game is None:
+        return None
+
+    if action_details['user']['id'] != current_game.player_id:
+        return None
+
+    # To put back if slack does not take the update
+    previous_state = game_codec.encode(current_game)
+    previous_board_url = blocks[1]['image_url']
+    board_url, game_state = play_move(current_game, blocks, action_details)
+    if board_url is not None:
+        try:
+            if game_state is not None:
+                # Nothing more can be done with a finished game
+                game_store.finish(game_id, version)
+            else:
+                version = game_store.save(current_game, version)
+        except GameConflict:
+            # Another click got there first, this board will never be shown
+            delete_queue.push(board_url)
+            slack_client.post(action_details['response_url'], team_id=action_details['team']['id'],
+                              json=MOVE_NOT_APPLIED)
+            return None
+        if game_state is not None:
+            # Only now that this move is the one that ended the game
+            current_game.save_history()
+
+    update_move_blocks(blocks, current_game, board_url, game_state)
+
+    r = slack_client.post(action_details['response_url'], team_id=action_details['team']['id'],
+                          json=action_details['message'])
     if r.json().get('ok') is True:
-        if redis_client.exists(game_id):
-            # only save game status if updating slack was successful and game is still playable
-            redis_client.set(game_id, pickle.dumps(current_game))
+        if board_url is not None:
+            # Delete previous game board once slack has had time to fetch the new one
+            delete_queue.push(previous_board_url)
     else:
         logger.error("Updating mastermind failed",
                      extra={'game_id': game_id,
                             'platform': 'slack',
                             'blocks': blocks,
                             'response': r.text})
+        if board_url is not None and game_state is None:
+            # Only keep the move if the player can see it
+            try:
+                game_store.save_state(game_id, previous_state, version)
+            except GameConflict:
+                pass
+            else:
+                delete_queue.push(board_url)
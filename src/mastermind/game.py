@@ -1,9 +1,12 @@
 import os
 import uuid
-import time
 import json
-import boto3
+import storage
 import utils as core_utils
+from batch_delete import batch_deleter
+from render_cache import render_cache, render_key, render_name
+from render_service import render_service
+from themes import theme_registry
 import mastermind.utils as mastermind_utils
 
 
@@ -28,6 +31,12 @@ class Mastermind:
             self.num_guesses,
         )
 
+        # Last rendered board, the theme version it was drawn with and the rows changed since,
+        # only those rows get repainted. Not saved when pickled, the first render after loading will do a full render
+        self._frame = None
+        self._frame_version = None
+        self._dirty_rows = set()
+
         self.game_history = {
             'platform': 'slack',
             'game_id': self.game_id,
@@ -43,29 +52,75 @@ class Mastermind:
             'board': {},
         }
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_frame'] = None
+        state['_frame_version'] = None
+        state['_dirty_rows'] = set()
+        return state
+
     def start(self):
         return self.render_board()
 
-    def render_board(self):
-        board_name = f"{self.s3_root_folder}/{self.game_id}_{time.time()}"
-        board_img = mastermind_utils.render_board(self.board, theme=self.theme)
-        return core_utils.save_render(board_img, board_name)
+    def render_board(self, final=False):
+        # The theme version changes when its images do, so boards drawn with the old ones are not reused
+        version = theme_registry.version('mastermind', self.theme)
+        if final:
+            # The finished message shows the last board for good, so the game keeps its own copy
+            # instead of sharing one that is deleted once the other games showing it move on
+            digest = None
+            board_name = f"{self.s3_root_folder}/{self.game_id}_final"
+        else:
+            # The code is never drawn, only what the player can see
+            digest = render_key('mastermind', self.theme, version, self.board['public'])
+            board_url = render_cache.get_url(digest)
+            if board_url is not None:
+                # Already rendered by this or another game, changed rows get repainted on the next render
+                return board_url
+            board_name = render_name('mastermind/renders', digest)
+
+        if render_service.enabled:
+            # Render processes do not have the previous frame, so they render the full board
+            board_png = render_service.render(mastermind_utils.render_board_png, self.board, theme=self.theme)
+            board_url = core_utils.upload_render(board_png, board_name)
+        else:
+            if self._frame is None or self._frame_version != version:
+                self._frame = mastermind_utils.render_board(self.board, theme=self.theme)
+                self._frame_version = version
+            elif self._dirty_rows:
+                self._frame = mastermind_utils.render_rows(self._frame,
+                                                           self.board,
+                                                           sorted(self._dirty_rows),
+                                                           theme=self.theme)
+            self._dirty_rows.clear()
+            board_url = core_utils.save_render(self._frame, board_name)
+
+        if digest is not None:
+            cached_url = render_cache.add(digest, board_url)
+            if cached_url != board_url:
+                # Another game rendered the same board at the same time, show theirs and drop this copy
+                batch_deleter.delete([core_utils.get_file_key(board_url)])
+                board_url = cached_url
+        return board_url
 
     def parse_move(self, action):
         return int(action['actions'][0]['value'])
 
     def make_move(self, move):
+        # Moves only ever change the row currently being guessed
+        self._dirty_rows.add(mastermind_utils._find_guess_index(self.board))
         self.board, game_state = mastermind_utils.make_move(self.board, move)
         if game_state is not None:
             # Game over
             self.game_history['board'] = self.board
             self.game_history['game_state'] = game_state
             self.game_history['end_time'] = core_utils.get_ts()
-            s3 = boto3.client('s3', endpoint_url=os.getenv('S3_ENDPOINT', None))
-            s3.put_object(
-                Body=json.dumps(self.game_history).encode('utf-8'),
-                Bucket=os.environ['GAME_HISTORY_BUCKET'],
-                Key=f"{self.s3_root_folder}/{self.game_id}_history.json",
-                ContentType='application/json')
-
-        return self.render_board(), game_state
+
+        return self.render_board(final=game_state is not None), game_state
+
+    def save_history(self):
+        """Save a finished game, once its last move has been saved"""
+        storage.put(os.environ['GAME_HISTORY_BUCKET'],
+                    f"{self.s3_root_folder}/{self.game_id}_history.json",
+                    json.dumps(self.game_history).encode('utf-8'),
+                    'application/json')
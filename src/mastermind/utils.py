@@ -1,10 +1,11 @@
 import os
 import random
 from PIL import Image
-from PIL import ImageFont
 from PIL import ImageDraw
 
+import utils as core_utils
 import mastermind.exceptions
+from assets import get_theme_assets
 
 
 def get_theme_list():
@@ -105,34 +106,10 @@ def _find_guess_index(board):
             return idx
 
 
-def get_sample_theme_blocks():
-    samples = []
-    for theme in get_theme_list():
-        try:
-            with open(os.path.join('mastermind', 'assets', theme, 'about.txt'), 'r') as f:
-                theme_about_text = f.read().strip()
-        except FileNotFoundError:
-            theme_about_text = ''
-
-        samples.append({
-            "type": "section",
-            "text": {
-                "type": "mrkdwn",
-                "text": f"Theme: *{theme}*\n{theme_about_text[:200]}"
-            },
-            "accessory": {
-                "type": "image",
-                "image_url": f"{os.getenv('S3_ENDPOINT', 'https://s3.amazonaws.com')}/{os.environ['RENDERED_IMAGES_BUCKET']}/mastermind/themes/sample-{theme}.png",  # noqa:E501
-                "alt_text": theme
-            }
-        })
-    return samples
-
-
 def render_board_str(board, theme='classic'):
     image = Image.new("RGBA", (600, 400), (255, 255, 255))
     draw = ImageDraw.Draw(image)
-    font = ImageFont.truetype("Lato-Bold.ttf", 16)
+    font = get_theme_assets('mastermind', theme).font("Lato-Bold.ttf", 16)
 
     plays = ''
     for play in board['public']:
@@ -152,42 +129,39 @@ Game Board
     return image
 
 
-def render_board(board, theme='classic'):
-    # TODO: Make dynamic. Currently only works with 4 holes, 6 colors, and 10 guesses
-    # TODO: Make more efficient. Currently has to re render the full board each time
-    #       (use last board and just add/remove whats needed?)
-    hole_img = Image.open(f"mastermind/assets/{theme}/hole.png")
+def render_empty_board(theme='classic', holes=4, guesses=10):
+    # TODO: Make dynamic. Currently the feedback only works with 4 holes
+    theme_assets = get_theme_assets('mastermind', theme)
+    hole_img = theme_assets.image('hole.png')
     hole_width, hole_height = hole_img.size
 
     # Create a 2 x 2 key image
     empty_feedback_img = Image.new("RGBA", (hole_width, hole_height), (255, 255, 255))
     small_hole_width = int(hole_width / 2)
     small_hole_height = int(hole_height / 2)
-    small_hole_img = hole_img.resize((small_hole_width, small_hole_height), Image.ANTIALIAS)
+    small_hole_img = theme_assets.resized('hole.png', (small_hole_width, small_hole_height))
     empty_feedback_img.paste(small_hole_img, (0, 0), small_hole_img)
     empty_feedback_img.paste(small_hole_img, (0, small_hole_height), small_hole_img)
     empty_feedback_img.paste(small_hole_img, (small_hole_width, 0), small_hole_img)
     empty_feedback_img.paste(small_hole_img, (small_hole_width, small_hole_height), small_hole_img)
 
-    # Create row with 1 key and 4 holes
-    empty_row_img = Image.new("RGBA", (hole_width * 5, hole_height), (255, 255, 255))
+    # Create row with 1 key and a hole for each peg
+    empty_row_img = Image.new("RGBA", (hole_width * (holes + 1), hole_height), (255, 255, 255))
     empty_row_img.paste(empty_feedback_img, (0, 0), empty_feedback_img)
-    empty_row_img.paste(hole_img, (hole_width * 1, 0), hole_img)
-    empty_row_img.paste(hole_img, (hole_width * 2, 0), hole_img)
-    empty_row_img.paste(hole_img, (hole_width * 3, 0), hole_img)
-    empty_row_img.paste(hole_img, (hole_width * 4, 0), hole_img)
+    for i in range(1, holes + 1):
+        empty_row_img.paste(hole_img, (hole_width * i, 0), hole_img)
 
     # Create full empty game board
-    row_sep_img = Image.open(f"mastermind/assets/{theme}/row_sep.png")
+    row_sep_img = theme_assets.image('row_sep.png')
     sep_height = row_sep_img.size[1]
     row_width, row_height = empty_row_img.size
-    board_height = (row_height * len(board['public'])) + (sep_height * (len(board['public']) - 1))
+    board_height = (row_height * guesses) + (sep_height * (guesses - 1))
     empty_board_img = Image.new("RGBA", (row_width, board_height), (255, 255, 255))
-    for i in range(0, len(board['public'])):
+    for i in range(0, guesses):
         paste_y = (row_height * i) + (sep_height * i)
         if i != 0:
             # Do not do on the last one
-            for j in range(0, len(board['public'][0][0]) + 1):
+            for j in range(0, holes + 1):
                 empty_board_img.paste(
                     row_sep_img,
                     (hole_width * j, paste_y - 2)
@@ -198,43 +172,98 @@ def render_board(board, theme='classic'):
             empty_row_img
         )
 
-    feedback_img = {
-        'w': Image.open(f"mastermind/assets/{theme}/peg-w.png").resize((small_hole_width, small_hole_height), Image.ANTIALIAS),  # noqa: E501
-        'b': Image.open(f"mastermind/assets/{theme}/peg-b.png").resize((small_hole_width, small_hole_height), Image.ANTIALIAS),  # noqa: E501
-    }
-    peg_img = {
-        0: Image.open(f"mastermind/assets/{theme}/peg-0.png"),
-        1: Image.open(f"mastermind/assets/{theme}/peg-1.png"),
-        2: Image.open(f"mastermind/assets/{theme}/peg-2.png"),
-        3: Image.open(f"mastermind/assets/{theme}/peg-3.png"),
-        4: Image.open(f"mastermind/assets/{theme}/peg-4.png"),
-        5: Image.open(f"mastermind/assets/{theme}/peg-5.png"),
-    }
+    return empty_board_img
+
+
+def get_empty_board(theme='classic', holes=4, guesses=10):
+    """Shared empty board for the geometry, `.copy()` it before drawing on it"""
+    return get_theme_assets('mastermind', theme).memoize(
+        ('empty_board', holes, guesses),
+        lambda: render_empty_board(theme=theme, holes=holes, guesses=guesses),
+    )
+
+
+def add_row_pegs(board_img, row, row_idx, theme='classic'):
+    """Paste the feedback and guess pegs of a single row
+
+    Args:
+        board_img (PIL.Image): Board to paste the pegs on to
+        row (list): Row from the public board
+        row_idx (int): Row index counting from the top of the image
+    """
+    theme_assets = get_theme_assets('mastermind', theme)
+    hole_width, hole_height = theme_assets.image('hole.png').size
+    sep_height = theme_assets.image('row_sep.png').size[1]
+    small_hole_width = int(hole_width / 2)
+    small_hole_height = int(hole_height / 2)
+
     fb_rel_location = [
         (0, 0),
         (0, small_hole_height),
         (small_hole_width, 0),
         (small_hole_width, small_hole_height),
     ]
+    row_y = (hole_height * row_idx) + (sep_height * row_idx)
+    # Add feedback
+    for fb_idx, fb in enumerate(row[1][0]):
+        if fb is not None:
+            feedback_img = theme_assets.resized(f'peg-{fb}.png', (small_hole_width, small_hole_height))
+            board_img.paste(
+                feedback_img,
+                (fb_rel_location[fb_idx][0], fb_rel_location[fb_idx][1] + row_y),
+                feedback_img
+            )
+
+    # Add players guess
+    for peg_idx, peg in enumerate(row[0], start=1):
+        if peg is not None:
+            peg_img = theme_assets.image(f'peg-{peg}.png')
+            board_img.paste(
+                peg_img,
+                (peg_idx * hole_width, row_y),
+                peg_img
+            )
+
+    return board_img
+
+
+def render_rows(board_img, board, guess_idxs, theme='classic'):
+    """Repaint only the given rows of an already rendered board
+
+    Args:
+        board_img (PIL.Image): Board rendered by `render_board`
+        board (dict): Mastermind game board data
+        guess_idxs (iterable): Indexes of the changed rows in `board['public']`
+    """
+    holes = len(board['public'][0][0])
+    guesses = len(board['public'])
+    empty_board_img = get_empty_board(theme=theme, holes=holes, guesses=guesses)
+    theme_assets = get_theme_assets('mastermind', theme)
+    row_height = theme_assets.image('hole.png').size[1]
+    sep_height = theme_assets.image('row_sep.png').size[1]
+
+    for guess_idx in guess_idxs:
+        # Rows are drawn with the first guess at the bottom
+        row_idx = guesses - 1 - guess_idx
+        row_y = (row_height * row_idx) + (sep_height * row_idx)
+        row_box = (0, row_y, board_img.size[0], row_y + row_height)
+        board_img.paste(empty_board_img.crop(row_box), row_box)
+        board_img = add_row_pegs(board_img, board['public'][guess_idx], row_idx, theme=theme)
+
+    return board_img
+
+
+def render_board(board, theme='classic'):
+    # TODO: Make dynamic. Currently only works with 4 holes, 6 colors, and 10 guesses
+    board_img = get_empty_board(theme=theme,
+                                holes=len(board['public'][0][0]),
+                                guesses=len(board['public'])).copy()
     # Add pegs to board, row by row
     for row_idx, row in enumerate(board['public'][::-1]):
-        # Add feedback
-        row_y = (row_height * row_idx) + (sep_height * row_idx)
-        for fb_idx, fb in enumerate(row[1][0]):
-            if fb is not None:
-                empty_board_img.paste(
-                    feedback_img[fb],
-                    (fb_rel_location[fb_idx][0], fb_rel_location[fb_idx][1] + row_y),
-                    feedback_img[fb]
-                )
+        board_img = add_row_pegs(board_img, row, row_idx, theme=theme)
 
-        # Add players guess
-        for peg_idx, peg in enumerate(row[0], start=1):
-            if peg is not None:
-                empty_board_img.paste(
-                    peg_img[peg],
-                    (peg_idx * hole_width, row_y),
-                    peg_img[peg]
-                )
+    return board_img
 
-    return empty_board_img
+
+def render_board_png(board, theme='classic'):
+    return core_utils.encode_image(render_board(board, theme=theme))
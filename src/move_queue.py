@@ -0,0 +1,127 @@
+import os
+import time
+import zlib
+import queue
+import logging
+import threading
+import collections
+
+logger = logging.getLogger(__name__)
+
+# response_url body telling just the player who clicked that their move was not taken
+MOVE_BUSY = {
+    'response_type': 'ephemeral',
+    'replace_original': False,
+    'text': "Too many moves are being played right now, yours was not played. Please try again in a moment.",
+}
+
+
+class MoveQueue:
+    """Play moves in background threads so slack gets its response right away
+
+    Slack gives up on an interaction after 3 seconds, which loading, rendering,
+    uploading and posting the new board can take longer than. Each game always
+    goes to the same worker so its clicks are played in the order they came in.
+    Workers have a bounded queue, once it is full a move waits up to
+    `put_timeout` seconds for room and is turned away after that. It is never
+    played outside its game's queue, where it could race the moves already
+    waiting. With no workers everything runs inline.
+    """
+
+    def __init__(self, workers=4, max_queue=64, put_timeout=0.5):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.put_timeout = put_timeout
+        self._queues = []
+        self._queues_pid = None
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.inline = 0
+        self.rejected = 0
+        self.processed = 0
+        self.failed = 0
+        # Recent (seconds waiting, seconds running)
+        self.timings = collections.deque(maxlen=200)
+
+    @property
+    def enabled(self):
+        return self.workers > 0
+
+    def _get_queues(self):
+        with self._lock:
+            # Threads do not survive a fork (gunicorn forks workers after import)
+            if self._queues_pid != os.getpid():
+                self._queues = [queue.Queue(maxsize=max(1, self.max_queue // self.workers))
+                                for _ in range(self.workers)]
+                for idx, work in enumerate(self._queues):
+                    threading.Thread(target=self._run, args=(work,), name=f'move-queue-{idx}', daemon=True).start()
+                self._queues_pid = os.getpid()
+            return self._queues
+
+    def _play(self, func, action_details, submitted):
+        started = time.time()
+        try:
+            func(action_details)
+        except Exception:
+            logger.exception("Failed playing move", extra={'move': func.__name__})
+            with self._lock:
+                self.failed += 1
+        finally:
+            finished = time.time()
+            with self._lock:
+                self.processed += 1
+                self.timings.append((started - submitted, finished - started))
+
+    def _run(self, work):
+        while True:
+            func, action_details, submitted = work.get()
+            self._play(func, action_details, submitted)
+
+    def submit(self, game_id, func, action_details):
+        """Play `func(action_details)` on the worker for the game
+
+        Returns:
+            bool: If the move was taken, False if the game's worker is too far behind
+                and the player should be told to try again (see `MOVE_BUSY`)
+        """
+        submitted = time.time()
+        if not self.enabled:
+            with self._lock:
+                self.inline += 1
+            self._play(func, action_details, submitted)
+            return True
+
+        queues = self._get_queues()
+        work = queues[zlib.crc32(game_id.encode('utf-8')) % len(queues)]
+        try:
+            work.put((func, action_details, submitted), timeout=self.put_timeout)
+        except queue.Full:
+            logger.warning("Move queue full, turning move away", extra={'game_id': game_id})
+            with self._lock:
+                self.rejected += 1
+            return False
+        with self._lock:
+            self.queued += 1
+        return True
+
+    def stats(self):
+        with self._lock:
+            wait_times = [t[0] for t in self.timings]
+            run_times = [t[1] for t in self.timings]
+            return {
+                'workers': self.workers,
+                'queue_depth': sum(work.qsize() for work in self._queues),
+                'max_queue': self.max_queue,
+                'queued': self.queued,
+                'inline': self.inline,
+                'rejected': self.rejected,
+                'processed': self.processed,
+                'failed': self.failed,
+                'avg_wait_ms': round(sum(wait_times) / len(wait_times) * 1000, 3) if wait_times else 0,
+                'avg_move_ms': round(sum(run_times) / len(run_times) * 1000, 3) if run_times else 0,
+            }
+
+
+move_queue = MoveQueue(workers=int(os.getenv('MOVE_WORKERS', 4)),
+                       max_queue=int(os.getenv('MOVE_QUEUE_SIZE', 64)),
+                       put_timeout=float(os.getenv('MOVE_QUEUE_WAIT', 0.5)))
@@ -0,0 +1,61 @@
+import argparse
+import collections
+
+from utils import redis_client
+from game_store import game_store
+from delete_queue import delete_queue
+from render_cache import RedisRenderIndex
+from access_tokens import access_tokens
+
+# Anything else is left over from older versions (games and tokens used to be saved by id only)
+# Everything expires but the delete queue, which only holds what is waiting to be deleted
+KEY_CLASSES = [
+    ('games', game_store.prefix),
+    ('access tokens', access_tokens.prefix),
+    ('render cache', RedisRenderIndex.prefix),
+    ('delete queue', delete_queue.key),
+]
+
+
+def count_keys(client, sample=0):
+    """Keys, memory and keys that never expire by class
+
+    Args:
+        sample (int): Only check every Nth key and scale its numbers up, 0 to check every key
+
+    Returns:
+        tuple: Counters of keys, bytes and keys without a ttl
+    """
+    counts = collections.Counter()
+    memory = collections.Counter()
+    no_ttl = collections.Counter()
+    for idx, key in enumerate(client.scan_iter(count=1000)):
+        key = key.decode('utf-8', errors='replace')
+        key_class = next((name for name, prefix in KEY_CLASSES if key.startswith(prefix)), 'other')
+        counts[key_class] += 1
+        if sample and idx % sample:
+            continue
+        pipe = client.pipeline(transaction=False)
+        pipe.memory_usage(key)
+        pipe.ttl(key)
+        usage, ttl = pipe.execute()
+        memory[key_class] += (usage or 0) * (sample or 1)
+        if ttl == -1:
+            # Stands for the keys that were skipped too
+            no_ttl[key_class] += sample or 1
+    return counts, memory, no_ttl
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Count the keys in redis and the memory they use by what they are for")
+    parser.add_argument('--sample', type=int, default=0,
+                        help="Only check the memory of every Nth key and scale it up, 0 to check every key")
+    args = parser.parse_args()
+
+    counts, memory, no_ttl = count_keys(redis_client, sample=args.sample)
+
+    print(f"{'class':<20} {'keys':>10} {'memory':>12} {'no expiry':>10}")
+    for name in [name for name, _ in KEY_CLASSES] + ['other']:
+        print(f"{name:<20} {counts[name]:>10} {memory[name] / 1024:>10.1f}KB {no_ttl[name]:>10}")
+    print(f"{'total':<20} {sum(counts.values()):>10} {sum(memory.values()) / 1024:>10.1f}KB "
+          f"{sum(no_ttl.values()):>10}")
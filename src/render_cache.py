@@ -0,0 +1,199 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import threading
+
+from utils import redis_client
+
+
+def render_key(*state):
+    """Hash of everything that goes into a rendered image
+
+    Args:
+        *state: json serializable values, i.e. game name, theme, board and overlays
+
+    Returns:
+        str: hex digest used as the images file name
+    """
+    canonical = json.dumps(state, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+
+def render_name(folder, digest):
+    """Storage name for a new upload of a render
+
+    Every upload gets its own name, so deleting a released image can never remove
+    an upload of the same board that another game made in the meantime.
+    """
+    return f"{folder}/{digest}.{uuid.uuid4().hex[:12]}"
+
+
+def digest_from_url(url):
+    return url.rsplit('/', 1)[-1].split('.', 1)[0]
+
+
+class MemoryRenderIndex:
+    """Digest -> url index for a single process, for local use and tests"""
+
+    def __init__(self, ttl=7 * 24 * 60 * 60):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._urls = {}
+        self._refs = {}
+        # digest -> when it is forgotten
+        self._expires = {}
+
+    def _expire(self, digest):
+        if self._expires.get(digest, float('inf')) <= time.time():
+            self._urls.pop(digest, None)
+            self._refs.pop(digest, None)
+            self._expires.pop(digest, None)
+
+    def acquire(self, digest):
+        with self._lock:
+            self._expire(digest)
+            self._refs[digest] = self._refs.get(digest, 0) + 1
+            self._expires[digest] = time.time() + self.ttl
+            return self._urls.get(digest)
+
+    def add(self, digest, url):
+        with self._lock:
+            self._expire(digest)
+            self._expires[digest] = time.time() + self.ttl
+            return self._urls.setdefault(digest, url)
+
+    def release(self, digest):
+        with self._lock:
+            self._expire(digest)
+            if digest not in self._refs:
+                return True
+            if digest not in self._urls:
+                # Being rendered again by another game
+                return False
+            self._refs[digest] -= 1
+            if self._refs[digest] > 0:
+                return False
+            self._urls.pop(digest)
+            self._refs.pop(digest)
+            self._expires.pop(digest, None)
+            return True
+
+
+class RedisRenderIndex:
+    """Digest -> url index shared by every worker
+
+    Each game that shows an image holds a reference to it, the image can only
+    be deleted once the last reference is released. The index entry of an image
+    expires `ttl` seconds after a game last showed it, the same as an idle game,
+    so abandoned games do not keep it in redis. Only the entry goes, the image
+    stays in storage and is uploaded again by the next game that renders it.
+    """
+
+    # Each image is a hash of its url and references
+    prefix = 'render-cache:'
+
+    # Returns the url if it has already been rendered
+    _acquire_script = """
+    redis.call('HINCRBY', KEYS[1], 'refs', 1)
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+    return redis.call('HGET', KEYS[1], 'url')
+    """
+
+    # Returns the url that is cached, another game's if it added one first
+    _add_script = """
+    redis.call('HSETNX', KEYS[1], 'url', ARGV[1])
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+    return redis.call('HGET', KEYS[1], 'url')
+    """
+
+    # Returns 1 if nothing references the image anymore and it can be deleted
+    _release_script = """
+    if redis.call('EXISTS', KEYS[1]) == 0 then
+        return 1
+    end
+    if redis.call('HEXISTS', KEYS[1], 'url') == 0 then
+        -- Being rendered again by another game
+        return 0
+    end
+    if redis.call('HINCRBY', KEYS[1], 'refs', -1) > 0 then
+        return 0
+    end
+    redis.call('DEL', KEYS[1])
+    return 1
+    """
+
+    def __init__(self, client, ttl=7 * 24 * 60 * 60):
+        self.client = client
+        self.ttl = ttl
+        self._acquire = client.register_script(self._acquire_script)
+        self._add = client.register_script(self._add_script)
+        self._release = client.register_script(self._release_script)
+
+    def key(self, digest):
+        return f"{self.prefix}{digest}"
+
+    def acquire(self, digest):
+        url = self._acquire(keys=[self.key(digest)], args=[self.ttl])
+        return url.decode('utf-8') if url is not None else None
+
+    def add(self, digest, url):
+        return self._add(keys=[self.key(digest)], args=[url, self.ttl]).decode('utf-8')
+
+    def release(self, digest):
+        return bool(self._release(keys=[self.key(digest)]))
+
+
+class RenderCache:
+
+    def __init__(self, index):
+        self.index = index
+        self.hits = 0
+        self.misses = 0
+
+    def get_url(self, digest):
+        """Take a reference to an already rendered image
+
+        Every call must be paired with `release` once the image is no longer shown,
+        even when it returns None and the caller renders the image itself.
+        """
+        url = self.index.acquire(digest)
+        if url is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return url
+
+    def add(self, digest, url):
+        """Cache a new render
+
+        Returns:
+            str: Url to show, another game's if it rendered the same board at the same time
+        """
+        return self.index.add(digest, url)
+
+    def release(self, url):
+        """Drop a reference to an image
+
+        Images that were not rendered through the cache are never shared.
+
+        Returns:
+            bool: True if the image is not used anymore and should be deleted
+        """
+        return self.index.release(digest_from_url(url))
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+# Index entries are kept as long as the games showing them by default
+RENDER_CACHE_TTL = int(os.getenv('RENDER_CACHE_TTL', os.getenv('GAME_TTL', 7 * 24 * 60 * 60)))
+
+if os.getenv('RENDER_CACHE_INDEX', 'redis') == 'memory':
+    render_cache = RenderCache(MemoryRenderIndex(ttl=RENDER_CACHE_TTL))
+else:
+    render_cache = RenderCache(RedisRenderIndex(redis_client, ttl=RENDER_CACHE_TTL))
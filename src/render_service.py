@@ -0,0 +1,138 @@
+import os
+import time
+import logging
+import multiprocessing
+import threading
+import collections
+import concurrent.futures
+
+logger = logging.getLogger(__name__)
+
+
+def _run_job(func, args, kwargs):
+    # Runs in the render process, times are wall clock so they can be compared across processes
+    started = time.time()
+    result = func(*args, **kwargs)
+    return result, started, time.time()
+
+
+class RenderService:
+    """Run CPU bound rendering in a pool of render processes
+
+    Jobs are plain module level functions that take board state and return the
+    encoded image bytes, so nothing but small lists and dicts cross the process
+    boundary. With no processes configured jobs run inline in the calling thread.
+    """
+
+    def __init__(self, processes=0, max_queue=64, timeout=20):
+        self.processes = processes
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._pool = None
+        self._pool_pid = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_queue)
+        self.queue_depth = 0
+        self.timed_out = 0
+        self.restarts = 0
+        # Job name -> recent (seconds waiting, seconds rendering)
+        self.timings = collections.defaultdict(lambda: collections.deque(maxlen=200))
+
+    @property
+    def enabled(self):
+        return self.processes > 0
+
+    def _get_pool(self):
+        with self._lock:
+            # A pool is only usable in the process that created it (gunicorn forks workers after import)
+            if self._pool is None or self._pool_pid != os.getpid():
+                # Forking a worker that is running threads can copy a lock some other thread holds
+                # (assets, redis, logging), render processes are started from a clean forkserver instead
+                self._pool = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.processes, mp_context=multiprocessing.get_context('forkserver'))
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    def restart(self):
+        """Start new render processes for the next jobs, they load the themes again when they start
+
+        Jobs already running on the old processes are left to finish.
+        """
+        with self._lock:
+            # A pool inherited from the parent process is not ours to shut down
+            pool = self._pool if self._pool_pid == os.getpid() else None
+            self._pool = None
+            self.restarts += 1
+        if pool is not None:
+            pool.shutdown(wait=False)
+
+    def _release(self, future=None):
+        with self._lock:
+            self.queue_depth -= 1
+        self._slots.release()
+
+    def _record(self, name, wait_time, run_time):
+        with self._lock:
+            self.timings[name].append((wait_time, run_time))
+
+    def render(self, func, *args, **kwargs):
+        submitted = time.time()
+        if not self.enabled:
+            result = func(*args, **kwargs)
+            self._record(func.__name__, 0, time.time() - submitted)
+            return result
+
+        # Block new jobs once the queue is full rather than letting it grow forever
+        if not self._slots.acquire(timeout=self.timeout):
+            raise TimeoutError(f"Render queue full, waited {self.timeout}s to submit {func.__name__}")
+        with self._lock:
+            self.queue_depth += 1
+        try:
+            future = self._get_pool().submit(_run_job, func, args, kwargs)
+        except BaseException:
+            self._release()
+            raise
+        # The slot is held until the job is done, not just until this caller stops waiting for it
+        future.add_done_callback(self._release)
+        try:
+            result, started, finished = future.result(timeout=self.timeout)
+        except concurrent.futures.TimeoutError:
+            # Drop the job if it has not started yet, one that is running keeps its slot until it finishes
+            future.cancel()
+            with self._lock:
+                self.timed_out += 1
+            raise
+        except concurrent.futures.BrokenExecutor:
+            logger.exception("Render pool died, starting a new one", extra={'job': func.__name__})
+            with self._lock:
+                self._pool = None
+            raise
+
+        self._record(func.__name__, started - submitted, finished - started)
+        return result
+
+    def stats(self):
+        with self._lock:
+            jobs = {}
+            for name, timings in self.timings.items():
+                wait_times = [t[0] for t in timings]
+                run_times = [t[1] for t in timings]
+                jobs[name] = {
+                    'recent_jobs': len(timings),
+                    'avg_wait_ms': round(sum(wait_times) / len(wait_times) * 1000, 3),
+                    'avg_render_ms': round(sum(run_times) / len(run_times) * 1000, 3),
+                    'max_render_ms': round(max(run_times) * 1000, 3),
+                }
+            return {
+                'processes': self.processes,
+                'queue_depth': self.queue_depth,
+                'max_queue': self.max_queue,
+                'timed_out': self.timed_out,
+                'restarts': self.restarts,
+                'jobs': jobs,
+            }
+
+
+render_service = RenderService(processes=int(os.getenv('RENDER_PROCESSES', 0)),
+                               max_queue=int(os.getenv('RENDER_QUEUE_SIZE', 64)),
+                               timeout=float(os.getenv('RENDER_TIMEOUT', 20)))
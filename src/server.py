@@ -2,6 +2,17 @@ import json
 import falcon
 import urllib.parse
 
+from assets import asset_cache
+from local_files import add_local_files
+from render_cache import render_cache
+from batch_delete import batch_deleter
+from game_store import game_store
+from delete_queue import delete_queue
+from move_queue import move_queue, MOVE_BUSY
+from slack_client import slack_client
+from access_tokens import access_tokens
+from themes import theme_registry
+from render_service import render_service
 from connect4.endpoints import (
     SlackOAuth,
     SlackConnect4,
@@ -21,9 +32,16 @@ class SlackInteractive:
         data = urllib.parse.unquote(req.stream.read().decode('utf-8'))
         action_details = json.loads(data.replace('payload=', ''))
         if action_details['actions'][0]['action_id'].startswith('connect4-move'):
-            slack_connect4_move(action_details)
+            move = slack_connect4_move
         elif action_details['actions'][0]['action_id'].startswith('mastermind-move'):
-            slack_mastermind_move(action_details)
+            move = slack_mastermind_move
+        else:
+            return
+        # The board is updated through the response_url once the move is played,
+        # slack only needs to hear back that the click was received
+        if not move_queue.submit(action_details['message']['blocks'][0]['block_id'], move, action_details):
+            slack_client.post(action_details['response_url'], team_id=action_details['team']['id'],
+                              json=MOVE_BUSY)
 
 
 class BreakRoom:
@@ -47,8 +65,36 @@ class Healthcheck:
         resp.media = {'success': True}
 
 
+def get_stats():
+    return {
+        'asset_cache': asset_cache.stats(),
+        'render_service': render_service.stats(),
+        'render_cache': render_cache.stats(),
+        'batch_deleter': batch_deleter.stats(),
+        'delete_queue': delete_queue.stats(),
+        'game_store': game_store.stats(),
+        'move_queue': move_queue.stats(),
+        'slack_client': slack_client.stats(),
+        'access_tokens': access_tokens.stats(),
+        'themes': theme_registry.stats(),
+    }
+
+
+class Stats:
+    def on_get(self, req, resp):
+        resp.media = get_stats()
+
+
+# Each worker helps drain superseded images
+delete_queue.start()
+# Themes are read once here, then again on SIGHUP or when an asset file changes
+theme_registry.load()
+theme_registry.install_signal_handler()
+
 api = falcon.API()
 api.add_route('/healthcheck', Healthcheck())
+api.add_route('/stats', Stats())
+add_local_files(api)
 
 api.add_route('/slack/breakroom', BreakRoom())
 api.add_route('/slack/oauth', SlackOAuth())
@@ -0,0 +1,254 @@
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+import collections
+
+import httpx
+import requests
+import requests.adapters
+import urllib3.util
+
+logger = logging.getLogger(__name__)
+
+API_URL = 'https://slack.com/api/'
+
+
+class TokenBucket:
+    """Lets `rate` requests through a second, after a burst of up to `burst`"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def reserve(self):
+        """Take a token, going into debt if there are none
+
+        Returns:
+            float: Seconds to wait before using the token
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return max(0, -self.tokens / self.rate)
+
+
+class BaseSlackClient:
+    """Rate limiting, retries and metrics shared by the sync and async clients
+
+    Each (team, endpoint) gets its own token bucket, so one busy workspace gets
+    slowed down before slack starts turning it away without affecting the rest.
+    Requests slack never acted on (429s and failed connections) are retried,
+    waiting as long as slack asks with some jitter so retries do not all land
+    at once. Anything else is returned as is, a retried chat.postMessage
+    could post twice.
+    """
+
+    def __init__(self, timeout=10, connect_timeout=3, max_retries=3, backoff=0.5,
+                 team_rate=5, team_burst=20, max_buckets=10000):
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.team_rate = team_rate
+        self.team_burst = team_burst
+        self.max_buckets = max_buckets
+        self._lock = threading.Lock()
+        # (team id, endpoint) -> TokenBucket, least recently used first
+        self._buckets = collections.OrderedDict()
+        # Endpoint -> counters, recent seconds per request
+        self.counters = collections.defaultdict(collections.Counter)
+        self.timings = collections.defaultdict(lambda: collections.deque(maxlen=200))
+
+    @staticmethod
+    def endpoint(url):
+        """Name to rate limit and report the url by, the api method or `response_url`"""
+        if url.startswith(API_URL):
+            return url[len(API_URL):].split('?', 1)[0]
+        return 'response_url'
+
+    def _throttle(self, team_id, endpoint):
+        """Seconds to wait before sending to stay under the team's rate"""
+        if team_id is None or self.team_rate <= 0:
+            return 0
+        with self._lock:
+            bucket = self._buckets.pop((team_id, endpoint), None) or TokenBucket(self.team_rate, self.team_burst)
+            self._buckets[(team_id, endpoint)] = bucket
+            while len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+            wait = bucket.reserve()
+            if wait:
+                self.counters[endpoint]['throttled'] += 1
+            return wait
+
+    def _retry_delay(self, attempt, endpoint, status_code=None, retry_after=None):
+        """Seconds to wait before trying again, None to give up"""
+        if attempt >= self.max_retries:
+            return None
+        if status_code == 429:
+            with self._lock:
+                self.counters[endpoint]['rate_limited'] += 1
+            try:
+                delay = float(retry_after)
+            except (TypeError, ValueError):
+                delay = self.backoff * 2 ** attempt
+        else:
+            delay = self.backoff * 2 ** attempt
+        with self._lock:
+            self.counters[endpoint]['retries'] += 1
+        return delay + random.uniform(0, delay / 2 + self.backoff)
+
+    def _record(self, endpoint, seconds, ok):
+        with self._lock:
+            self.counters[endpoint]['requests'] += 1
+            if not ok:
+                self.counters[endpoint]['errors'] += 1
+            self.timings[endpoint].append(seconds)
+
+    def _headers(self, token, headers):
+        headers = dict(headers or {})
+        if token is not None:
+            headers['Authorization'] = f"Bearer {token}"
+        return headers
+
+    def stats(self):
+        with self._lock:
+            endpoints = {}
+            for endpoint, counters in self.counters.items():
+                timings = self.timings[endpoint]
+                endpoints[endpoint] = {
+                    **counters,
+                    'avg_ms': round(sum(timings) / len(timings) * 1000, 3) if timings else 0,
+                    'max_ms': round(max(timings) * 1000, 3) if timings else 0,
+                }
+            return {
+                'rate_limit_buckets': len(self._buckets),
+                'endpoints': endpoints,
+            }
+
+
+class SlackClient(BaseSlackClient):
+    """Slack client for the WSGI app, connections are kept open between requests"""
+
+    def __init__(self, pool_size=32, **kwargs):
+        super().__init__(**kwargs)
+        self.pool_size = pool_size
+        self._session = None
+        self._session_pid = None
+
+    def get_session(self):
+        with self._lock:
+            # Sessions are thread safe for this but cannot be shared with forked processes
+            if self._session is None or self._session_pid != os.getpid():
+                self._session = requests.Session()
+                # urllib3 only retries connecting here, nothing has been sent yet
+                retries = urllib3.util.Retry(total=None, connect=self.max_retries, read=0, redirect=0,
+                                             status=0, other=0, backoff_factor=self.backoff)
+                adapter = requests.adapters.HTTPAdapter(pool_connections=self.pool_size,
+                                                        pool_maxsize=self.pool_size,
+                                                        max_retries=retries)
+                self._session.mount('https://', adapter)
+                self._session.mount('http://', adapter)
+                self._session_pid = os.getpid()
+            return self._session
+
+    def post(self, url, team_id=None, token=None, headers=None, **kwargs):
+        """Post to slack, retrying anything slack did not act on
+
+        Args:
+            url (str): Api method or response_url
+            team_id (str): Team the request is for, to rate limit by
+            token (str): Team's access token
+
+        Returns:
+            requests.Response
+        """
+        endpoint = self.endpoint(url)
+        headers = self._headers(token, headers)
+        time.sleep(self._throttle(team_id, endpoint))
+        attempt = 0
+        while True:
+            started = time.monotonic()
+            try:
+                r = self.get_session().post(url, headers=headers, timeout=(self.connect_timeout, self.timeout),
+                                            **kwargs)
+            except requests.exceptions.RequestException:
+                self._record(endpoint, time.monotonic() - started, False)
+                raise
+            self._record(endpoint, time.monotonic() - started, r.status_code < 400)
+            if r.status_code != 429:
+                return r
+            delay = self._retry_delay(attempt, endpoint, r.status_code, r.headers.get('Retry-After'))
+            if delay is None:
+                return r
+            logger.info("Retrying slack request",
+                        extra={'endpoint': endpoint, 'team_id': team_id, 'attempt': attempt, 'delay': delay})
+            time.sleep(delay)
+            attempt += 1
+
+    def api(self, method, team_id=None, token=None, **kwargs):
+        return self.post(f"{API_URL}{method}", team_id=team_id, token=token, **kwargs)
+
+
+class AsyncSlackClient(BaseSlackClient):
+    """Slack client for the ASGI app"""
+
+    def __init__(self, pool_size=100, **kwargs):
+        super().__init__(**kwargs)
+        self.client = httpx.AsyncClient(timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+                                        limits=httpx.Limits(max_connections=pool_size))
+
+    async def post(self, url, team_id=None, token=None, headers=None, **kwargs):
+        """Same as `SlackClient.post`
+
+        Returns:
+            httpx.Response
+        """
+        endpoint = self.endpoint(url)
+        headers = self._headers(token, headers)
+        await asyncio.sleep(self._throttle(team_id, endpoint))
+        attempt = 0
+        while True:
+            started = time.monotonic()
+            try:
+                r = await self.client.post(url, headers=headers, **kwargs)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout):
+                self._record(endpoint, time.monotonic() - started, False)
+                delay = self._retry_delay(attempt, endpoint)
+                if delay is None:
+                    raise
+            else:
+                self._record(endpoint, time.monotonic() - started, r.status_code < 400)
+                if r.status_code != 429:
+                    return r
+                delay = self._retry_delay(attempt, endpoint, r.status_code, r.headers.get('Retry-After'))
+                if delay is None:
+                    return r
+            logger.info("Retrying slack request",
+                        extra={'endpoint': endpoint, 'team_id': team_id, 'attempt': attempt, 'delay': delay})
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def api(self, method, team_id=None, token=None, **kwargs):
+        return await self.post(f"{API_URL}{method}", team_id=team_id, token=token, **kwargs)
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+def env_settings():
+    return {
+        'timeout': float(os.getenv('SLACK_TIMEOUT', 10)),
+        'connect_timeout': float(os.getenv('SLACK_CONNECT_TIMEOUT', 3)),
+        'max_retries': int(os.getenv('SLACK_MAX_RETRIES', 3)),
+        'team_rate': float(os.getenv('SLACK_TEAM_RATE', 5)),
+        'team_burst': int(os.getenv('SLACK_TEAM_BURST', 20)),
+    }
+
+
+slack_client = SlackClient(**env_settings())
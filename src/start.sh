@@ -2,4 +2,5 @@
 
 python render_connect4_themes.py
 python render_mastermind_themes.py
+python compile_themes.py
 gunicorn -b 0.0.0.0:8088 -w 16 server:api
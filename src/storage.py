@@ -0,0 +1,139 @@
+import os
+import boto3
+import tempfile
+import threading
+import botocore.config
+
+
+class S3Storage:
+
+    def __init__(self, endpoint_url=None, config=None):
+        self.endpoint_url = endpoint_url
+        self.config = config
+        self._lock = threading.Lock()
+        self._client = None
+        self._client_pid = None
+
+    def get_client(self):
+        """The s3 client for this process
+
+        Clients are thread safe and keep their connections open between calls,
+        but cannot be shared with forked processes (gunicorn workers, render processes).
+        """
+        with self._lock:
+            if self._client is None or self._client_pid != os.getpid():
+                self._client = boto3.client('s3', endpoint_url=self.endpoint_url, config=self.config)
+                self._client_pid = os.getpid()
+            return self._client
+
+    def get_url(self, bucket, key):
+        return f"{self.endpoint_url or 'https://s3.amazonaws.com'}/{bucket}/{key}"
+
+    def put(self, bucket, key, body, content_type):
+        self.get_client().put_object(Body=body, Bucket=bucket, Key=key, ContentType=content_type)
+
+    def get(self, bucket, key):
+        return self.get_client().get_object(Bucket=bucket, Key=key)['Body'].read()
+
+    def delete(self, bucket, key):
+        self.get_client().delete_object(Bucket=bucket, Key=key)
+
+    def delete_many(self, bucket, keys):
+        resp = self.get_client().delete_objects(Bucket=bucket,
+                                                Delete={'Objects': [{'Key': key} for key in keys],
+                                                        'Quiet': True})
+        return [error['Key'] for error in resp.get('Errors', [])]
+
+
+class LocalStorage:
+    """Keep everything on local disk, buckets are folders under `root`
+
+    Public files are served by the api itself, see `local_files.LocalFiles`.
+    """
+
+    def __init__(self, root, base_url):
+        # Slack fetches the images itself, so they need a full url
+        if not base_url.startswith(('http://', 'https://')):
+            raise ValueError(f"BASE_URL must be the full url the api is served at, not {base_url!r}")
+        self.root = os.path.abspath(root)
+        self.base_url = base_url.rstrip('/')
+
+    def get_path(self, bucket, key):
+        bucket_root = os.path.join(self.root, bucket)
+        path = os.path.abspath(os.path.join(bucket_root, key))
+        if not path.startswith(bucket_root + os.sep):
+            raise ValueError(f"Key {key} is outside of the bucket")
+        return path
+
+    def get_url(self, bucket, key):
+        return f"{self.base_url}/files/{bucket}/{key}"
+
+    def put(self, bucket, key, body, content_type):
+        path = self.get_path(bucket, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then swap it in so a file is never read half written
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(body)
+        os.replace(tmp_path, path)
+
+    def get(self, bucket, key):
+        with open(self.get_path(bucket, key), 'rb') as f:
+            return f.read()
+
+    def delete(self, bucket, key):
+        try:
+            os.remove(self.get_path(bucket, key))
+        except FileNotFoundError:
+            pass
+
+    def delete_many(self, bucket, keys):
+        for key in keys:
+            self.delete(bucket, key)
+        return []
+
+
+if os.getenv('STORAGE_BACKEND', 's3') == 'local':
+    backend = LocalStorage(os.getenv('LOCAL_STORAGE_DIR', 'storage'), os.environ['BASE_URL'])
+else:
+    backend = S3Storage(
+        endpoint_url=os.getenv('S3_ENDPOINT', None),
+        config=botocore.config.Config(
+            max_pool_connections=int(os.getenv('S3_MAX_POOL_CONNECTIONS', 32)),
+            connect_timeout=float(os.getenv('S3_CONNECT_TIMEOUT', 3)),
+            read_timeout=float(os.getenv('S3_READ_TIMEOUT', 10)),
+            retries={'max_attempts': int(os.getenv('S3_MAX_ATTEMPTS', 3)), 'mode': 'standard'},
+            tcp_keepalive=True,
+        ),
+    )
+
+
+def get_url(bucket, key):
+    return backend.get_url(bucket, key)
+
+
+def get_key(bucket, url):
+    """Reverse of `get_url`"""
+    return url.split(f"/{bucket}/", 1)[-1]
+
+
+def put(bucket, key, body, content_type):
+    backend.put(bucket, key, body, content_type)
+    return get_url(bucket, key)
+
+
+def get(bucket, key):
+    return backend.get(bucket, key)
+
+
+def delete(bucket, key):
+    backend.delete(bucket, key)
+
+
+def delete_many(bucket, keys):
+    """Delete up to 1000 keys at once, see `batch_delete` for more
+
+    Returns:
+        list: Keys that failed to delete
+    """
+    return backend.delete_many(bucket, keys)
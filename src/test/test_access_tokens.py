@@ -0,0 +1,85 @@
+import json
+import time
+import threading
+
+import pytest
+
+import access_tokens
+
+
+class FakeRedis:
+    """Just the commands `AccessTokens` uses"""
+
+    def __init__(self):
+        self.data = {}
+        self.gets = 0
+
+    def get(self, key):
+        self.gets += 1
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value.encode('utf-8')
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+@pytest.fixture
+def storage_gets(monkeypatch):
+    monkeypatch.setenv('OAUTH_BUCKET', 'oauth')
+    gets = []
+
+    def get(bucket, key):
+        gets.append(key)
+        # Slow enough for everyone to miss at the same time
+        time.sleep(0.05)
+        return json.dumps({'access_token': f"token-{len(gets)}"}).encode('utf-8')
+
+    monkeypatch.setattr(access_tokens.storage, 'get', get)
+    return gets
+
+
+def test_get__single_load(storage_gets):
+    client = FakeRedis()
+    tokens = access_tokens.AccessTokens(client)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(tokens.get('T1'))) for _ in range(10)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert results == ['token-1'] * 10
+    assert storage_gets == ['slack/T1.json']
+    assert client.data['slack-token:T1'] == b'token-1'
+
+    # Kept in the worker from now on
+    gets = client.gets
+    assert tokens.get('T1') == 'token-1'
+    assert client.gets == gets
+    stats = tokens.stats()
+    assert stats['storage_loads'] == 1
+    assert stats['coalesced'] + stats['local_hits'] == 10
+
+
+def test_get__local_expires(storage_gets):
+    client = FakeRedis()
+    client.set('slack-token:T1', 'from-redis')
+    tokens = access_tokens.AccessTokens(client, local_ttl=0)
+    assert tokens.get('T1') == 'from-redis'
+    assert tokens.get('T1') == 'from-redis'
+    assert client.gets == 2
+    assert storage_gets == []
+
+
+def test_set_and_invalidate(storage_gets):
+    client = FakeRedis()
+    tokens = access_tokens.AccessTokens(client)
+    tokens.set('T1', 'installed')
+    assert tokens.get_cached('T1') == 'installed'
+    assert client.data['slack-token:T1'] == b'installed'
+
+    tokens.invalidate('T1')
+    assert tokens.get_cached('T1') is None
+    assert tokens.get('T1') == 'token-1'
@@ -0,0 +1,77 @@
+import os
+
+import botocore.exceptions
+import pytest
+
+import storage
+from batch_delete import BatchDeleter, MAX_KEYS_PER_REQUEST
+
+
+class StubS3Client:
+    """Records delete_objects calls, keys in `failing` come back as errors that many times"""
+
+    def __init__(self, failing=None, raise_times=0):
+        self.failing = dict(failing or {})
+        self.raise_times = raise_times
+        self.requests = []
+
+    def delete_objects(self, Bucket, Delete):
+        keys = [obj['Key'] for obj in Delete['Objects']]
+        self.requests.append(keys)
+        if self.raise_times:
+            self.raise_times -= 1
+            raise botocore.exceptions.ClientError({'Error': {'Code': 'SlowDown'}}, 'DeleteObjects')
+        errors = []
+        for key in keys:
+            if self.failing.get(key, 0):
+                self.failing[key] -= 1
+                errors.append({'Key': key, 'Code': 'InternalError'})
+        return {'Errors': errors} if errors else {}
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    def use(client):
+        backend = storage.S3Storage()
+        backend._client, backend._client_pid = client, os.getpid()
+        monkeypatch.setattr(storage, 'backend', backend)
+        return client
+    return use
+
+
+def test_delete__chunks(s3):
+    client = s3(StubS3Client())
+    deleter = BatchDeleter(retry_delay=0)
+    keys = [f"connect4/renders/{idx}.png" for idx in range(2500)]
+    assert deleter.delete(keys + keys[:10], bucket='images') == []
+
+    assert [len(chunk) for chunk in client.requests] == [MAX_KEYS_PER_REQUEST, MAX_KEYS_PER_REQUEST, 500]
+    assert deleter.stats() == {'requests': 3, 'deleted': 2500, 'retries': 0, 'failed': 0}
+
+
+def test_delete__retries_errors(s3):
+    client = s3(StubS3Client(failing={'b': 1}))
+    deleter = BatchDeleter(retry_delay=0)
+    assert deleter.delete(['a', 'b', 'c'], bucket='images') == []
+
+    # Only the key that failed is sent again
+    assert client.requests == [['a', 'b', 'c'], ['b']]
+    assert deleter.stats() == {'requests': 2, 'deleted': 3, 'retries': 1, 'failed': 0}
+
+
+def test_delete__gives_up(s3):
+    client = s3(StubS3Client(failing={'b': 10}))
+    deleter = BatchDeleter(max_retries=2, retry_delay=0)
+    assert deleter.delete(['a', 'b'], bucket='images') == ['b']
+
+    assert client.requests == [['a', 'b'], ['b'], ['b']]
+    assert deleter.stats() == {'requests': 3, 'deleted': 1, 'retries': 2, 'failed': 1}
+
+
+def test_delete__request_fails(s3):
+    client = s3(StubS3Client(raise_times=1))
+    deleter = BatchDeleter(retry_delay=0)
+    assert deleter.delete(['a', 'b'], bucket='images') == []
+
+    assert client.requests == [['a', 'b'], ['a', 'b']]
+    assert deleter.stats()['retries'] == 1
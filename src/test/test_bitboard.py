@@ -0,0 +1,69 @@
+import random
+
+import pytest
+
+import connect4.utils
+import connect4.bitboard
+import connect4.exceptions
+
+
+@pytest.mark.parametrize('seed', range(50))
+@pytest.mark.parametrize('rows, cols', [(6, 7), (4, 5)])
+def test_same_as_list_engine(seed, rows, cols):
+    """Random games played on both engines, kept going after wins to get boards with more then one line"""
+    random.seed(seed)
+    list_board = connect4.utils.gen_new_board(rows, cols)
+    bit_board = connect4.utils.gen_new_board(rows, cols)
+    bitboard = connect4.bitboard.Bitboard(rows, cols)
+    player = 1
+    while not connect4.utils.check_tie(list_board):
+        column = random.randint(1, cols)
+        try:
+            list_board, latest_move = connect4.utils.place_piece(list_board, column, player)
+        except connect4.exceptions.ColumnFull:
+            with pytest.raises(connect4.exceptions.ColumnFull):
+                connect4.bitboard.place_piece(bit_board, column, player)
+            with pytest.raises(connect4.exceptions.ColumnFull):
+                bitboard.drop(column - 1, player)
+            continue
+
+        bit_board, bit_latest_move = connect4.bitboard.place_piece(bit_board, column, player)
+        assert bit_board == list_board
+        assert bit_latest_move == latest_move
+        assert bitboard.drop(column - 1, player) == latest_move[0]
+
+        wins = connect4.utils.check_win(list_board, column)
+        assert connect4.bitboard.check_win(bit_board, column) == wins
+        assert bitboard.winning_lines(*latest_move) == wins
+        assert connect4.bitboard.check_tie(bit_board) == bitboard.is_full() == connect4.utils.check_tie(list_board)
+        player = 2 if player == 1 else 1
+
+
+def test_check_win__bug_with_vertical():
+    board = [
+        [0, 1, 0, 0, 0, 0, 0],
+        [0, 2, 0, 0, 0, 0, 0],
+        [0, 1, 1, 0, 2, 2, 0],
+        [0, 1, 2, 2, 1, 1, 0],
+        [0, 1, 1, 1, 2, 2, 2],
+        [0, 2, 1, 2, 1, 2, 1],
+    ]
+    assert connect4.bitboard.check_win(board, 2) == []
+
+
+def test_has_four__no_wrap():
+    """Pieces at the top of one column and the bottom of the next are not in a line"""
+    bitboard = connect4.bitboard.Bitboard.from_board([
+        [1, 0, 0, 0, 0, 0, 0],
+        [1, 0, 0, 0, 0, 0, 0],
+        [2, 0, 0, 0, 0, 0, 0],
+        [1, 0, 0, 0, 0, 0, 0],
+        [2, 1, 0, 0, 0, 0, 0],
+        [2, 1, 2, 2, 2, 0, 0],
+    ])
+    assert bitboard.has_four(1) is False
+    assert bitboard.has_four(2) is False
+
+    bitboard.drop(5, 2)
+    assert bitboard.has_four(2) is True
+    assert bitboard.winning_lines(5, 5) == [[(5, 5), (5, 4), (5, 3), (5, 2)]]
@@ -0,0 +1,76 @@
+import pickle
+
+import pytest
+
+import game_codec
+import connect4.exceptions
+from connect4.game import Connect4
+from mastermind.game import Mastermind
+
+
+@pytest.fixture(autouse=True)
+def no_uploads(monkeypatch):
+    monkeypatch.setenv('GAME_HISTORY_BUCKET', 'history')
+    monkeypatch.setattr('storage.put', lambda *args: None)
+    monkeypatch.setattr(Connect4, 'render_player_banner', lambda self, *names: 'https://example.com/imgs/banner.png')
+    monkeypatch.setattr(Connect4, 'render_board',
+                        lambda self, final=False: f"https://example.com/imgs/{len(self.moves)}.png")
+    monkeypatch.setattr(Mastermind, 'render_board', lambda self, final=False: 'https://example.com/imgs/mastermind.png')
+
+
+def play_connect4(columns):
+    game = Connect4('U1', 'U2', 'T1', 'C1', theme='classic')
+    game.start('Player 1', 'Player 2')
+    for column in columns:
+        try:
+            game.place_piece(column, game.current_player)
+        except connect4.exceptions.ColumnFull:
+            pass
+    return game
+
+
+def assert_same(game, loaded):
+    # Same as what pickle would have loaded, rendered frames are not saved
+    assert loaded.__dict__ == pickle.loads(pickle.dumps(game)).__dict__
+
+
+@pytest.mark.parametrize('columns', [
+    [],
+    [1, 2, 1, 2, 1, 2],
+    [1, 2, 1, 2, 1, 2, 1],  # Win
+    [4, 4, 4, 4, 4, 4, 4, 3, 5],  # Full column
+])
+def test_connect4__round_trip(columns):
+    game = play_connect4(columns)
+    assert_same(game, game_codec.decode(game_codec.encode(game)))
+    assert_same(game, game_codec.decode(game_codec.encode(game, compress=False)))
+
+
+def test_connect4__smaller_than_pickle():
+    game = play_connect4([1, 2, 3, 4, 5, 6, 7] * 3)
+    assert len(game_codec.encode(game)) < len(pickle.dumps(game)) / 4
+
+
+@pytest.mark.parametrize('moves', [
+    [],
+    [3, 2, 1],
+    [3, 2, 1, 0, -2, 5, -1, 0],
+    [3, 2, 1, 0, -2, 0, 1, 2, 3, -2],  # Win
+])
+def test_mastermind__round_trip(moves):
+    game = Mastermind('U1', 'Player 1', 'T1', 'C1')
+    game.board['private'] = [0, 1, 2, 3]
+    for move in moves:
+        game.make_move(move)
+    assert_same(game, game_codec.decode(game_codec.encode(game)))
+
+
+@pytest.mark.parametrize('data', [
+    None,
+    b'',
+    pickle.dumps({'game_id': 1}),
+    b'BRB\x63\x01\x00',
+])
+def test_decode__invalid(data):
+    with pytest.raises(game_codec.CodecError):
+        game_codec.decode(data)
@@ -1,8 +1,12 @@
+import random
+
 import pytest
 from deepdiff import DeepDiff
 
 import connect4.utils
 import connect4.exceptions
+import render_cache
+from connect4.game import Connect4
 
 
 def test_gen_new_board():
@@ -244,3 +248,56 @@ def test_check_win__diagonal_back_slash_middle():
                     [[(1, 1), (2, 2), (3, 3), (4, 4)]],
                     ignore_order=True)
     assert diff == {}
+
+
+@pytest.mark.parametrize('num_frames, max_frames, expected', [
+    (5, 0, [0, 1, 2, 3, 4]),
+    (5, 10, [0, 1, 2, 3, 4]),
+    (9, 5, [0, 2, 4, 6, 8]),
+    (10, 4, [0, 3, 6, 9]),
+    (5, 1, [0, 4]),
+    (2, 1, [0, 1]),
+])
+def test_select_recap_frames(num_frames, max_frames, expected):
+    assert connect4.utils.select_recap_frames(num_frames, max_frames) == expected
+
+
+def test_iter_history_moves():
+    moves = [
+        connect4.utils.Move(0, None, 't0', 'url0'),
+        connect4.utils.Move(1, 2, 't1', 'url1'),
+        connect4.utils.Move(2, 2, 't2', 'url2'),
+    ]
+    history_moves = list(connect4.utils.iter_history_moves(moves, rows=3, cols=3))
+    assert history_moves == [
+        {'player': 0, 'piece_played': (None, None), 'rendered_board_url': 'url0', 'timestamp': 't0',
+         'board': [[0, 0, 0], [0, 0, 0], [0, 0, 0]]},
+        {'player': 1, 'piece_played': (2, 1), 'rendered_board_url': 'url1', 'timestamp': 't1',
+         'board': [[0, 0, 0], [0, 0, 0], [0, 1, 0]]},
+        {'player': 2, 'piece_played': (1, 1), 'rendered_board_url': 'url2', 'timestamp': 't2',
+         'board': [[0, 0, 0], [0, 2, 0], [0, 1, 0]]},
+    ]
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_render_board__incremental_same_as_full(seed, monkeypatch):
+    """Boards drawn onto the previous frame match drawing the whole board again"""
+    rendered = []
+
+    def save_render(board_img, board_name, ext='png'):
+        rendered.append(board_img)
+        return f"https://example.com/imgs/{board_name}.{ext}"
+
+    monkeypatch.setattr('connect4.game.core_utils.save_render', save_render)
+    monkeypatch.setattr('connect4.game.render_cache', render_cache.RenderCache(render_cache.MemoryRenderIndex()))
+    rng = random.Random(seed)
+    game = Connect4('U1', 'U2', 'T1', 'C1')
+    game_end = None
+    while game_end is None:
+        try:
+            _, game_end = game.place_piece(rng.randint(1, 7), game.current_player)
+        except connect4.exceptions.ColumnFull:
+            continue
+        full = connect4.utils.add_overlay(connect4.utils.render_board(game.board), game.latest_move, game.winning_moves)
+        assert rendered[-1].tobytes() == full.tobytes()
+    assert len(rendered) == len(game.moves)
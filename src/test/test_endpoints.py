@@ -0,0 +1,104 @@
+import urllib.parse
+
+import fakeredis
+import falcon
+import falcon.testing
+import pytest
+
+import connect4.endpoints
+import mastermind.endpoints
+from connect4.game import Connect4
+from game_store import GameStore, MOVE_NOT_APPLIED
+from mastermind.game import Mastermind
+
+
+@pytest.fixture
+def new_games(monkeypatch):
+    monkeypatch.setattr(Connect4, 'start', lambda self, *names: ('https://example.com/imgs/banner.png',
+                                                                 f'https://example.com/imgs/{self.game_id}.png'))
+    monkeypatch.setattr(Mastermind, 'start', lambda self: f'https://example.com/imgs/{self.game_id}.png')
+    monkeypatch.setattr('game_store.game_store.create', lambda game: None)
+
+
+def slash_command(resource, text):
+    body = urllib.parse.urlencode({'text': text, 'user_id': 'U1', 'user_name': 'one',
+                                   'team_id': 'T1', 'channel_id': 'C1'})
+    req = falcon.testing.create_req(method='POST', body=body)
+    resp = falcon.Response()
+    resource.on_post(req, resp)
+    return resp.media
+
+
+@pytest.mark.parametrize('game_module, resource, text, image_block', [
+    (connect4.endpoints, connect4.endpoints.SlackConnect4(), '<@U2|two>', 2),
+    (mastermind.endpoints, mastermind.endpoints.SlackMastermind(), 'classic', 1),
+])
+def test_new_game__own_blocks(new_games, game_module, resource, text, image_block):
+    # The media is serialized after the handler returns, another request may have started by then
+    first = slash_command(resource, text)['blocks']
+    second = slash_command(resource, text)['blocks']
+
+    assert first is not second
+    assert first[0]['block_id'] != second[0]['block_id']
+    assert first[image_block]['image_url'] == f"https://example.com/imgs/{first[0]['block_id']}.png"
+    # Games are started on many threads at once, the shared template is never filled in
+    assert 'block_id' not in game_module.default_message_blocks[0]
+    assert game_module.default_message_blocks[image_block]['image_url'] == ''
+
+
+@pytest.fixture
+def store(monkeypatch):
+    monkeypatch.setattr(Connect4, 'render_board',
+                        lambda self, final=False: f'https://example.com/imgs/{self.game_id}-{len(self.moves)}.png')
+    monkeypatch.setattr(Mastermind, 'render_board', lambda self, final=False: 'https://example.com/imgs/mastermind.png')
+    store = GameStore(fakeredis.FakeRedis(), hot_games=0)
+    monkeypatch.setattr(connect4.endpoints, 'game_store', store)
+    monkeypatch.setattr(mastermind.endpoints, 'game_store', store)
+    return store
+
+
+@pytest.fixture
+def slack(monkeypatch):
+    calls = {'posts': [], 'deletes': []}
+    monkeypatch.setattr('slack_client.slack_client.post',
+                        lambda url, team_id=None, json=None: calls['posts'].append((url, json)))
+    monkeypatch.setattr('delete_queue.delete_queue.push', calls['deletes'].append)
+    return calls
+
+
+def click(game_id, value):
+    return {
+        'message': {'blocks': [{'block_id': game_id},
+                               {'image_url': 'https://example.com/imgs/previous.png'},
+                               {'image_url': 'https://example.com/imgs/previous.png'},
+                               {'text': {'text': ''}},
+                               {'elements': [{'text': ''}]}]},
+        'actions': [{'value': str(value)}],
+        'user': {'id': 'U1'},
+        'team': {'id': 'T1'},
+        'response_url': 'https://hooks.slack.com/actions/1',
+    }
+
+
+@pytest.mark.parametrize('game_module, move, game', [
+    (connect4.endpoints, connect4.endpoints.slack_connect4_move, lambda: Connect4('U1', 'U2', 'T1', 'C1')),
+    (mastermind.endpoints, mastermind.endpoints.slack_mastermind_move, lambda: Mastermind('U1', 'one', 'T1', 'C1')),
+])
+def test_move__conflict(store, slack, monkeypatch, game_module, move, game):
+    game = game()
+    store.create(game)
+    play_move = game_module.play_move
+
+    def other_click_first(current_game, *args):
+        other, version = store.load(current_game.game_id)
+        store.save(other, version)
+        return play_move(current_game, *args)
+
+    monkeypatch.setattr(game_module, 'play_move', other_click_first)
+    move(click(game.game_id, 1))
+
+    # The board of the dropped move is never shown, and only the player who clicked is told
+    assert len(slack['deletes']) == 1
+    assert slack['deletes'][0] != 'https://example.com/imgs/previous.png'
+    assert slack['posts'] == [('https://hooks.slack.com/actions/1', MOVE_NOT_APPLIED)]
+    assert store.load(game.game_id)[1] == 2
@@ -0,0 +1,118 @@
+import fakeredis
+import pytest
+
+from connect4.game import Connect4
+from game_store import GameStore, GameConflict
+
+
+@pytest.fixture(autouse=True)
+def no_uploads(monkeypatch):
+    monkeypatch.setattr(Connect4, 'render_board', lambda self, final=False: 'https://example.com/imgs/board.png')
+
+
+@pytest.fixture
+def client():
+    return fakeredis.FakeRedis()
+
+
+def new_game(store):
+    game = Connect4('U1', 'U2', 'T1', 'C1')
+    store.create(game)
+    return game
+
+
+def test_save__conflict(client):
+    store = GameStore(client, hot_games=0)
+    game_id = new_game(store).game_id
+    # Two clicks on the same board load the same version
+    first, version = store.load(game_id)
+    second, _ = store.load(game_id)
+
+    first.place_piece(1, 'U1')
+    assert store.save(first, version) == version + 1
+    second.place_piece(2, 'U1')
+    with pytest.raises(GameConflict):
+        store.save(second, version)
+
+    game, version = store.load(game_id)
+    assert version == 2
+    assert game.board == first.board
+    assert store.stats()['conflicts'] == 1
+
+
+def test_finish(client):
+    store = GameStore(client, hot_games=0)
+    game_id = new_game(store).game_id
+    game, version = store.load(game_id)
+    game.place_piece(1, 'U1')
+    store.save(game, version)
+
+    with pytest.raises(GameConflict):
+        store.finish(game_id, version)
+    assert store.load(game_id)[1] == version + 1
+
+    store.finish(game_id, version + 1)
+    assert store.load(game_id) == (None, None)
+    with pytest.raises(GameConflict, match='gone'):
+        store.finish(game_id, version + 1)
+
+
+def test_load__hot_game(client):
+    store = GameStore(client, hot_games=4)
+    game = new_game(store)
+    assert store.load(game.game_id) == (game, 1)
+    assert store.stats()['hot_hits'] == 1
+    # Taken out while it is being played, back in once saved
+    assert store.stats()['hot_games'] == 0
+    game.place_piece(1, 'U1')
+    store.save(game, 1)
+    assert store.stats()['hot_games'] == 1
+    assert store.load(game.game_id) == (game, 2)
+
+
+def test_load__hot_game_saved_elsewhere(client):
+    worker1 = GameStore(client, hot_games=4)
+    worker2 = GameStore(client, hot_games=4)
+    game = new_game(worker1)
+
+    other, version = worker2.load(game.game_id)
+    other.place_piece(3, 'U1')
+    worker2.save(other, version)
+
+    # The copy worker1 kept is behind redis, so the newer one is loaded
+    loaded, version = worker1.load(game.game_id)
+    assert version == 2
+    assert loaded is not game
+    assert loaded.board == other.board
+    assert worker1.stats()['hot_stale'] == 1
+
+
+def test_hot_games__bounded(client):
+    store = GameStore(client, hot_games=2)
+    games = [new_game(store) for _ in range(3)]
+    assert store.stats()['hot_games'] == 2
+
+    # The oldest one was dropped, it is read from redis
+    loaded, _ = store.load(games[0].game_id)
+    assert loaded is not games[0]
+    assert store.load(games[2].game_id)[0] is games[2]
+    assert store.stats()['hot_hits'] == 1
+
+
+def test_ttl(client):
+    store = GameStore(client, hot_games=0, ttl=60)
+    game = new_game(store)
+    key = store.key(game.game_id)
+    assert 0 < client.ttl(key) <= 60
+
+    client.expire(key, 5)
+    game, version = store.load(game.game_id)
+    # Touched by every load and save
+    assert client.ttl(key) > 5
+    client.expire(key, 5)
+    version = store.save(game, version)
+    assert client.ttl(key) > 5
+
+    # Finished games do not wait to expire
+    store.finish(game.game_id, version)
+    assert client.exists(key) == 0
@@ -0,0 +1,53 @@
+import falcon
+import falcon.testing
+import pytest
+
+import storage
+from local_files import LocalFiles
+
+
+@pytest.fixture
+def client(tmp_path):
+    backend = storage.LocalStorage(str(tmp_path), 'http://localhost:8000')
+    backend.put('images', 'connect4/renders/abc.png', b'png data', 'image/png')
+    backend.put('history', 'connect4/game.json', b'{}', 'application/json')
+    api = falcon.App()
+    api.add_sink(LocalFiles(backend, ['images']), prefix=LocalFiles.prefix)
+    return falcon.testing.TestClient(api)
+
+
+def test_get__cached(client):
+    resp = client.simulate_get('/files/images/connect4/renders/abc.png')
+    assert resp.status_code == 200
+    assert resp.content == b'png data'
+    assert resp.headers['content-type'] == 'image/png'
+    assert 'immutable' in resp.headers['cache-control']
+
+    resp = client.simulate_get('/files/images/connect4/renders/abc.png',
+                               headers={'If-None-Match': resp.headers['etag']})
+    assert resp.status_code == 304
+    assert resp.content == b''
+
+
+@pytest.mark.parametrize('path', [
+    '/files/history/connect4/game.json',
+    '/files/images/../history/connect4/game.json',
+    '/files/images/connect4/%2E%2E/%2E%2E/history/connect4/game.json',
+    '/files/images/connect4/renders/missing.png',
+])
+def test_get__not_found(client, path):
+    assert client.simulate_get(path).status_code == 404
+
+
+def test_local_storage__delete(tmp_path):
+    backend = storage.LocalStorage(str(tmp_path), 'http://localhost:8000/')
+    assert backend.get_url('images', 'a/b.png') == 'http://localhost:8000/files/images/a/b.png'
+    backend.put('images', 'a/b.png', b'data', 'image/png')
+    assert backend.delete_many('images', ['a/b.png', 'a/missing.png']) == []
+    with pytest.raises(FileNotFoundError):
+        backend.get('images', 'a/b.png')
+
+
+def test_local_storage__relative_base_url(tmp_path):
+    with pytest.raises(ValueError):
+        storage.LocalStorage(str(tmp_path), '')
@@ -1,6 +1,10 @@
+import random
+
 import pytest
 import mastermind.utils
 import mastermind.exceptions
+import render_cache
+from mastermind.game import Mastermind
 
 
 def test_gen_new_board():
@@ -124,3 +128,32 @@ def test_making_invalid_move(current_public_board, color, expected_exception):
 def test_check_code(key, code, expected_feedback):
     feedback = mastermind.utils._check_code(key, code)
     assert feedback == expected_feedback
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_render_board__repainted_rows_same_as_full(seed, monkeypatch):
+    """Boards with only the changed rows repainted match drawing the whole board again"""
+    rendered = []
+
+    def save_render(board_img, board_name, ext='png'):
+        rendered.append(board_img.copy())
+        return f"https://example.com/imgs/{board_name}.{ext}"
+
+    monkeypatch.setattr('mastermind.game.core_utils.save_render', save_render)
+    monkeypatch.setattr('mastermind.game.render_cache', render_cache.RenderCache(render_cache.MemoryRenderIndex()))
+    rng = random.Random(seed)
+    game = Mastermind('U1', 'one', 'T1', 'C1')
+    game_state = None
+    while game_state is None:
+        # Mostly colors, with the odd undo, and submitting once the row is full
+        move = rng.choice([0, 1, 2, 3, 4, 5, -1])
+        if None not in game.board['public'][mastermind.utils._find_guess_index(game.board)][0]:
+            move = -2
+        renders = len(rendered)
+        try:
+            _, game_state = game.make_move(move)
+        except mastermind.exceptions.NothingToUndo:
+            continue
+        if len(rendered) > renders:
+            # Not a render cache hit, i.e. after an undo and playing the same color again
+            assert rendered[-1].tobytes() == mastermind.utils.render_board(game.board).tobytes()
@@ -0,0 +1,53 @@
+import threading
+
+import move_queue
+
+
+def test_submit__same_game_in_order():
+    moves = move_queue.MoveQueue(workers=4, max_queue=128)
+    played = []
+    done = threading.Event()
+
+    def move(action_details):
+        played.append(action_details)
+        if len(played) == 20:
+            done.set()
+
+    for i in range(20):
+        assert moves.submit('game-1', move, i) is True
+    assert done.wait(5)
+    assert played == list(range(20))
+    assert moves.stats()['queued'] == 20
+
+
+def test_submit__busy_when_full():
+    moves = move_queue.MoveQueue(workers=1, max_queue=1, put_timeout=0.01)
+    release = threading.Event()
+    started = threading.Event()
+
+    def slow_move(action_details):
+        started.set()
+        release.wait(5)
+
+    # First is being played, second waits in the queue, third has nowhere to go
+    assert moves.submit('game-1', slow_move, None) is True
+    assert started.wait(5)
+    assert moves.submit('game-1', slow_move, None) is True
+    played = []
+    # Never played out of order with the ones already waiting
+    assert moves.submit('game-1', played.append, 'busy') is False
+    release.set()
+    assert played == []
+    assert moves.stats()['rejected'] == 1
+
+
+def test_submit__no_workers():
+    moves = move_queue.MoveQueue(workers=0)
+
+    def bad_move(action_details):
+        raise ValueError(action_details)
+
+    assert moves.submit('game-1', bad_move, 'oops') is True
+    stats = moves.stats()
+    assert stats['failed'] == 1
+    assert stats['inline'] == 1
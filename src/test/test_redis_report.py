@@ -0,0 +1,25 @@
+import fakeredis
+import redis.client
+
+import redis_report
+from game_store import game_store
+from delete_queue import delete_queue
+
+
+def test_count_keys__sampled(monkeypatch):
+    # fakeredis has no MEMORY USAGE, count each key as a byte
+    monkeypatch.setattr(redis.client.Pipeline, 'memory_usage', lambda self, key: self.exists(key))
+    client = fakeredis.FakeRedis()
+    for idx in range(10):
+        client.set(f"{game_store.prefix}{idx}", 'game', ex=60)
+        client.zadd(f"{delete_queue.key}-{idx}", {'url': 1})
+
+    counts, memory, no_ttl = redis_report.count_keys(client)
+    assert counts == {'games': 10, 'delete queue': 10}
+    assert no_ttl == {'delete queue': 10}
+
+    # Every 4th key is checked, each one standing for 4
+    counts, memory, no_ttl = redis_report.count_keys(client, sample=4)
+    assert counts == {'games': 10, 'delete queue': 10}
+    assert sum(memory.values()) == 20
+    assert sum(no_ttl.values()) + memory['games'] == 20
@@ -0,0 +1,86 @@
+import render_cache
+from connect4.game import Connect4
+
+
+def test_render_key__canonical():
+    board = [[0, 1], [2, 1]]
+    assert render_cache.render_key('connect4', 'classic', board) == \
+        render_cache.render_key('connect4', 'classic', [[0, 1], [2, 1]])
+    assert render_cache.render_key('connect4', 'classic', board) != \
+        render_cache.render_key('connect4', 'other', board)
+
+
+def test_release__shared_image():
+    cache = render_cache.RenderCache(render_cache.MemoryRenderIndex())
+    url = 'https://s3.amazonaws.com/bucket/connect4/renders/abc.png'
+
+    # First game renders it, second game reuses it
+    assert cache.get_url('abc') is None
+    cache.add('abc', url)
+    assert cache.get_url('abc') == url
+
+    assert cache.release(url) is False
+    assert cache.release(url) is True
+    assert cache.get_url('abc') is None
+
+
+def test_release__not_cached():
+    cache = render_cache.RenderCache(render_cache.MemoryRenderIndex())
+    assert cache.release('https://s3.amazonaws.com/bucket/connect4/slack/T1/game_1575000000.0.png') is True
+
+
+def test_release__rendered_again_before_delete():
+    cache = render_cache.RenderCache(render_cache.MemoryRenderIndex())
+    first_url = f"https://s3.amazonaws.com/bucket/{render_cache.render_name('connect4/renders', 'abc')}.png"
+    cache.get_url('abc')
+    assert cache.add('abc', first_url) == first_url
+    assert cache.release(first_url) is True
+
+    # Another game shows the same board before the queued delete of the first upload runs
+    assert cache.get_url('abc') is None
+    second_url = f"https://s3.amazonaws.com/bucket/{render_cache.render_name('connect4/renders', 'abc')}.png"
+    assert second_url != first_url
+    assert render_cache.digest_from_url(second_url) == 'abc'
+    assert cache.add('abc', second_url) == second_url
+
+
+def test_add__same_board_at_once():
+    cache = render_cache.RenderCache(render_cache.MemoryRenderIndex())
+    assert cache.get_url('abc') is None
+    assert cache.get_url('abc') is None
+    first_url = 'https://s3.amazonaws.com/bucket/connect4/renders/abc.1.png'
+    assert cache.add('abc', first_url) == first_url
+    # The slower game shows the first upload too, both references count
+    assert cache.add('abc', 'https://s3.amazonaws.com/bucket/connect4/renders/abc.2.png') == first_url
+    assert cache.release(first_url) is False
+    assert cache.release(first_url) is True
+
+
+def test_expired__only_forgotten():
+    cache = render_cache.RenderCache(render_cache.MemoryRenderIndex(ttl=0))
+    url = 'https://s3.amazonaws.com/bucket/connect4/renders/abc.png'
+
+    # Never released, i.e. a board of an abandoned game
+    cache.get_url('abc')
+    cache.add('abc', url)
+    # The image is not deleted, the next game to show it uploads it again
+    assert cache.get_url('abc') is None
+    cache.add('abc', url)
+    assert cache.release(url) is True
+
+
+def test_final_board__owned_by_the_game(monkeypatch):
+    cache = render_cache.RenderCache(render_cache.MemoryRenderIndex())
+    monkeypatch.setattr('connect4.game.render_cache', cache)
+    monkeypatch.setattr('storage.put', lambda bucket, key, data, content_type: f'https://example.com/{key}')
+    monkeypatch.setenv('RENDERED_IMAGES_BUCKET', 'images')
+    game = Connect4('U1', 'U2', 'T1', 'C1')
+    for column in (1, 2, 1, 2, 1, 2):
+        board_url, game_end = game.place_piece(column, game.current_player)
+    assert '/connect4/renders/' in board_url
+
+    board_url, game_end = game.place_piece(1, game.current_player)
+    assert game_end == 'win'
+    # Finished messages show it for good, so it never goes through the render cache
+    assert board_url == f'https://example.com/connect4/slack/T1/{game.game_id}_final.png'
+    assert cache.stats()['misses'] == 6
@@ -0,0 +1,65 @@
+import os
+import time
+import threading
+import concurrent.futures
+
+import pytest
+
+from render_service import RenderService
+
+
+def wait(seconds):
+    time.sleep(seconds)
+    return seconds
+
+
+def crash():
+    os._exit(1)
+
+
+@pytest.fixture
+def service():
+    service = RenderService(processes=1, max_queue=1, timeout=30)
+    # Starting the forkserver is slow, get it out of the way before timing anything
+    assert service.render(wait, 0) == 0
+    yield service
+    service.restart()
+
+
+def test_render__timeout(service):
+    service.timeout = 0.2
+    with pytest.raises(concurrent.futures.TimeoutError):
+        service.render(wait, 1)
+    assert service.stats()['timed_out'] == 1
+
+    # The job keeps its slot until it is done, not just until the caller gave up on it
+    assert service.stats()['queue_depth'] == 1
+    with pytest.raises(TimeoutError, match='Render queue full'):
+        service.render(wait, 0)
+
+    service.timeout = 30
+    assert service.render(wait, 0) == 0
+    assert service.stats()['queue_depth'] == 0
+
+
+def test_render__queue_full(service):
+    service.timeout = 0.5
+    started = threading.Event()
+    thread = threading.Thread(target=lambda: started.set() or service.render(wait, 0.3))
+    thread.start()
+    started.wait()
+    time.sleep(0.05)
+
+    # Waits for the slot to free up rather than failing right away
+    assert service.render(wait, 0) == 0
+    thread.join()
+    assert service.stats()['timed_out'] == 0
+
+
+def test_render__pool_died(service):
+    with pytest.raises(concurrent.futures.BrokenExecutor):
+        service.render(crash)
+
+    # A new pool is started for the next job
+    assert service.render(wait, 0) == 0
+    assert service.stats()['queue_depth'] == 0
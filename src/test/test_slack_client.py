@@ -0,0 +1,80 @@
+import pytest
+
+import slack_client
+
+
+class FakeResponse:
+
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class FakeSession:
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    def post(self, url, **kwargs):
+        self.calls.append((url, kwargs))
+        return self.responses.pop(0)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(slack_client.time, 'sleep', sleeps.append)
+    return sleeps
+
+
+def test_endpoint():
+    assert slack_client.SlackClient.endpoint('https://slack.com/api/chat.postMessage') == 'chat.postMessage'
+    assert slack_client.SlackClient.endpoint('https://hooks.slack.com/actions/T1/1/abc') == 'response_url'
+
+
+def test_token_bucket():
+    bucket = slack_client.TokenBucket(rate=10, burst=2)
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.01)
+    assert bucket.reserve() == pytest.approx(0.2, abs=0.01)
+
+
+def test_post__retry_after(sleeps):
+    client = slack_client.SlackClient(team_rate=0, backoff=0)
+    session = FakeSession([FakeResponse(429, {'Retry-After': '2'}), FakeResponse(200)])
+    client.get_session = lambda: session
+
+    r = client.api('chat.postMessage', team_id='T1', token='xoxb', json={})
+    assert r.status_code == 200
+    assert session.calls[0][1]['headers'] == {'Authorization': 'Bearer xoxb'}
+    # Waits at least as long as slack asked
+    assert 2 <= sleeps[-1] <= 3
+    stats = client.stats()['endpoints']['chat.postMessage']
+    assert stats['requests'] == 2
+    assert stats['rate_limited'] == 1
+    assert stats['retries'] == 1
+
+
+def test_post__gives_up(sleeps):
+    client = slack_client.SlackClient(team_rate=0, max_retries=2, backoff=0)
+    session = FakeSession([FakeResponse(429)] * 3)
+    client.get_session = lambda: session
+
+    assert client.post('https://hooks.slack.com/actions/T1/1/abc', team_id='T1').status_code == 429
+    assert len(session.calls) == 3
+
+
+def test_post__team_rate(sleeps):
+    client = slack_client.SlackClient(team_rate=1, team_burst=1)
+    session = FakeSession([FakeResponse(200)] * 3)
+    client.get_session = lambda: session
+
+    client.post('https://hooks.slack.com/actions/T1/1/abc', team_id='T1')
+    client.post('https://hooks.slack.com/actions/T2/1/abc', team_id='T2')
+    assert sleeps == [0, 0]
+    # Second in a row from the same team has to wait its turn
+    client.post('https://hooks.slack.com/actions/T1/1/abc', team_id='T1')
+    assert sleeps[-1] == pytest.approx(1, abs=0.05)
+    assert client.stats()['endpoints']['response_url']['throttled'] == 1
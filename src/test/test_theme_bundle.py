@@ -0,0 +1,41 @@
+from PIL import Image
+
+import theme_bundle
+
+
+def test_validate_theme__classic():
+    assert theme_bundle.validate_theme('connect4', 'classic') == []
+    assert theme_bundle.validate_theme('mastermind', 'classic') == []
+
+
+def test_validate_theme__missing_theme():
+    errors = theme_bundle.validate_theme('connect4', 'not-a-theme')
+    assert 'connect4/not-a-theme: missing board.png' in errors
+
+
+def test_bundle_round_trip(tmp_path):
+    bundle_path = str(tmp_path / 'themes.bundle')
+    theme_bundle.write_bundle(bundle_path, {'connect4': ['classic'], 'mastermind': ['classic']})
+    bundle = theme_bundle.ThemeBundle(bundle_path)
+
+    board = Image.open('connect4/assets/classic/board.png').convert('RGBA')
+    assert bundle.image('connect4', 'classic', 'board.png').tobytes() == board.tobytes()
+
+    banner = Image.open('connect4/assets/player_banner.png').convert('RGBA')
+    assert bundle.image('connect4', None, 'player_banner.png').tobytes() == banner.tobytes()
+
+    small_peg = Image.open('mastermind/assets/classic/peg-b.png').convert('RGBA').resize((30, 30), Image.LANCZOS)
+    assert bundle.resized('mastermind', 'classic', 'peg-b.png', (30, 30)).tobytes() == small_peg.tobytes()
+
+    assert bundle.image('connect4', 'classic', 'not-an-asset.png') is None
+    assert bundle.stale == set()
+
+
+def test_load_bundle__bad_bundle(tmp_path):
+    stale = tmp_path / 'stale.bundle'
+    stale.write_bytes(theme_bundle.HEADER.pack(theme_bundle.BUNDLE_MAGIC, 0, 0))
+    assert theme_bundle.load_bundle(str(stale)) is None
+
+    corrupt = tmp_path / 'corrupt.bundle'
+    corrupt.write_bytes(b'BRB')
+    assert theme_bundle.load_bundle(str(corrupt)) is None
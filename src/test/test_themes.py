@@ -0,0 +1,72 @@
+import shutil
+from PIL import Image
+
+import themes
+import theme_bundle
+import connect4.utils as connect4_utils
+from assets import asset_cache
+
+
+def make_registry(tmp_path, monkeypatch):
+    for game in ('connect4', 'mastermind'):
+        shutil.copytree(f'{game}/assets', tmp_path / game / 'assets')
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('RENDERED_IMAGES_BUCKET', 'images')
+    registry = themes.ThemeRegistry(check_interval=0)
+    registry.load()
+    return registry
+
+
+def test_registry(tmp_path, monkeypatch):
+    registry = make_registry(tmp_path, monkeypatch)
+    assert registry.get_theme_list('connect4') == ['classic']
+    assert registry.get('connect4', 'not-a-theme') is None
+    assert registry.get('mastermind', 'classic').colors[0] == ('0', 'White')
+
+    blocks = registry.sample_blocks('connect4')
+    assert blocks[0]['accessory']['alt_text'] == 'classic'
+    assert registry.sample_blocks('connect4') is blocks
+
+
+def test_registry__skips_invalid_themes(tmp_path, monkeypatch):
+    registry = make_registry(tmp_path, monkeypatch)
+    (tmp_path / 'connect4' / 'assets' / 'broken').mkdir()
+    # Nothing is read again until asked to
+    assert registry.get_theme_list('connect4') == ['classic']
+
+    registry.request_reload()
+    assert registry.get_theme_list('connect4') == ['classic']
+    assert registry.stats()['invalid'] == ['connect4/broken']
+    assert registry.stats()['loads'] == 2
+
+
+def test_registry__reloads_changed_files(tmp_path, monkeypatch):
+    registry = make_registry(tmp_path, monkeypatch)
+    registry.check_interval = 0.001
+    shutil.copytree(tmp_path / 'connect4' / 'assets' / 'classic', tmp_path / 'connect4' / 'assets' / 'dark')
+    registry._checked = 0
+    assert registry.get_theme_list('connect4') == ['classic', 'dark']
+
+
+def test_registry__reload_draws_changed_assets(tmp_path, monkeypatch):
+    registry = make_registry(tmp_path, monkeypatch)
+    theme_bundle.write_bundle('themes.bundle', {'connect4': ['classic'], 'mastermind': ['classic']})
+    monkeypatch.setattr(asset_cache, 'bundle_path', 'themes.bundle')
+    asset_cache.reload()
+    try:
+        board = connect4_utils.gen_new_board()
+        board[5][3] = 1
+        version = registry.version('connect4', 'classic')
+        rendered = connect4_utils.render_board_png(board, (5, 3), None)
+
+        piece_path = tmp_path / 'connect4' / 'assets' / 'classic' / 'player1.png'
+        Image.new('RGBA', (50, 50), (255, 0, 255, 255)).save(piece_path)
+        registry.request_reload()
+
+        # New images get new render cache keys, and the bundle is not used for the changed theme
+        assert registry.version('connect4', 'classic') != version
+        assert asset_cache.bundle.stale == {'connect4/classic'}
+        assert connect4_utils.render_board_png(board, (5, 3), None) != rendered
+    finally:
+        monkeypatch.undo()
+        asset_cache.reload()
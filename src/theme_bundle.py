@@ -0,0 +1,241 @@
+import os
+import csv
+import json
+import mmap
+import struct
+import hashlib
+import logging
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Header: magic, format version, length of the json index that follows it
+BUNDLE_MAGIC = b'BRBTHEME'
+BUNDLE_VERSION = 2
+HEADER = struct.Struct('<8sII')
+# Keep every image plane aligned in the file
+ALIGN = 16
+
+THEME_ASSETS = {
+    'connect4': {
+        'required': ['board.png', 'player1.png', 'player2.png'],
+        'optional': ['latest_move.png', 'won.png'],
+        # Assets shared by all themes, found in the root of the games assets folder
+        'shared': ['player_banner.png'],
+    },
+    'mastermind': {
+        'required': ['hole.png', 'row_sep.png', 'peg-b.png', 'peg-w.png'] + [f'peg-{i}.png' for i in range(6)],
+        'optional': [],
+        'shared': [],
+    },
+}
+
+
+class BundleError(Exception):
+    pass
+
+
+def asset_key(game, theme, name):
+    return f"{game}/{theme or ''}/{name}"
+
+
+def resized_key(game, theme, name, size):
+    return f"{asset_key(game, theme, name)}@{size[0]}x{size[1]}"
+
+
+def theme_version(game, theme=None, assets_dir=None):
+    """Hash of the files a theme is drawn from, its own folder and the games shared assets
+
+    Only file contents go in, so every host serving the same themes agrees on it.
+    With no theme only the shared assets are hashed.
+    """
+    assets_dir = assets_dir or os.path.join(game, 'assets')
+    paths = [os.path.join(assets_dir, name) for name in THEME_ASSETS[game]['shared']]
+    if theme:
+        theme_dir = os.path.join(assets_dir, theme)
+        paths += [os.path.join(theme_dir, name) for name in sorted(os.listdir(theme_dir))]
+
+    digest = hashlib.sha1()
+    for path in paths:
+        if not os.path.isfile(path):
+            continue
+        with open(path, 'rb') as f:
+            data = f.read()
+        digest.update(f"{os.path.basename(path)}:{len(data)}:".encode('utf-8'))
+        digest.update(data)
+    return digest.hexdigest()[:16]
+
+
+def validate_theme(game, theme, assets_dir=None):
+    """Check a theme folder against the asset requirements in the README
+
+    Returns:
+        list: Problems found with the theme, empty if it is valid
+    """
+    theme_dir = os.path.join(assets_dir or os.path.join(game, 'assets'), theme)
+    errors = []
+    images = {}
+    for name in THEME_ASSETS[game]['required'] + THEME_ASSETS[game]['optional']:
+        try:
+            images[name] = Image.open(os.path.join(theme_dir, name))
+        except FileNotFoundError:
+            if name in THEME_ASSETS[game]['required']:
+                errors.append(f"{game}/{theme}: missing {name}")
+            continue
+        if images[name].format != 'PNG':
+            errors.append(f"{game}/{theme}: {name} must be a png")
+
+    if errors:
+        return errors
+
+    if game == 'connect4':
+        board_w, board_h = images['board.png'].size
+        if board_w != 430 or board_h < 370:
+            errors.append(f"{game}/{theme}: board.png must be 430px wide and at least 370px tall")
+        for name in ('player1.png', 'player2.png'):
+            if images[name].size != (50, 50):
+                errors.append(f"{game}/{theme}: {name} must be 50x50")
+
+    elif game == 'mastermind':
+        hole_size = images['hole.png'].size
+        for name in [n for n in THEME_ASSETS[game]['required'] if n.startswith('peg-')]:
+            if images[name].size != hole_size:
+                errors.append(f"{game}/{theme}: {name} must be the same size as hole.png")
+        if images['row_sep.png'].size[0] != hole_size[0]:
+            errors.append(f"{game}/{theme}: row_sep.png must be the same width as hole.png")
+        try:
+            with open(os.path.join(theme_dir, 'colors.csv'), 'r') as f:
+                colors = [row for row in csv.reader(f) if row]
+            if sorted(int(row[0]) for row in colors) != list(range(6)):
+                errors.append(f"{game}/{theme}: colors.csv must name the colors 0-5")
+        except FileNotFoundError:
+            errors.append(f"{game}/{theme}: missing colors.csv")
+        except (ValueError, IndexError):
+            errors.append(f"{game}/{theme}: colors.csv must be rows of `index,name`")
+
+    return errors
+
+
+def _theme_images(game, theme):
+    """Yield (key, image) for every decoded and pre-resized asset of a theme"""
+    theme_dir = os.path.join(game, 'assets', theme)
+    names = THEME_ASSETS[game]['required'] + THEME_ASSETS[game]['optional']
+    images = {}
+    for name in names:
+        path = os.path.join(theme_dir, name)
+        if os.path.exists(path):
+            images[name] = Image.open(path).convert('RGBA')
+            yield asset_key(game, theme, name), images[name]
+
+    if game == 'mastermind':
+        # Feedback pegs and their holes are drawn at half size
+        hole_w, hole_h = images['hole.png'].size
+        small_size = (int(hole_w / 2), int(hole_h / 2))
+        for name in ('hole.png', 'peg-b.png', 'peg-w.png'):
+            yield resized_key(game, theme, name, small_size), images[name].resize(small_size, Image.LANCZOS)
+
+
+def write_bundle(path, themes):
+    """Pack the decoded assets of each theme into a single file
+
+    Args:
+        path (str): Where to write the bundle
+        themes (dict): Game name to a list of its themes
+    """
+    # Versions of the files each theme was compiled from, "game/" for the shared assets
+    index = {'themes': [], 'versions': {}, 'images': {}}
+    planes = []
+    offset = 0
+    for game, game_themes in themes.items():
+        shared = [(asset_key(game, None, name), Image.open(os.path.join(game, 'assets', name)).convert('RGBA'))
+                  for name in THEME_ASSETS[game]['shared']]
+        index['versions'][f"{game}/"] = theme_version(game)
+        for theme in game_themes:
+            index['themes'].append(f"{game}/{theme}")
+            index['versions'][f"{game}/{theme}"] = theme_version(game, theme)
+        for key, img in shared + [i for theme in game_themes for i in _theme_images(game, theme)]:
+            data = img.tobytes()
+            index['images'][key] = [offset, img.size[0], img.size[1]]
+            planes.append(data)
+            offset += len(data) + (-len(data) % ALIGN)
+
+    index_data = json.dumps(index).encode('utf-8')
+    data_start = HEADER.size + len(index_data)
+    data_start += -data_start % ALIGN
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(BUNDLE_MAGIC, BUNDLE_VERSION, len(index_data)))
+        f.write(index_data)
+        f.write(b'\0' * (data_start - f.tell()))
+        for data in planes:
+            f.write(data)
+            f.write(b'\0' * (-len(data) % ALIGN))
+    # Workers may have the old bundle mapped, so swap the file instead of writing over it
+    os.replace(tmp_path, path)
+
+
+class ThemeBundle:
+    """Read only, memory mapped view of a compiled theme bundle
+
+    The images handed out point straight at the mapped file, so they are shared
+    between every process that has the bundle open. Themes whose files changed
+    after the bundle was compiled are left out, they get decoded from disk.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            try:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                magic, version, index_len = HEADER.unpack_from(self._mmap, 0)
+            except (ValueError, struct.error):
+                raise BundleError(f"{path} is not a theme bundle")
+        if magic != BUNDLE_MAGIC or version != BUNDLE_VERSION:
+            raise BundleError(f"{path} is not a version {BUNDLE_VERSION} theme bundle")
+
+        try:
+            index = json.loads(self._mmap[HEADER.size:HEADER.size + index_len].decode('utf-8'))
+        except ValueError:
+            raise BundleError(f"{path} has a corrupt index")
+        self.themes = set(index['themes'])
+        self.stale = set()
+        for key, version in index['versions'].items():
+            game, theme = key.split('/', 1)
+            try:
+                if theme_version(game, theme or None) != version:
+                    self.stale.add(key)
+            except FileNotFoundError:
+                self.stale.add(key)
+        self._images = index['images']
+        self._data_start = HEADER.size + index_len
+        self._data_start += -self._data_start % ALIGN
+        self._view = memoryview(self._mmap)
+
+    def get(self, key):
+        try:
+            offset, width, height = self._images[key]
+        except KeyError:
+            return None
+        start = self._data_start + offset
+        plane = self._view[start:start + (width * height * 4)]
+        return Image.frombuffer('RGBA', (width, height), plane, 'raw', 'RGBA', 0, 1)
+
+    def image(self, game, theme, name):
+        if f"{game}/{theme or ''}" in self.stale:
+            return None
+        return self.get(asset_key(game, theme, name))
+
+    def resized(self, game, theme, name, size):
+        if f"{game}/{theme or ''}" in self.stale:
+            return None
+        return self.get(resized_key(game, theme, name, size))
+
+
+def load_bundle(path):
+    """Map a bundle if it has been compiled, themes will be decoded from disk otherwise"""
+    if path and os.path.exists(path):
+        try:
+            return ThemeBundle(path)
+        except BundleError:
+            logger.exception("Not using the theme bundle, run compile_themes.py to rebuild it")
+    return None
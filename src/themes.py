@@ -0,0 +1,163 @@
+import os
+import csv
+import time
+import signal
+import logging
+import threading
+import collections
+
+import storage
+from assets import asset_cache
+from render_service import render_service
+from theme_bundle import validate_theme, theme_version
+
+logger = logging.getLogger(__name__)
+
+# version changes with the theme's files, it goes into the render cache keys of its images
+Theme = collections.namedtuple('Theme', ['game', 'name', 'about', 'colors', 'version'])
+
+
+class ThemeRegistry:
+    """Every valid theme, read from the asset folders once per process
+
+    Slash commands look themes up here rather than walking the asset folders.
+    Themes are loaded again on SIGHUP, or when a file in the asset folders
+    changes, checked at most every `check_interval` seconds (0 to only reload
+    on the signal). Themes that fail validation are logged and left out.
+    """
+
+    def __init__(self, games=('connect4', 'mastermind'), check_interval=30):
+        self.games = games
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        # game -> {theme name: Theme}
+        self._themes = {}
+        # game -> themes command blocks, built the first time they are asked for
+        self._sample_blocks = {}
+        self._signature = None
+        self._checked = 0
+        self._reload_requested = False
+        self.loads = 0
+        self.invalid = []
+
+    def _assets_signature(self):
+        """mtime of every file and folder under the asset folders"""
+        signature = []
+        for game in self.games:
+            for root, dirs, files in os.walk(os.path.join(game, 'assets')):
+                dirs.sort()
+                for name in [root] + sorted(os.path.join(root, f) for f in files):
+                    try:
+                        signature.append((name, os.stat(name).st_mtime_ns))
+                    except FileNotFoundError:
+                        pass
+        return signature
+
+    def _load_theme(self, game, name):
+        theme_dir = os.path.join(game, 'assets', name)
+        try:
+            with open(os.path.join(theme_dir, 'about.txt'), 'r') as f:
+                about = f.read().strip()
+        except FileNotFoundError:
+            about = ''
+
+        colors = []
+        if game == 'mastermind':
+            with open(os.path.join(theme_dir, 'colors.csv'), 'r') as f:
+                colors = [(row[0].strip(), row[1].strip()) for row in csv.reader(f) if row]
+        return Theme(game, name, about, colors, theme_version(game, name))
+
+    def load(self):
+        signature = self._assets_signature()
+        themes = {}
+        invalid = []
+        for game in self.games:
+            themes[game] = {}
+            for name in sorted(next(os.walk(os.path.join(game, 'assets')))[1]):
+                errors = validate_theme(game, name)
+                if errors:
+                    logger.error("Skipping invalid theme", extra={'game': game, 'theme': name, 'errors': errors})
+                    invalid.append(f"{game}/{name}")
+                    continue
+                themes[game][name] = self._load_theme(game, name)
+
+        with self._lock:
+            reloaded = self._signature is not None
+            self._themes = themes
+            self._sample_blocks = {}
+            self._signature = signature
+            self._checked = time.monotonic()
+            self.invalid = invalid
+            self.loads += 1
+        if reloaded:
+            # Do not keep drawing with the old images, from the cache, the bundle or the render processes
+            asset_cache.reload()
+            render_service.restart()
+
+    def request_reload(self, signum=None, frame=None):
+        """Signal handler, the themes are loaded again on the next lookup"""
+        self._reload_requested = True
+
+    def install_signal_handler(self, signum=signal.SIGHUP):
+        # Signal handlers can only be set from the main thread
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signum, self.request_reload)
+
+    def _check(self):
+        with self._lock:
+            now = time.monotonic()
+            stale = self._signature is None or self._reload_requested
+            if not stale and self.check_interval > 0 and now - self._checked >= self.check_interval:
+                self._checked = now
+                stale = self._assets_signature() != self._signature
+            self._reload_requested = False
+        if stale:
+            self.load()
+
+    def themes(self, game):
+        self._check()
+        return self._themes[game]
+
+    def get_theme_list(self, game):
+        return list(self.themes(game))
+
+    def get(self, game, name):
+        """The Theme, None if the game has no valid theme by that name"""
+        return self.themes(game).get(name)
+
+    def version(self, game, name):
+        """The themes version, None if the game has no valid theme by that name"""
+        theme = self.get(game, name)
+        return theme.version if theme else None
+
+    def sample_blocks(self, game):
+        """Blocks listing the game's themes for its `themes` command"""
+        themes = self.themes(game)
+        with self._lock:
+            if game not in self._sample_blocks:
+                self._sample_blocks[game] = [{
+                    "type": "section",
+                    "text": {
+                        "type": "mrkdwn",
+                        "text": f"Theme: *{theme.name}*\n{theme.about[:200]}"
+                    },
+                    "accessory": {
+                        "type": "image",
+                        "image_url": storage.get_url(os.environ['RENDERED_IMAGES_BUCKET'],
+                                                     f"{game}/themes/sample-{theme.name}.png"),
+                        "alt_text": theme.name
+                    }
+                } for theme in themes.values()]
+            return self._sample_blocks[game]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'themes': {game: len(themes) for game, themes in self._themes.items()},
+                'invalid': list(self.invalid),
+                'loads': self.loads,
+                'check_interval': self.check_interval,
+            }
+
+
+theme_registry = ThemeRegistry(check_interval=float(os.getenv('THEME_RELOAD_INTERVAL', 30)))
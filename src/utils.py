@@ -1,11 +1,13 @@
+import io
 import os
 import sys
-import boto3
 import redis
+import storage
 import os.path
 import logging
 import datetime
-import tempfile
+import mimetypes
+import threading
 import traceback
 from pythonjsonlogger import jsonlogger
 
@@ -42,20 +44,69 @@ def get_ts():
     return datetime.datetime.utcnow().isoformat() + 'Z'
 
 
-def save_render(board_img, board_name, ext='png'):
-    # TODO: Auto get content type using lib
-    content_type = {
-        'png': 'image/png',
-        'gif': 'image/gif',
-    }
+_buffers = threading.local()
+
+# Extension -> content type, for formats `mimetypes` does not know or gets wrong
+CONTENT_TYPES = {
+    'png': 'image/png',
+    'gif': 'image/gif',
+}
+# Magic bytes -> content type, checked before falling back to the extension
+IMAGE_SIGNATURES = {
+    b'\x89PNG\r\n\x1a\n': 'image/png',
+    b'GIF87a': 'image/gif',
+    b'GIF89a': 'image/gif',
+    b'\xff\xd8\xff': 'image/jpeg',
+}
+
+
+def content_type_from_data(file_key, data):
+    for signature, content_type in IMAGE_SIGNATURES.items():
+        if data[:len(signature)] == signature:
+            return content_type
+    return None
+
+
+def content_type_from_ext(file_key, data):
+    ext = file_key.rsplit('.', 1)[-1].lower()
+    return CONTENT_TYPES.get(ext) or mimetypes.guess_type(file_key)[0]
+
+
+# Called in order with (file_key, data) until one returns a content type
+content_type_detectors = [
+    content_type_from_data,
+    content_type_from_ext,
+]
+
+
+def get_content_type(file_key, data=b''):
+    for detector in content_type_detectors:
+        content_type = detector(file_key, data)
+        if content_type:
+            return content_type
+    return 'application/octet-stream'
+
+
+def encode_image(img, ext='png'):
+    # Reuse a buffer per thread so it does not have to keep growing from empty
+    try:
+        buf = _buffers.buf
+    except AttributeError:
+        buf = _buffers.buf = io.BytesIO()
+    buf.seek(0)
+    buf.truncate()
+    img.save(buf, format=ext)
+    return buf.getvalue()
+
+
+def upload_render(data, board_name, ext='png'):
     file_key = f"{board_name}.{ext}"
-    s3 = boto3.client('s3', endpoint_url=os.getenv('S3_ENDPOINT', None))
-    with tempfile.NamedTemporaryFile() as tmp:
-        # TODO: Need to make this dynamic in order to support multiple formats
-        board_img.save(tmp.name, format=ext)
-        s3.upload_file(tmp.name,
-                       os.environ['RENDERED_IMAGES_BUCKET'],
-                       file_key,
-                       ExtraArgs={'ContentType': content_type[ext]})
-
-    return f"{os.getenv('S3_ENDPOINT', 'https://s3.amazonaws.com')}/{os.environ['RENDERED_IMAGES_BUCKET']}/{file_key}"
+    return storage.put(os.environ['RENDERED_IMAGES_BUCKET'], file_key, data, get_content_type(file_key, data))
+
+
+def get_file_key(url):
+    return storage.get_key(os.environ['RENDERED_IMAGES_BUCKET'], url)
+
+
+def save_render(board_img, board_name, ext='png'):
+    return upload_render(encode_image(board_img, ext=ext), board_name, ext=ext)